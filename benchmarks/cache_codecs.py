@@ -0,0 +1,101 @@
+"""
+Micro-benchmark of the CacheService codecs on TrackingOrder-like payloads.
+
+RUN:
+    python -m benchmarks.cache_codecs [--orders 1000] [--restaurants 3]
+
+The legacy row is the format used before codecs: JSON string pickled by the Django Redis backend.
+"""
+
+import argparse
+import json
+import os
+import pickle
+import random
+import time
+import uuid
+from dataclasses import asdict
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
+django.setup()
+
+from django.core.exceptions import ImproperlyConfigured  # noqa: E402
+
+from food.enums import OrderStatus  # noqa: E402
+from food.tracking import TrackingOrder  # noqa: E402
+from shared import codecs  # noqa: E402
+
+
+def build_payloads(orders: int, restaurants: int) -> list[dict]:
+    results = []
+
+    for _ in range(orders):
+        tracking_order = TrackingOrder(
+            restaurants={
+                str(restaurant_id): {
+                    "status": random.choice([OrderStatus.NOT_STARTED, OrderStatus.COOKING, OrderStatus.COOKED]),
+                    "external_id": str(uuid.uuid4()),
+                }
+                for restaurant_id in range(1, restaurants + 1)
+            },
+            delivery={
+                "status": OrderStatus.DELIVERY,
+                "location": [random.random(), random.random()],
+            },
+        )
+        results.append(asdict(tracking_order))
+
+    return results
+
+
+def measure(name: str, encode, decode, payloads: list[dict]) -> None:
+    started = time.perf_counter()
+    encoded = [encode(payload) for payload in payloads]
+    encode_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for item in encoded:
+        decode(item)
+    decode_time = time.perf_counter() - started
+
+    size = sum(len(item) for item in encoded) / len(encoded)
+    per_item = 1_000_000 / len(payloads)
+
+    print(
+        f"{name:<10} "
+        f"encode {encode_time * per_item:>8.2f} µs  "
+        f"decode {decode_time * per_item:>8.2f} µs  "
+        f"size {size:>7.1f} B"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--orders", type=int, default=10_000)
+    parser.add_argument("--restaurants", type=int, default=3)
+    args = parser.parse_args()
+
+    payloads = build_payloads(args.orders, args.restaurants)
+    print(f"{args.orders} TrackingOrder payloads, {args.restaurants} restaurants each\n")
+
+    measure(
+        "legacy",
+        lambda value: pickle.dumps(json.dumps(value), pickle.HIGHEST_PROTOCOL),
+        codecs.decode,
+        payloads,
+    )
+
+    for name in codecs.CODECS:
+        try:
+            codec = codecs.get_codec(name)
+        except ImproperlyConfigured as error:
+            print(f"{name:<10} skipped: {error}")
+            continue
+
+        measure(name, lambda value: codecs.encode(codec, value), codecs.decode, payloads)
+
+
+if __name__ == "__main__":
+    main()
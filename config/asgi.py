@@ -2,15 +2,23 @@
 ASGI config for config project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Live tracking streams of orders are served next to Django, see `food.asgi`.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
 
 import os
+from typing import cast
 
+from asgiref.typing import ASGI3Application
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from food.asgi import with_tracking_stream  # noqa: E402  models are imported after the setup
+
+# the handler annotates the scope as a plain dict
+application = with_tracking_stream(cast(ASGI3Application, django_application))
@@ -1,11 +1,26 @@
 import os
 
-from celery import Celery
+from celery import Celery, signals
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
 
 
 app = Celery("config")
 app.config_from_object("django.conf:settings", namespace="CELERY")
-app.conf.update(task_serializer="pickle")
 app.autodiscover_tasks()
+
+
+# metrics and pools are per process, see `shared.metrics`
+@signals.task_postrun.connect
+def log_process_stats(**kwargs):
+    from shared.metrics import log_stats  # Django is not set up when the Celery app is imported
+
+    log_stats()
+
+
+@signals.worker_process_shutdown.connect
+@signals.worker_shutdown.connect
+def close_http_clients(**kwargs):
+    from shared.http_clients import close_clients
+
+    close_clients()
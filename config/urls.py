@@ -3,13 +3,14 @@ from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import include, path
 
-from food.views import import_dishes, kfc_webhook
+from food.views import import_dishes, import_dishes_status, kfc_webhook
 from food.views import router as food_router
 from food.views import uklon_webhook
 from users.views import router as users_router
 
 urlpatterns = [
     path("admin/food/dish/import-dishes/", import_dishes, name="import_dishes"),
+    path("admin/food/dish/import-dishes/<str:job_id>/", import_dishes_status, name="import_dishes_status"),
     path("admin/", admin.site.urls),
     path("users/", include(users_router.urls)),
     path("food/", include(food_router.urls)),
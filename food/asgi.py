@@ -0,0 +1,143 @@
+"""
+ASGI endpoints of the food app, served next to Django by `config.asgi`.
+
+HTTP GET /food/orders/17/stream/?token=<access token>
+    Server-Sent Events of the order, for its customer or an admin:
+        event: snapshot  // the whole TrackingOrder, also sent again when updates are missed
+        data: {"restaurants": {...}, "delivery": {...}, "status": "cooking"}
+
+        event: update  // the changed part of the TrackingOrder
+        data: {"delivery": {"location": [50.45, 30.52]}}
+
+The token is passed in the query, as `EventSource` can not send headers.
+
+Provider pools of the process are closed on the lifespan shutdown, which Django does not handle.
+"""
+
+import asyncio
+import re
+from dataclasses import asdict
+from typing import Any, cast
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from asgiref.typing import ASGI3Application, ASGIReceiveCallable, ASGISendCallable, HTTPScope, Scope
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken, Token
+
+from shared.http_clients import aclose_clients, close_clients
+from users.models import Role, User
+
+from .models import Order
+from .streams import RESYNC, hub, sse_event
+from .tracking import TrackingOrderStore
+
+STREAM_PATH = re.compile(r"^/food/orders/(?P<order_id>\d+)/stream/?$")
+HEARTBEAT_INTERVAL = 15.0  # seconds, keeps proxies from closing idle streams
+
+
+async def _respond(
+    send: ASGISendCallable,
+    status: int,
+    body: bytes = b"",
+    headers: list[tuple[bytes, bytes]] | None = None,
+    more_body: bool = False,
+) -> None:
+    await send({"type": "http.response.start", "status": status, "headers": headers or [], "trailers": False})
+    await send({"type": "http.response.body", "body": body, "more_body": more_body})
+
+
+async def _authorize(scope: HTTPScope, order_id: int) -> int:
+    """Return the HTTP status: `200` if the user of the token may watch the order."""
+
+    query = parse_qs(scope.get("query_string", b"").decode())
+
+    try:
+        # the encoded token is annotated as `Token` by simplejwt
+        token = AccessToken(cast(Token, query.get("token", [""])[0]))
+    except TokenError:
+        return 401
+
+    user = await User.objects.filter(id=token[api_settings.USER_ID_CLAIM], is_active=True).afirst()
+    if user is None:
+        return 401
+
+    order_user_id = await Order.objects.filter(id=order_id).values_list("user_id", flat=True).afirst()
+    if order_user_id is None:
+        return 404
+
+    return 200 if user.role == Role.ADMIN or user.pk == order_user_id else 403
+
+
+async def _snapshot(order_id: int) -> bytes:
+    tracking_order = await sync_to_async(TrackingOrderStore().get)(order_id)
+    return sse_event("snapshot", asdict(tracking_order) if tracking_order is not None else {})
+
+
+async def tracking_stream(
+    scope: HTTPScope, receive: ASGIReceiveCallable, send: ASGISendCallable, order_id: int
+) -> None:
+    status = await _authorize(scope, order_id)
+    if status != 200:
+        await _respond(send, status)
+        return
+
+    headers = [(b"content-type", b"text/event-stream"), (b"cache-control", b"no-cache"), (b"x-accel-buffering", b"no")]
+
+    async with hub.subscribe(order_id) as queue:
+        # subscribed before the snapshot, so updates made while it is read are not lost
+        await _respond(send, 200, await _snapshot(order_id), headers=headers, more_body=True)
+
+        disconnected = asyncio.ensure_future(_wait_disconnect(receive))
+
+        try:
+            while not disconnected.done():
+                next_event = asyncio.ensure_future(queue.get())
+                await asyncio.wait(
+                    {next_event, disconnected}, timeout=HEARTBEAT_INTERVAL, return_when="FIRST_COMPLETED"
+                )
+
+                if not next_event.done():
+                    next_event.cancel()
+                    body = b": heartbeat\n\n"
+                else:
+                    event: Any = next_event.result()
+                    body = await _snapshot(order_id) if event is RESYNC else event
+
+                if not disconnected.done():
+                    await send({"type": "http.response.body", "body": body, "more_body": True})
+        finally:
+            disconnected.cancel()
+
+
+async def _wait_disconnect(receive: ASGIReceiveCallable) -> None:
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+async def lifespan(receive: ASGIReceiveCallable, send: ASGISendCallable) -> None:
+    while True:
+        message = await receive()
+
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await aclose_clients()
+            await asyncio.to_thread(close_clients)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+def with_tracking_stream(application: ASGI3Application) -> ASGI3Application:
+    """Serve tracking streams and lifespan events, pass other requests to the application."""
+
+    async def router(scope: Scope, receive: ASGIReceiveCallable, send: ASGISendCallable) -> None:
+        if scope["type"] == "http" and (match := STREAM_PATH.match(scope["path"])):
+            await tracking_stream(scope, receive, send, int(match["order_id"]))
+        elif scope["type"] == "lifespan":
+            await lifespan(receive, send)
+        else:
+            await application(scope, receive, send)
+
+    return router
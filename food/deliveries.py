@@ -0,0 +1,119 @@
+"""
+Consolidation of Uklon deliveries.
+
+Cooked orders wait for the delivery up to `DELIVERY_WINDOW` seconds, so orders
+with the same ETA and the same pickup addresses are delivered by one multi-stop
+Uklon order. `consolidate_deliveries` (Celery beat) takes groups whose oldest
+order waited the window, or which are full, and younger orders of the same
+group go with them.
+
+The Uklon order is mapped to all its orders in the CacheService:
+    uklon_orders:<external_id>  {"internal_order_ids": [17, 18]}
+Mappings of single orders created before are `{"internal_order_id": 17}`.
+
+REDIS STRUCTURE:
+    deliveries:pending  ZSET  {order_id: cooked at (timestamp)}
+"""
+
+import time
+from dataclasses import dataclass, field
+from typing import Iterable, cast
+
+from shared.cache import get_redis_client
+
+from .models import OrderItem
+
+DELIVERY_WINDOW = 20.0  # seconds
+MAX_ORDERS_PER_DELIVERY = 5
+
+
+def uklon_order_ids(uklon_cache_order: dict) -> list[int]:
+    """Internal orders of the Uklon order mapping, in both formats."""
+
+    if "internal_order_ids" in uklon_cache_order:
+        return uklon_cache_order["internal_order_ids"]
+    return [uklon_cache_order["internal_order_id"]]
+
+
+@dataclass
+class DeliveryGroup:
+    eta: str
+    pickups: tuple[tuple[str, str], ...]  # (restaurant name, address)
+    order_ids: list[int] = field(default_factory=list)
+    cooked_at: float = 0.0  # of the oldest order
+
+
+def pickups_of(order_ids: list[int]) -> dict[int, tuple[str, tuple[tuple[str, str], ...]]]:
+    """ETA and pickup addresses of orders with a single query."""
+
+    rows = (
+        OrderItem.objects.filter(order_id__in=order_ids)
+        .values_list("order_id", "order__eta", "dish__restaurant__name", "dish__restaurant__address")
+        .distinct()
+    )
+
+    orders: dict[int, tuple[str, set[tuple[str, str]]]] = {}
+    for order_id, eta, name, address in rows:
+        orders.setdefault(order_id, (eta.isoformat(), set()))[1].add((name, address))
+
+    return {order_id: (eta, tuple(sorted(pickups))) for order_id, (eta, pickups) in orders.items()}
+
+
+def group_orders(pending: dict[int, float]) -> list[DeliveryGroup]:
+    """Group orders by the ETA and pickup addresses, at most `MAX_ORDERS_PER_DELIVERY` in each."""
+
+    groups: dict[tuple, list[DeliveryGroup]] = {}
+
+    for order_id, (eta, pickups) in sorted(pickups_of(list(pending)).items(), key=lambda item: pending[item[0]]):
+        chunks = groups.setdefault((eta, pickups), [])
+        if not chunks or len(chunks[-1].order_ids) >= MAX_ORDERS_PER_DELIVERY:
+            chunks.append(DeliveryGroup(eta=eta, pickups=pickups, cooked_at=pending[order_id]))
+        chunks[-1].order_ids.append(order_id)
+
+    return [group for chunks in groups.values() for group in chunks]
+
+
+class DeliveryWindow:
+    KEY = "deliveries:pending"
+
+    def __init__(self):
+        self.redis = get_redis_client()
+
+    def add(self, order_id: int) -> None:
+        self.redis.zadd(self.KEY, {str(order_id): time.time()}, nx=True)
+
+    def restore(self, groups: Iterable[DeliveryGroup]) -> None:
+        """Return taken groups which are not delivered, so they are due at the next run."""
+
+        orders = {str(order_id): group.cooked_at for group in groups for order_id in group.order_ids}
+        if orders:
+            self.redis.zadd(self.KEY, orders, nx=True)
+
+    def take_due(self) -> list[DeliveryGroup]:
+        """Remove groups which should be delivered now from the window.
+
+        Each order is taken by one caller only, so concurrent runs do not deliver it twice.
+        """
+
+        entries = cast(list[tuple[bytes, float]], self.redis.zrange(self.KEY, 0, -1, withscores=True))
+        pending = {int(order_id): cooked_at for order_id, cooked_at in entries}
+        if not pending:
+            return []
+
+        groups = group_orders(pending)
+        deadline = time.time() - DELIVERY_WINDOW
+        due = [
+            group for group in groups if group.cooked_at <= deadline or len(group.order_ids) >= MAX_ORDERS_PER_DELIVERY
+        ]
+        # deleted orders have no items to deliver
+        deleted = pending.keys() - {order_id for group in groups for order_id in group.order_ids}
+
+        pipe = self.redis.pipeline(transaction=False)
+        for order_id in [order_id for group in due for order_id in group.order_ids] + list(deleted):
+            pipe.zrem(self.KEY, str(order_id))
+        removed = iter(pipe.execute())
+
+        for group in due:
+            group.order_ids = [order_id for order_id in group.order_ids if next(removed)]
+
+        return [group for group in due if group.order_ids]
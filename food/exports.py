@@ -0,0 +1,125 @@
+"""
+Streaming export of orders and their items for reporting.
+
+Rows are read with a server-side cursor (`QuerySet.iterator`) and written to the
+response as they come, so the memory does not depend on the number of orders.
+Under ASGI the stream is read with `async_stream`, as `StreamingHttpResponse`
+reads sync iterators to the end before sending them.
+
+CSV: one row per order item, order columns are repeated.
+NDJSON: one line per order, items are nested:
+    {"id": 17, "status": "delivered", "eta": "2025-07-14", ..., "items": [{"restaurant": "silpo", ...}]}
+"""
+
+import csv
+import itertools
+from operator import itemgetter
+from typing import AsyncIterator, Iterable, Iterator
+
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import QuerySet
+
+from .models import Order, OrderItem
+
+EXPORT_CHUNK_SIZE = 2000  # rows fetched from the cursor at once
+STREAM_BUFFER_SIZE = 64 * 1024  # chars sent to the client at once
+
+ORDER_COLUMNS = ("order_id", "status", "eta", "delivery_provider", "total", "user_id")
+ITEM_COLUMNS = ("restaurant", "dish", "price", "quantity")
+
+_json_encoder = DjangoJSONEncoder(separators=(",", ":"))
+
+
+class _Echo:
+    """File-like object for `csv.writer` which returns the row instead of writing it."""
+
+    def write(self, value: str) -> str:
+        return value
+
+
+def export_rows(orders: QuerySet[Order]) -> Iterator[tuple]:
+    """Iterate over items of the orders, ordered by the order.
+
+    Orders without items are not exported.
+    """
+
+    return (
+        OrderItem.objects.filter(order__in=orders)
+        .order_by("order_id", "id")
+        .values_list(
+            "order_id",
+            "order__status",
+            "order__eta",
+            "order__delivery_provider",
+            "order__total",
+            "order__user_id",
+            "dish__restaurant__name",
+            "dish__name",
+            "dish__price",
+            "quantity",
+        )
+        .iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    )
+
+
+def _buffered(chunks: Iterable[str]) -> Iterator[str]:
+    """Join small chunks, so the response is not sent row by row."""
+
+    buffer: list[str] = []
+    size = 0
+
+    for chunk in chunks:
+        buffer.append(chunk)
+        size += len(chunk)
+
+        if size >= STREAM_BUFFER_SIZE:
+            yield "".join(buffer)
+            buffer, size = [], 0
+
+    if buffer:
+        yield "".join(buffer)
+
+
+def csv_stream(rows: Iterable[tuple]) -> Iterator[str]:
+    writer = csv.writer(_Echo())
+
+    return _buffered(
+        itertools.chain(
+            [writer.writerow(ORDER_COLUMNS + ITEM_COLUMNS)],
+            (writer.writerow(row) for row in rows),
+        )
+    )
+
+
+def ndjson_stream(rows: Iterable[tuple]) -> Iterator[str]:
+    def lines() -> Iterator[str]:
+        orders_columns = len(ORDER_COLUMNS)
+
+        # rows are ordered by the order, so only one order is kept in memory
+        for order, items in itertools.groupby(rows, key=itemgetter(slice(0, orders_columns))):
+            payload = dict(zip(("id",) + ORDER_COLUMNS[1:], order))
+            payload["items"] = [dict(zip(ITEM_COLUMNS, item[orders_columns:])) for item in items]
+
+            yield _json_encoder.encode(payload) + "\n"
+
+    return _buffered(lines())
+
+
+async def async_stream(chunks: Iterator[str]) -> AsyncIterator[str]:
+    """Read chunks of the sync stream one by one, in the thread of sync code.
+
+    The cursor is used in the same thread as its database connection (`thread_sensitive`).
+    """
+
+    def read() -> str | None:
+        return next(chunks, None)
+
+    while (chunk := await sync_to_async(read)()) is not None:
+        yield chunk
+
+
+EXPORT_FORMATS = {
+    "csv": ("text/csv", csv_stream),
+    "ndjson": ("application/x-ndjson", ndjson_stream),
+}
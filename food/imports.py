@@ -0,0 +1,195 @@
+"""
+Bulk import of dishes from CSV.
+
+CSV FORMAT:
+    name,price,restaurant
+    Salad,100,silpo
+
+The file is read row by row. Restaurants are resolved once per name and
+dishes are upserted by `(restaurant, name)` in batches, so the number of
+queries depends on the number of batches, not rows.
+
+Uploads from the admin are imported by the `import_dishes_file` task.
+Its progress is kept in the CacheService:
+    dish_imports:<job_id>  {"status": "running", "processed": 4000, "inserted": 3990, ..., "errors": [...]}
+"""
+
+import csv
+import enum
+import io
+import uuid
+from dataclasses import asdict, dataclass, field
+from typing import IO, Callable, Iterable
+
+from django.db import transaction
+
+from shared.cache import CacheService
+
+from .models import Dish, Restaurant
+
+IMPORT_BATCH_SIZE = 2000
+MAX_REPORTED_ERRORS = 100
+IMPORT_JOB_TTL = 86400
+
+
+class ImportStatus(enum.StrEnum):
+    QUEUED = enum.auto()
+    RUNNING = enum.auto()
+    FINISHED = enum.auto()
+    FAILED = enum.auto()
+
+
+@dataclass
+class ImportReport:
+    processed: int = 0  # rows read from the file
+    inserted: int = 0
+    updated: int = 0
+    skipped: int = 0
+    errors: list[str] = field(default_factory=list)
+
+    def skip(self, line: int, reason: str) -> None:
+        self.skipped += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(f"Line {line}: {reason}")
+
+    def __str__(self) -> str:
+        return f"{self.inserted} dishes inserted, {self.updated} updated, {self.skipped} skipped"
+
+
+class RestaurantLookup:
+    """Resolve restaurants by the name from CSV with a single query.
+
+    The name matches case-insensitively, exactly or as a part of the restaurant name.
+    """
+
+    def __init__(self):
+        self._restaurants: list[Restaurant] = list(Restaurant.objects.order_by("id"))
+        self._cache: dict[str, Restaurant | None] = {}
+
+    def get(self, name: str) -> Restaurant | None:
+        key = name.strip().lower()
+
+        if key not in self._cache:
+            exact = [restaurant for restaurant in self._restaurants if restaurant.name.lower() == key]
+            partial = [restaurant for restaurant in self._restaurants if key and key in restaurant.name.lower()]
+            self._cache[key] = next(iter(exact or partial), None)
+
+        return self._cache[key]
+
+
+def _parse_row(row: dict, restaurants: RestaurantLookup) -> Dish:
+    name = (row.get("name") or "").strip()
+    max_length = Dish._meta.get_field("name").max_length
+    if not name or (max_length is not None and len(name) > max_length):
+        raise ValueError(f"Invalid dish name {name!r}")
+
+    try:
+        price = int(row.get("price") or "")
+    except ValueError:
+        raise ValueError(f"Invalid price {row.get('price')!r}")
+    if price < 0:
+        raise ValueError(f"Negative price {price}")
+
+    restaurant = restaurants.get(row.get("restaurant") or "")
+    if restaurant is None:
+        raise ValueError(f"Restaurant {row.get('restaurant')!r} does not exist")
+
+    return Dish(name=name, price=price, restaurant=restaurant)
+
+
+def _upsert(batch: dict[tuple[int, str], Dish], report: ImportReport) -> None:
+    existing = set(
+        Dish.objects.filter(
+            restaurant_id__in={restaurant_id for restaurant_id, _ in batch},
+            name__in={name for _, name in batch},
+        ).values_list("restaurant_id", "name")
+    )
+
+    Dish.objects.bulk_create(
+        batch.values(),
+        update_conflicts=True,
+        unique_fields=["restaurant", "name"],
+        update_fields=["price"],
+    )
+
+    updated = len(existing & batch.keys())
+    report.updated += updated
+    report.inserted += len(batch) - updated
+
+
+def import_dishes(
+    rows: Iterable[dict],
+    batch_size: int = IMPORT_BATCH_SIZE,
+    progress: Callable[[ImportReport], None] | None = None,
+) -> ImportReport:
+    """Upsert dishes from CSV rows in one transaction. `progress` is called after each batch."""
+
+    report = ImportReport()
+    restaurants = RestaurantLookup()
+    batch: dict[tuple[int, str], Dish] = {}
+
+    with transaction.atomic():
+        for line, row in enumerate(rows, start=2):  # the first line is the header
+            report.processed += 1
+
+            try:
+                dish = _parse_row(row, restaurants)
+            except ValueError as error:
+                report.skip(line, str(error))
+                continue
+
+            key = (dish.restaurant.pk, dish.name)
+            if key in batch:
+                report.updated += 1  # the same dish in the file again, the last row wins
+
+            batch[key] = dish
+
+            if len(batch) >= batch_size:
+                _upsert(batch, report)
+                batch = {}
+
+                if progress is not None:
+                    progress(report)
+
+        if batch:
+            _upsert(batch, report)
+
+    print(f"Dishes import finished: {report}")
+
+    return report
+
+
+def import_dishes_csv(
+    file: IO[bytes],
+    batch_size: int = IMPORT_BATCH_SIZE,
+    progress: Callable[[ImportReport], None] | None = None,
+) -> ImportReport:
+    """Decode and parse the binary file lazily, without reading it into memory."""
+
+    text = io.TextIOWrapper(file, encoding="utf-8-sig", newline="")
+
+    try:
+        return import_dishes(csv.DictReader(text), batch_size=batch_size, progress=progress)
+    finally:
+        text.detach()  # the file is closed by the caller
+
+
+class ImportJobs:
+    """Progress of background imports, polled by the admin page."""
+
+    NAMESPACE = "dish_imports"
+
+    def __init__(self):
+        self.cache = CacheService()
+
+    def create(self) -> str:
+        job_id = uuid.uuid4().hex
+        self.update(job_id, ImportStatus.QUEUED, ImportReport())
+        return job_id
+
+    def update(self, job_id: str, status: ImportStatus, report: ImportReport, error: str | None = None) -> None:
+        value = {"status": status, "error": error} | asdict(report)
+        self.cache.set(self.NAMESPACE, job_id, value, ttl=IMPORT_JOB_TTL)
+
+    def get(self, job_id: str) -> dict | None:
+        return self.cache.get(self.NAMESPACE, job_id)
@@ -0,0 +1,88 @@
+"""
+Delivery locations, kept apart from the TrackingOrder hash.
+
+Drivers send many location pings per leg. Each ping only overwrites the latest
+point, and the history gets at most one point in `LOCATION_HISTORY_INTERVAL`,
+so frequent pings do not rewrite tracking orders or touch the database.
+Each point is published to live streams of its orders, see `food.streams`.
+
+REDIS STRUCTURE:
+    locations:17           STR   [lat, lng, timestamp]  the latest point
+    locations:17:history   LIST  recent points, newest first, at most `LOCATION_HISTORY_SIZE`
+    locations:17:throttle  STR   exists while the history is not updated
+"""
+
+import json
+import time
+from typing import Iterable, cast
+
+from redis.client import Pipeline
+
+from shared.cache import CacheService, get_redis_client
+
+from .deliveries import uklon_order_ids
+from .streams import TRACKING_CHANNEL, tracking_message
+
+LOCATION_HISTORY_SIZE = 50
+LOCATION_HISTORY_INTERVAL = 5.0  # seconds
+LOCATION_TTL = 86400
+
+# KEYS: latest, history, throttle. ARGV: point, history interval (ms), history size, ttl
+RECORD_LOCATION_SCRIPT = """
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[4])
+if redis.call('SET', KEYS[3], 1, 'NX', 'PX', ARGV[2]) then
+    redis.call('LPUSH', KEYS[2], ARGV[1])
+    redis.call('LTRIM', KEYS[2], 0, ARGV[3] - 1)
+    redis.call('EXPIRE', KEYS[2], ARGV[4])
+    return 1
+end
+return 0
+"""
+
+
+def location_key(order_id: int | str) -> str:
+    return f"locations:{order_id}"
+
+
+class LocationStore:
+    def __init__(self):
+        self.redis = get_redis_client()
+        self._record = self.redis.register_script(RECORD_LOCATION_SCRIPT)
+
+    def record(self, order_ids: Iterable[int], location: list[float], pipe: Pipeline | None = None) -> None:
+        """Save the point of orders delivered together, with the pipeline if it is passed."""
+
+        point = json.dumps([*location, round(time.time(), 3)])
+        _pipe = pipe if pipe is not None else self.redis.pipeline(transaction=False)
+
+        for order_id in order_ids:
+            key = location_key(order_id)
+            self._record(
+                keys=[key, f"{key}:history", f"{key}:throttle"],
+                args=[point, int(LOCATION_HISTORY_INTERVAL * 1000), LOCATION_HISTORY_SIZE, LOCATION_TTL],
+                client=_pipe,
+            )
+            _pipe.publish(TRACKING_CHANNEL, tracking_message(order_id, {"delivery": {"location": location[:2]}}))
+
+        if pipe is None:
+            _pipe.execute()
+
+    def latest(self, order_id: int | str) -> list[float] | None:
+        point = cast(bytes | None, self.redis.get(location_key(order_id)))
+        return json.loads(point) if point is not None else None
+
+    def history(self, order_id: int | str) -> list[list[float]]:
+        points = cast(list[bytes], self.redis.lrange(f"{location_key(order_id)}:history", 0, -1))
+        return [json.loads(point) for point in points]
+
+
+def record_uklon_location(external_id: str, location: list[float]) -> None:
+    """Save the location of all orders of the Uklon trip. Pings of unknown orders are ignored."""
+
+    uklon_cache_order = CacheService().get("uklon_orders", key=external_id)
+
+    if uklon_cache_order is None:
+        print(f"Location of the unknown Uklon order {external_id} is ignored")
+        return
+
+    LocationStore().record(uklon_order_ids(uklon_cache_order), location)
@@ -12,11 +12,13 @@ RESTAURANT_EXTERNAL_TO_INTERNAL: dict[str, dict[str, OrderStatus]] = {
         silpo.OrderStatus.NOT_STARTED: OrderStatus.NOT_STARTED,
         silpo.OrderStatus.COOKING: OrderStatus.COOKING,
         silpo.OrderStatus.COOKED: OrderStatus.COOKED,
+        silpo.OrderStatus.FINISHED: OrderStatus.COOKED,
     },
     "kfc": {
         kfc.OrderStatus.NOT_STARTED: OrderStatus.NOT_STARTED,
         kfc.OrderStatus.COOKING: OrderStatus.COOKING,
         kfc.OrderStatus.COOKED: OrderStatus.COOKED,
+        kfc.OrderStatus.FINISHED: OrderStatus.COOKED,
     },
 }
 
@@ -0,0 +1,140 @@
+"""
+Menu snapshot, materialized as JSON bytes for each menu version.
+
+The version is bumped after every committed change of dishes or restaurants
+(see `food.signals` and `food.services.import_dishes_file`), and the snapshot
+of the new version is materialized in the background. Responses are served
+from the bytes as is, without the ORM and DRF serializers.
+
+REDIS STRUCTURE:
+    menu:version          STR   bumped on changes, starts from the current time when lost
+    menu:v7               STR   `[{"id":1,"dishes":[...],"name":"silpo","address":"..."}, ...]`
+    menu:v7:restaurants   HASH  {restaurant_id: `{"id":1,"dishes":[...],...}`}
+    menu:lock:7           STR   only one process materializes the snapshot of the version
+"""
+
+import json
+import time
+from typing import cast
+
+from shared.cache import get_redis_client
+
+from .models import Dish, Restaurant
+
+MENU_TTL = 86400
+MENU_LOCK_TTL = 10
+REBUILD_WAIT = 5.0  # seconds to wait for the snapshot materialized by another process
+REBUILD_POLL_INTERVAL = 0.05
+
+# the same output as the DRF JSON renderer
+_json_encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+
+class MenuCache:
+    VERSION_KEY = "menu:version"
+
+    def __init__(self):
+        self.redis = get_redis_client()
+
+    @staticmethod
+    def _key(version: int) -> str:
+        return f"menu:v{version}"
+
+    @classmethod
+    def _restaurants_key(cls, version: int) -> str:
+        return f"{cls._key(version)}:restaurants"
+
+    def _pipeline(self):
+        pipe = self.redis.pipeline()
+        # a lost version starts from the current time, so ETags of old menus do not match
+        pipe.set(self.VERSION_KEY, time.time_ns() // 1_000_000, nx=True)
+        return pipe
+
+    def version(self) -> int:
+        pipe = self._pipeline()
+        pipe.get(self.VERSION_KEY)
+        return int(pipe.execute()[1])
+
+    def bump(self) -> int:
+        pipe = self._pipeline()
+        pipe.incr(self.VERSION_KEY)
+        return int(pipe.execute()[1])
+
+    @staticmethod
+    def etag(version: int) -> str:
+        return f'"menu-{version}"'
+
+    def get(self, version: int) -> bytes:
+        """Return the menu of all restaurants."""
+
+        menu = cast(bytes | None, self.redis.get(self._key(version)))
+        return menu if menu is not None else self.materialize(version)
+
+    def restaurant(self, version: int, restaurant_id: int) -> bytes | None:
+        """Return the menu of the restaurant or `None` if there is no such restaurant."""
+
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.exists(self._key(version))
+        pipe.hget(self._restaurants_key(version), str(restaurant_id))
+        materialized, menu = pipe.execute()
+
+        if not materialized:
+            self.materialize(version)
+            menu = self.redis.hget(self._restaurants_key(version), str(restaurant_id))
+
+        return menu
+
+    def materialize(self, version: int) -> bytes:
+        """Materialize the snapshot of the version. Only one caller builds it, others wait for it."""
+
+        lock = f"menu:lock:{version}"
+
+        if self.redis.set(lock, 1, nx=True, ex=MENU_LOCK_TTL):
+            try:
+                return self._build(version)
+            finally:
+                self.redis.delete(lock)
+
+        deadline = time.monotonic() + REBUILD_WAIT
+        while time.monotonic() < deadline:
+            time.sleep(REBUILD_POLL_INTERVAL)
+
+            menu = cast(bytes | None, self.redis.get(self._key(version)))
+            if menu is not None:
+                return menu
+
+        print(f"Menu v{version} is not materialized in {REBUILD_WAIT} seconds. Building it again")
+        return self._build(version)
+
+    def _build(self, version: int) -> bytes:
+        """Encode menus of all restaurants with two queries and store them at once."""
+
+        dishes: dict[int, list[dict]] = {}
+        for dish_id, name, price, restaurant_id in Dish.objects.order_by("id").values_list(
+            "id", "name", "price", "restaurant_id"
+        ):
+            dishes.setdefault(restaurant_id, []).append({"id": dish_id, "name": name, "price": price})
+
+        restaurants: dict[int, bytes] = {}
+        for restaurant in Restaurant.objects.order_by("id").values("id", "name", "address"):
+            payload = {
+                "id": restaurant["id"],
+                "dishes": dishes.get(restaurant["id"], []),
+                "name": restaurant["name"],
+                "address": restaurant["address"],
+            }
+            restaurants[restaurant["id"]] = _json_encoder.encode(payload).encode()
+
+        menu = b"[" + b",".join(restaurants.values()) + b"]"
+
+        pipe = self.redis.pipeline()
+        pipe.set(self._key(version), menu, ex=MENU_TTL)
+        pipe.delete(self._restaurants_key(version))
+        if restaurants:
+            pipe.hset(self._restaurants_key(version), mapping=restaurants)
+        pipe.expire(self._restaurants_key(version), MENU_TTL)
+        pipe.execute()
+
+        print(f"Menu v{version} is materialized: {len(restaurants)} restaurants, {len(menu)} bytes")
+
+        return menu
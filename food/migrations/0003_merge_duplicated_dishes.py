@@ -0,0 +1,34 @@
+# Generated by Django 5.2.3 on 2026-10-18 20:18
+
+from django.db import migrations, models
+
+
+def merge_duplicated_dishes(apps, schema_editor):
+    """Keep the first dish of each (restaurant, name) and move order items to it."""
+
+    Dish = apps.get_model("food", "Dish")
+    OrderItem = apps.get_model("food", "OrderItem")
+
+    duplicates = (
+        Dish.objects.values("restaurant_id", "name")
+        .annotate(first_id=models.Min("id"), count=models.Count("id"))
+        .filter(count__gt=1)
+    )
+
+    for duplicate in duplicates:
+        dishes = Dish.objects.filter(restaurant_id=duplicate["restaurant_id"], name=duplicate["name"]).exclude(
+            id=duplicate["first_id"]
+        )
+        OrderItem.objects.filter(dish__in=dishes).update(dish_id=duplicate["first_id"])
+        dishes.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("food", "0002_order_indexes"),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicated_dishes, migrations.RunPython.noop),
+    ]
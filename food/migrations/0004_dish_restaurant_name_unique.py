@@ -0,0 +1,17 @@
+# Generated by Django 5.2.3 on 2026-10-18 20:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("food", "0003_merge_duplicated_dishes"),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name="dish",
+            constraint=models.UniqueConstraint(fields=("restaurant", "name"), name="dishes_restaurant_name_unique"),
+        ),
+    ]
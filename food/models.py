@@ -1,4 +1,4 @@
-from typing import Iterable
+from typing import Iterable, NamedTuple
 
 from django.conf import settings
 from django.db import models
@@ -6,6 +6,19 @@ from django.db import models
 from .enums import OrderStatus
 
 
+class RestaurantRef(NamedTuple):
+    id: int
+    name: str
+
+
+class DispatchItem(NamedTuple):
+    """Materialized order item to be sent to the restaurant."""
+
+    dish: str
+    quantity: int
+    restaurant_id: int
+
+
 class Restaurant(models.Model):
     class Meta:
         db_table = "restaurants"
@@ -20,6 +33,10 @@ class Restaurant(models.Model):
 class Dish(models.Model):
     class Meta:
         db_table = "dishes"
+        # dishes are upserted by the name on import
+        constraints = [
+            models.UniqueConstraint(fields=["restaurant", "name"], name="dishes_restaurant_name_unique"),
+        ]
 
     name = models.CharField(max_length=255)
     price = models.IntegerField()
@@ -32,6 +49,13 @@ class Dish(models.Model):
 class Order(models.Model):
     class Meta:
         db_table = "orders"
+        # `all_orders` filters by one of the fields and pages over the id (keyset pagination)
+        indexes = [
+            models.Index(fields=["status", "-id"], name="orders_status_id_idx"),
+            models.Index(fields=["delivery_provider", "-id"], name="orders_provider_id_idx"),
+            models.Index(fields=["eta", "-id"], name="orders_eta_id_idx"),
+            models.Index(fields=["user", "-id"], name="orders_user_id_idx"),
+        ]
 
     status = models.CharField(max_length=50, choices=OrderStatus.choices(), default=OrderStatus.NOT_STARTED)
     delivery_provider = models.CharField(max_length=20, null=True, blank=True)
@@ -42,15 +66,23 @@ class Order(models.Model):
     def __str__(self) -> str:
         return f"[{self.pk}] {self.status} for {self.user.email}"
 
-    def items_by_restaurant(self):
-        results = {}
+    def items_by_restaurant(self) -> dict[RestaurantRef, list[DispatchItem]]:
+        """Group order items by restaurants with a single query."""
 
-        qs = self.items.select_related("dish__restaurant")
+        results: dict[RestaurantRef, list[DispatchItem]] = {}
 
-        restaurants = {item.dish.restaurant for item in qs}
+        rows = self.items.values_list(
+            "dish__restaurant_id",
+            "dish__restaurant__name",
+            "dish__name",
+            "quantity",
+        ).order_by("dish__restaurant_id", "id")
 
-        for restaurant in restaurants:
-            results[restaurant] = qs.filter(dish__restaurant=restaurant)
+        for restaurant_id, restaurant_name, dish_name, quantity in rows:
+            restaurant = RestaurantRef(id=restaurant_id, name=restaurant_name)
+            results.setdefault(restaurant, []).append(
+                DispatchItem(dish=dish_name, quantity=quantity, restaurant_id=restaurant_id)
+            )
 
         return results
 
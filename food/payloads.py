@@ -0,0 +1,82 @@
+"""
+Compact Celery messages for the restaurants dispatch.
+
+MESSAGE:
+    {
+        "v": 1,  // schema version
+        "order_id": 17,
+        "restaurants": [
+            {"id": 1, "name": "silpo", "items": [["Salad", 2], ["Soda", 1]]},
+            {"id": 2, "name": "kfc", "items": [["Wings", 3]]},
+        ]
+    }
+
+Messages are plain JSON, so workers do not run the items query again
+and the broker does not need the pickle serializer.
+"""
+
+from dataclasses import dataclass
+
+from .models import DispatchItem, RestaurantRef
+
+PAYLOAD_VERSION = 1
+
+
+@dataclass
+class RestaurantDispatch:
+    restaurant: RestaurantRef
+    items: list[DispatchItem]
+
+
+@dataclass
+class OrderDispatch:
+    order_id: int
+    restaurants: list[RestaurantDispatch]
+
+    @classmethod
+    def from_items(cls, order_id: int, items_by_restaurant: dict[RestaurantRef, list[DispatchItem]]):
+        return cls(
+            order_id=order_id,
+            restaurants=[
+                RestaurantDispatch(restaurant=restaurant, items=items)
+                for restaurant, items in items_by_restaurant.items()
+            ],
+        )
+
+    def only(self, restaurant: RestaurantRef) -> "OrderDispatch":
+        """Return the dispatch of a single restaurant."""
+
+        return OrderDispatch(
+            order_id=self.order_id,
+            restaurants=[dispatch for dispatch in self.restaurants if dispatch.restaurant == restaurant],
+        )
+
+    def to_message(self) -> dict:
+        return {
+            "v": PAYLOAD_VERSION,
+            "order_id": self.order_id,
+            "restaurants": [
+                {
+                    "id": dispatch.restaurant.id,
+                    "name": dispatch.restaurant.name,
+                    "items": [[item.dish, item.quantity] for item in dispatch.items],
+                }
+                for dispatch in self.restaurants
+            ],
+        }
+
+    @classmethod
+    def from_message(cls, message: dict) -> "OrderDispatch":
+        if message.get("v") != PAYLOAD_VERSION:
+            raise ValueError(f"Unsupported dispatch message version: {message.get('v')}")
+
+        restaurants: list[RestaurantDispatch] = []
+        for payload in message["restaurants"]:
+            restaurant = RestaurantRef(id=payload["id"], name=payload["name"])
+            items = [
+                DispatchItem(dish=dish, quantity=quantity, restaurant_id=restaurant.id)
+                for dish, quantity in payload["items"]
+            ]
+            restaurants.append(RestaurantDispatch(restaurant=restaurant, items=items))
+
+        return cls(order_id=message["order_id"], restaurants=restaurants)
@@ -0,0 +1,149 @@
+"""
+Registry of in-flight Silpo orders, polled in batches by a single periodic task.
+
+REDIS STRUCTURE:
+    silpo_tracking:orders    HASH  {external_id: {order_id, restaurant_id, status, interval, failures}}
+    silpo_tracking:schedule  ZSET  {external_id: next poll timestamp}
+    silpo_tracking:lock      STR   only one poller runs at a time
+"""
+
+import json
+import time
+import uuid
+from dataclasses import asdict, dataclass
+from typing import cast
+
+from shared.cache import get_redis_client
+
+from .enums import OrderStatus
+from .states import CANCELLED
+
+# status: (initial interval, max interval) in seconds
+POLL_INTERVALS: dict[str, tuple[float, float]] = {
+    OrderStatus.NOT_STARTED: (2.0, 10.0),
+    OrderStatus.COOKING: (1.0, 5.0),
+}
+DEFAULT_POLL_INTERVAL: tuple[float, float] = (2.0, 10.0)
+BACKOFF_FACTOR = 1.5
+# the order is not polled anymore after this number of failed polls in a row
+POLL_MAX_FAILURES = 5
+
+# restaurants do not cook orders with these statuses, so they are not polled
+STOPPED: frozenset[OrderStatus] = frozenset(
+    {OrderStatus.FAILED, OrderStatus.COOKING_REJECTED, OrderStatus.CANCELLED_BY_RESTAURANT, *CANCELLED}
+)
+
+POLL_BATCH_SIZE = 500
+POLL_CONCURRENCY = 20
+POLLER_LOCK_TTL = 30
+
+# KEYS: lock. ARGV: token. The lock is deleted only by its owner, it could expire and be taken by another poller.
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+@dataclass
+class TrackedOrder:
+    external_id: str
+    order_id: int
+    restaurant_id: int
+    status: str
+    interval: float
+    failures: int = 0  # polls failed in a row
+
+    def next_interval(self, status: str) -> float:
+        """Reset the interval if the status has changed, otherwise back off."""
+
+        initial, maximum = POLL_INTERVALS.get(status, DEFAULT_POLL_INTERVAL)
+
+        if status != self.status:
+            return initial
+        else:
+            return min(self.interval * BACKOFF_FACTOR, maximum)
+
+    def failed(self) -> bool:
+        """Back off after the failed poll. Return `False` if the order should not be polled anymore."""
+
+        self.failures += 1
+        self.interval = self.next_interval(self.status)
+        return self.failures < POLL_MAX_FAILURES
+
+
+class SilpoTrackingRegistry:
+    ORDERS_KEY = "silpo_tracking:orders"
+    SCHEDULE_KEY = "silpo_tracking:schedule"
+    LOCK_KEY = "silpo_tracking:lock"
+
+    def __init__(self):
+        self.redis = get_redis_client()
+        self._release_lock = self.redis.register_script(RELEASE_LOCK_SCRIPT)
+
+    def register(self, external_id: str, order_id: int, restaurant_id: int, status: str) -> None:
+        initial, _ = POLL_INTERVALS.get(status, DEFAULT_POLL_INTERVAL)
+        tracked = TrackedOrder(
+            external_id=external_id,
+            order_id=order_id,
+            restaurant_id=restaurant_id,
+            status=status,
+            interval=initial,
+        )
+
+        pipe = self.redis.pipeline()
+        pipe.hset(self.ORDERS_KEY, external_id, json.dumps(asdict(tracked)))
+        pipe.zadd(self.SCHEDULE_KEY, {external_id: time.time() + initial})
+        pipe.execute()
+
+    def unregister(self, external_id: str) -> None:
+        pipe = self.redis.pipeline()
+        pipe.hdel(self.ORDERS_KEY, external_id)
+        pipe.zrem(self.SCHEDULE_KEY, external_id)
+        pipe.execute()
+
+    def due(self, limit: int = POLL_BATCH_SIZE) -> list[TrackedOrder]:
+        """Return orders which next poll time has come."""
+
+        external_ids = cast(
+            list[bytes], self.redis.zrangebyscore(self.SCHEDULE_KEY, 0, time.time(), start=0, num=limit)
+        )
+        if not external_ids:
+            return []
+
+        payloads = cast(list[bytes | None], self.redis.hmget(self.ORDERS_KEY, external_ids))
+
+        results: list[TrackedOrder] = []
+        for external_id, payload in zip(external_ids, payloads):
+            if payload is None:
+                # stale schedule entry without state
+                self.redis.zrem(self.SCHEDULE_KEY, external_id)
+            else:
+                results.append(TrackedOrder(**json.loads(payload)))
+
+        return results
+
+    def reschedule(self, tracked_orders: list[TrackedOrder]) -> None:
+        """Save the state and next poll time of all polled orders in one round trip."""
+
+        now = time.time()
+        pipe = self.redis.pipeline()
+
+        for tracked in tracked_orders:
+            pipe.hset(self.ORDERS_KEY, tracked.external_id, json.dumps(asdict(tracked)))
+            pipe.zadd(self.SCHEDULE_KEY, {tracked.external_id: now + tracked.interval})
+
+        pipe.execute()
+
+    def acquire_lock(self) -> str | None:
+        """Return the token to release the lock with, or `None` if another poller runs."""
+
+        token = uuid.uuid4().hex
+        return token if self.redis.set(self.LOCK_KEY, token, nx=True, ex=POLLER_LOCK_TTL) else None
+
+    def release_lock(self, token: str) -> None:
+        self._release_lock(keys=[self.LOCK_KEY], args=[token])
+
+    def __len__(self) -> int:
+        return cast(int, self.redis.hlen(self.ORDERS_KEY))
@@ -3,6 +3,8 @@ from dataclasses import asdict, dataclass
 
 import httpx
 
+from shared import http_clients
+
 
 class OrderStatus(enum.StrEnum):
     NOT_STARTED = "not started"
@@ -29,17 +31,37 @@ class OrderResponse:
 
 
 class Client:
+    PROVIDER = "silpo"
     # the url of running service
     BASE_URL = "http://silpo-mock:8001/api/orders"
 
     @classmethod
     def create_order(cls, order: OrderRequestBody):
-        response: httpx.Response = httpx.post(cls.BASE_URL, json=asdict(order))
+        response: httpx.Response = http_clients.get_client(cls.PROVIDER).post(cls.BASE_URL, json=asdict(order))
         response.raise_for_status()
         return OrderResponse(**response.json())
 
     @classmethod
     def get_order(cls, order_id: str):
-        response: httpx.Response = httpx.get(f"{cls.BASE_URL}/{order_id}")
+        response: httpx.Response = http_clients.get_client(cls.PROVIDER).get(f"{cls.BASE_URL}/{order_id}")
+        response.raise_for_status()
+        return OrderResponse(**response.json())
+
+
+class AsyncClient:
+    PROVIDER = "silpo"
+    BASE_URL = Client.BASE_URL
+
+    @classmethod
+    async def create_order(cls, order: OrderRequestBody):
+        client = http_clients.get_async_client(cls.PROVIDER)
+        response: httpx.Response = await client.post(cls.BASE_URL, json=asdict(order))
+        response.raise_for_status()
+        return OrderResponse(**response.json())
+
+    @classmethod
+    async def get_order(cls, order_id: str):
+        client = http_clients.get_async_client(cls.PROVIDER)
+        response: httpx.Response = await client.get(f"{cls.BASE_URL}/{order_id}")
         response.raise_for_status()
         return OrderResponse(**response.json())
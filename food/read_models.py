@@ -0,0 +1,103 @@
+"""
+Read model of orders, served by `GET /food/orders/<id>`.
+
+Fields of the Order which do not change after it is created are encoded once,
+with the same output as `OrderSerializer`, and kept with the owner of the order. The live part (statuses of the order,
+its restaurants and delivery, the delivery location) is added from the TrackingOrder,
+read in the same round trip, so polling the order does not query the database
+while it is tracked.
+
+    {"id":17,"items":[{"dish":1,"quantity":2}],"eta":"2025-07-01","total":200,"delivery_provider":"uklon",
+     "status":"cooking","tracking":{"restaurants":{"1":{"status":"cooking","external_id":"13"}},"delivery":{}}}
+
+REDIS STRUCTURE:
+    order_documents:v2:17  HASH  {"body": the encoded Order without the status, "user_id": "5"}
+"""
+
+import hashlib
+import json
+from dataclasses import dataclass
+
+from shared.cache import get_redis_client
+
+from .locations import location_key
+from .models import Order, OrderItem
+from .tracking import ORDER_LIFE_TIME, TrackingOrder, TrackingOrderStore
+
+# the same output as the DRF JSON renderer
+_json_encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+
+@dataclass
+class OrderDocument:
+    body: bytes
+    etag: str
+    user_id: int
+
+
+class OrderReadModel:
+    NAMESPACE = "order_documents:v2"  # documents of v1 were strings without the owner, they expire
+
+    def __init__(self):
+        self.redis = get_redis_client()
+
+    @classmethod
+    def _key(cls, order_id: int) -> str:
+        return f"{cls.NAMESPACE}:{order_id}"
+
+    def get(self, order_id: int) -> OrderDocument | None:
+        """Return the order with its tracking state or `None` if there is no such order."""
+
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.hmget(self._key(order_id), ["body", "user_id"])
+        pipe.hgetall(TrackingOrderStore._key(order_id))
+        pipe.get(location_key(order_id))
+        (document, user_id), payload, point = pipe.execute()
+
+        tracking_order = TrackingOrderStore._parse(payload, point)
+        status = tracking_order.status if tracking_order is not None else None
+
+        if document is None or status is None:
+            # not read yet, or not tracked anymore: the status is only in the database
+            built = self._build(order_id)
+            if built is None:
+                return None
+            document, user_id, stored_status = built
+            status = status or stored_status
+
+        return self._document(document, int(user_id), status, tracking_order or TrackingOrder())
+
+    def _build(self, order_id: int) -> tuple[bytes, int, str] | None:
+        order = (
+            Order.objects.filter(id=order_id)
+            .values("id", "user_id", "eta", "total", "status", "delivery_provider")
+            .first()
+        )
+        if order is None:
+            return None
+
+        payload = {
+            "id": order["id"],
+            "items": list(OrderItem.objects.filter(order_id=order_id).order_by("id").values("dish", "quantity")),
+            "eta": order["eta"].isoformat(),
+            "total": order["total"],
+            "delivery_provider": order["delivery_provider"],
+        }
+        document = _json_encoder.encode(payload).encode()
+
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.hset(self._key(order_id), mapping={"body": document, "user_id": order["user_id"]})
+        pipe.expire(self._key(order_id), ORDER_LIFE_TIME)
+        pipe.execute()
+
+        return document, order["user_id"], order["status"]
+
+    @staticmethod
+    def _document(document: bytes, user_id: int, status: str, tracking_order: TrackingOrder) -> OrderDocument:
+        tracking = {"restaurants": tracking_order.restaurants, "delivery": tracking_order.delivery}
+        live = _json_encoder.encode({"status": status, "tracking": tracking}).encode()
+
+        # both parts are JSON objects: `{...}` + `{...}` -> `{...,...}`
+        body = document[:-1] + b"," + live[1:]
+
+        return OrderDocument(body=body, etag=f'"{hashlib.blake2b(body, digest_size=8).hexdigest()}"', user_id=user_id)
@@ -1,253 +1,622 @@
-from dataclasses import asdict, dataclass, field
-from time import sleep
+import asyncio
+import csv
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Coroutine, Iterable
 
-from django.db.models import QuerySet
+import httpx
+import redis
+from django.core.files.storage import default_storage
 
 from config import celery_app
+from shared import http_clients
 from shared.cache import CacheService
+from shared.resilience import CALL_NOT_SENT_ERRORS
 
+from .deliveries import DeliveryWindow, pickups_of, uklon_order_ids
 from .enums import OrderStatus
+from .imports import ImportJobs, ImportReport, ImportStatus, import_dishes_csv
+from .locations import LocationStore
 from .mapper import PROVIDER_EXTERNAL_TO_INTERNAL, RESTAURANT_EXTERNAL_TO_INTERNAL
-from .models import Order, OrderItem, Restaurant
+from .menu import MenuCache
+from .models import DispatchItem, Order, Restaurant, RestaurantRef
+from .payloads import OrderDispatch
+from .polling import POLL_CONCURRENCY, STOPPED, SilpoTrackingRegistry, TrackedOrder
 from .providers import kfc, silpo, uklon
+from .states import revert, transition
+from .tracking import TrackingOrder, TrackingOrderStore
+from .webhooks import WebhookEvent, WebhookTask
 
-ORDER_LIFE_TIME = 604800
 
+def all_orders_cooked(order_id: int):
+    store = TrackingOrderStore()
 
-@dataclass
-class TrackingOrder:
-    """
-    {
-        17: {  // internal Order.id
-            restaurants: {
-                1: {  // internal restaurant id
-                    status: NOT_STARTED, // internal
-                    external_id: 13,
-                    request_body: {...},
-                },
-                2: {  // internal restaurant id
-                    status: NOT_STARTED, // internal
-                    external_id: edf055b8-06e8-40ed-ab35-300fef3e0a5d,
-                    request_body: {...},
-                },
-            },
-            delivery: {
-                location: (..., ...),
-                status: NOT STARTED, DELIVERY, DELIVERED
-            }
-        },
-        18: ...
-    }
-    """
+    if store.claim_all_cooked(order_id):
+        print("✅ All orders are COOKED")
 
-    restaurants: dict = field(default_factory=dict)
-    delivery: dict = field(default_factory=dict)
+        # Wait for orders with the same pickups, unless the order is cancelled meanwhile
+        if transition(order_id, OrderStatus.COOKED):
+            try:
+                DeliveryWindow().add(order_id)
+            except redis.RedisError as error:
+                print(f"Order {order_id} is delivered alone: {error}")
+                order_delivery.delay(order_id)
+    else:
+        print(f"Not all orders are cooked: {store.get(order_id)}")
 
 
-def all_orders_cooked(order_id: int):
-    cache = CacheService()
-    tracking_order = TrackingOrder(**cache.get(namespace="orders", key=str(order_id)))
-    print(f"Checking if al lorders are cooked: {tracking_order.restaurants}")
+@celery_app.task(queue="default")
+def consolidate_deliveries():
+    """Deliver groups of cooked orders from the window, each with one Uklon order (see `food.deliveries`)."""
 
-    if all((payload["status"] == OrderStatus.COOKED for _, payload in tracking_order.restaurants.items())):
-        Order.objects.filter(id=order_id).update(status=OrderStatus.COOKED)
-        print("✅ All orders are COOKED")
+    window = DeliveryWindow()
+    groups = window.take_due()
 
-        # Start orders delivery
-        order_delivery.delay(order_id)
-    else:
-        print(f"Not all orders are cooked: {tracking_order=}")
+    try:
+        while groups:
+            orders_delivery.delay(groups[0].order_ids)
+            group = groups.pop(0)
+            print(f"🚚 Orders {group.order_ids} from {len(group.pickups)} restaurants are delivered together")
+    finally:
+        # groups which are not queued are taken again by the next run
+        window.restore(groups)
 
 
 @celery_app.task(queue="default")
 def order_delivery(order_id: int):
-    """Using random provider (or now only Uklon) - start processing delivery order."""
+    """Deliver the single order."""
+
+    deliver_orders([order_id])
+
+
+@celery_app.task(queue="default")
+def orders_delivery(order_ids: list[int]):
+    """Deliver orders with the same pickups together."""
+
+    deliver_orders(order_ids)
+
+
+def deliver_orders(order_ids: list[int]) -> None:
+    """Using random provider (or now only Uklon) - start processing delivery of orders with one trip."""
 
     print("🚚 DELIVERY PROCESSING STARTED")
 
     provider = uklon.Client()
     cache = CacheService()
-    order = Order.objects.get(id=order_id)
+    store = TrackingOrderStore()
 
     def get_internal_status(status: uklon.OrderStatus) -> OrderStatus:
         return PROVIDER_EXTERNAL_TO_INTERNAL["uklon"][status]
 
-    # update Order state
-    order.status = OrderStatus.DELIVERY_LOOKUP
-    order.save()
+    # update Order states. A retried task does not create the second delivery
+    order_ids = [order_id for order_id in order_ids if transition(order_id, OrderStatus.DELIVERY_LOOKUP)]
+    if not order_ids:
+        return
 
     # prepare data for the first request
     addresses: list[str] = []
     comments: list[str] = []
+    orders = f", orders {', '.join(map(str, order_ids))}" if len(order_ids) > 1 else ""
 
-    for rest_name, address in order.delivery_meta():
+    for rest_name, address in sorted({pickup for _, pickups in pickups_of(order_ids).values() for pickup in pickups}):
         addresses.append(address)
-        comments.append(f"Delivery to the {rest_name}")
+        comments.append(f"Delivery to the {rest_name}{orders}")
 
     # создаём заказ во внешнем провайдере
-    response: uklon.OrderResponse = provider.create_order(
-        uklon.OrderRequestBody(addresses=addresses, comments=comments)
-    )
+    try:
+        response: uklon.OrderResponse = provider.create_order(
+            uklon.OrderRequestBody(addresses=addresses, comments=comments)
+        )
+    except CALL_NOT_SENT_ERRORS as error:
+        print(f"Delivery of orders {order_ids} is not requested: {error!r}. Waiting for the next run")
+        _wait_for_delivery(order_ids)
+        return
+    except Exception:
+        # the Uklon order could be created if the request is sent, so it is not repeated
+        for order_id in order_ids:
+            transition(order_id, OrderStatus.FAILED)
+        raise
+
+    # сохраняем mapping external_id -> internal order_ids
+    # и обновляем TrackingOrder (без проставления DELIVERED!) за один round trip
+    internal_status = get_internal_status(response.status)
 
-    # сохраняем mapping external_id -> internal order_id
-    cache.set(
-        namespace="uklon_orders",
-        key=response.id,
-        value={"internal_order_id": order_id},
+    with cache.pipeline() as pipe:
+        pipe.set(namespace="uklon_orders", key=response.id, value={"internal_order_ids": order_ids})
+        LocationStore().record(order_ids, list(response.location), pipe=pipe.pipe)
+        for order_id in order_ids:
+            store.update_delivery(order_id, status=internal_status, pipe=pipe.pipe)
+            # orders stay in DELIVERY_LOOKUP until the trip is started
+            if internal_status in (OrderStatus.DELIVERY, OrderStatus.DELIVERED):
+                transition(order_id, internal_status, pipe=pipe.pipe)
+
+    print(f"🏁 UKLON order created [{response.id}] for {order_ids} status={response.status} 📍 {response.location}")
+
+
+@celery_app.task(queue="high_priority", base=WebhookTask)
+def uklon_order_webhook(message: dict):
+    """Apply the Uklon delivery status from the accepted `WebhookEvent` to all orders of the trip."""
+
+    event = WebhookEvent.from_message(message)
+    uklon_cache_order = CacheService().get("uklon_orders", key=event.external_id)
+
+    if uklon_cache_order is None:  # the mapping may be saved after the event, the task is retried
+        raise ValueError(f"Uklon order {event.external_id} is not found")
+
+    internal_status = PROVIDER_EXTERNAL_TO_INTERNAL["uklon"][event.status]
+
+    # a status is written with the transition only, locations are saved by the webhook view
+    store = TrackingOrderStore()
+    pipe = store.redis.pipeline()
+    for order_id in uklon_order_ids(uklon_cache_order):
+        if transition(order_id, internal_status, pipe=pipe):
+            store.update_delivery(order_id, status=internal_status, pipe=pipe)
+    pipe.execute()
+
+
+def _wait_for_delivery(order_ids: list[int]) -> None:
+    """Return orders which delivery is not requested to the window, unless they are cancelled meanwhile."""
+
+    window = DeliveryWindow()
+    for order_id in order_ids:
+        if revert(order_id, OrderStatus.DELIVERY_LOOKUP, OrderStatus.COOKED):
+            window.add(order_id)
+
+
+def silpo_request_body(items: Iterable[DispatchItem]) -> silpo.OrderRequestBody:
+    return silpo.OrderRequestBody(
+        order=[silpo.OrderItem(dish=item.dish, quantity=str(item.quantity)) for item in items]
     )
 
-    # обновляем кеш TrackingOrder (без проставления DELIVERED!)
-    tracking_order = TrackingOrder(**cache.get("orders", str(order.pk)))
-    tracking_order.delivery["status"] = get_internal_status(response.status)
-    tracking_order.delivery["location"] = response.location
-    cache.set("orders", str(order_id), asdict(tracking_order))
 
-    print(f"🏁 UKLON order created [{response.id}] status={response.status} 📍 {response.location}")
+def kfc_request_body(items: Iterable[DispatchItem]) -> kfc.OrderRequestBody:
+    return kfc.OrderRequestBody(order=[kfc.OrderItem(dish=item.dish, quantity=str(item.quantity)) for item in items])
 
 
-@celery_app.task(queue="default")
-def order_in_silpo(order_id: int, items: QuerySet[OrderItem]):
-    """Short polling requests to the Silpo API
+def silpo_order_created(order_id: int, restaurant_id: int, response: silpo.OrderResponse) -> None:
+    """Save the created Silpo order and pass it to the tracking registry.
 
     NOTES
-    get order from cache
-    is external_id?
-      no: make order
-      yes: get order
+    Silpo has no webhooks, so the status is tracked by `poll_silpo_orders`
+    which polls all registered orders in batches instead of a loop per order.
     """
 
-    client = silpo.Client()
+    store = TrackingOrderStore()
+    registry = SilpoTrackingRegistry()
+    internal_status: OrderStatus = RESTAURANT_EXTERNAL_TO_INTERNAL["silpo"][response.status]
+
+    # UPDATE CACHE WITH EXTERNAL ID AND STATE
+    store.update_restaurant(order_id, restaurant_id, status=internal_status, external_id=response.id)
+
+    print(f"Created Silpo Order. External ID: {response.id} Status: {internal_status}")
+
+    if internal_status == OrderStatus.COOKED:
+        all_orders_cooked(order_id)
+    else:
+        registry.register(
+            external_id=response.id,
+            order_id=order_id,
+            restaurant_id=restaurant_id,
+            status=internal_status,
+        )
+
+
+def kfc_order_created(order_id: int, restaurant_id: int, response: kfc.OrderResponse) -> None:
+    """Save the created KFC order. Further statuses come with the KFC webhook."""
+
     cache = CacheService()
-    restaurant = Restaurant.objects.get(name="silpo")
-
-    def get_internal_status(status: silpo.OrderStatus) -> OrderStatus:
-        return RESTAURANT_EXTERNAL_TO_INTERNAL["silpo"][status]
-
-    cooked = False
-    while not cooked:
-        sleep(1)  # just a delay
-
-        # GET ITEM FROM THE CACHE
-        cached_data = cache.get(namespace="orders", key=str(order_id)) or {}
-        tracking_order = TrackingOrder(
-            restaurants={
-                str(order_id): {
-                    "status": cached_data.get("status"),
-                    "external_id": cached_data.get("external_id"),
-                }
-            }
+    store = TrackingOrderStore()
+    internal_status: OrderStatus = RESTAURANT_EXTERNAL_TO_INTERNAL["kfc"][response.status]
+
+    # UPDATE CACHE WITH EXTERNAL ID AND STATE
+    # and save another item form Mapping to the Internal Order
+    with cache.pipeline() as pipe:
+        store.update_restaurant(
+            order_id, restaurant_id, status=internal_status, external_id=response.id, pipe=pipe.pipe
+        )
+        pipe.set(
+            namespace="kfc_orders",
+            key=response.id,  # external KFC order id
+            value={
+                "internal_order_id": order_id,
+                "restaurant_id": restaurant_id,
+            },
         )
-        # validate
-        silpo_order = tracking_order.restaurants.get(str(restaurant.pk))
-        if not silpo_order:
-            raise ValueError("No Silpo in orders processing")
-
-        # PRINT CURRENT STATUS
-        print(f"CURRENT SILPO ORDER STATUS: {silpo_order['status']}")
-
-        if not silpo_order["external_id"]:
-            # ✨ MAKE THE FIRST REQUEST IF NOT STARTED
-            response: silpo.OrderResponse = client.create_order(
-                silpo.OrderRequestBody(
-                    order=[silpo.OrderItem(dish=item.dish.name, quantity=str(item.quantity)) for item in items]
-                )
-            )
 
-            internal_status: OrderStatus = get_internal_status(response.status)
+    print(f"Created KFC Order. External ID: {response.id} Status: {internal_status}")
+
+    # 🚧 CHECK IF ALL ORDERS ARE COOKED
+    if internal_status == OrderStatus.COOKED:
+        all_orders_cooked(order_id)
+
+
+@celery_app.task(queue="high_priority", base=WebhookTask)
+def kfc_order_webhook(message: dict):
+    """Apply the KFC order status from the accepted `WebhookEvent`."""
+
+    event = WebhookEvent.from_message(message)
+    kfc_cache_order = CacheService().get("kfc_orders", key=event.external_id)
+
+    if kfc_cache_order is None:  # the mapping may be saved after the event, the task is retried
+        raise ValueError(f"KFC order {event.external_id} is not found")
+
+    order_id = kfc_cache_order["internal_order_id"]
+    restaurant_id = kfc_cache_order.get("restaurant_id")
+    if restaurant_id is None:  # mappings saved before the restaurant id was added
+        restaurant_id = Restaurant.objects.values_list("id", flat=True).get(name="kfc")
+
+    internal_status = RESTAURANT_EXTERNAL_TO_INTERNAL["kfc"][event.status]
+    TrackingOrderStore().update_restaurant(order_id, restaurant_id, status=internal_status)
+
+    if internal_status == OrderStatus.COOKING:
+        transition(order_id, OrderStatus.COOKING)
+    elif internal_status == OrderStatus.COOKED:
+        all_orders_cooked(order_id)
+
+
+@celery_app.task(queue="default")
+def order_in_silpo(message: dict):
+    """Create the Silpo order from the `OrderDispatch` message."""
+
+    client = silpo.Client()
+    store = TrackingOrderStore()
+    dispatch = OrderDispatch.from_message(message)
+    order_id = dispatch.order_id
+    restaurant_id = dispatch.restaurants[0].restaurant.id
+    items = dispatch.restaurants[0].items
+
+    # GET TRACKING ORDER FROM THE CACHE
+    tracking_order = store.get(order_id) or TrackingOrder()
+    silpo_order = tracking_order.restaurants.get(str(restaurant_id))
+    if not silpo_order:
+        raise ValueError("No Silpo in orders processing")
+
+    if silpo_order["external_id"]:
+        print(f"Silpo order is already created. External ID: {silpo_order['external_id']}")
+        return
+
+    # ✨ MAKE THE FIRST REQUEST
+    response: silpo.OrderResponse = client.create_order(silpo_request_body(items))
+    silpo_order_created(order_id, restaurant_id, response)
+
+
+def _silpo_order_polled(tracked: TrackedOrder, response: silpo.OrderResponse | None) -> bool:
+    """Apply the polled status. Return `True` if the order is still in progress."""
+
+    if response is None:  # request failed - just back off
+        tracked.interval = tracked.next_interval(tracked.status)
+        return True
+
+    internal_status = RESTAURANT_EXTERNAL_TO_INTERNAL["silpo"][response.status]
+
+    if internal_status != tracked.status:  # STATUS HAS CHANGED
+        TrackingOrderStore().update_restaurant(tracked.order_id, tracked.restaurant_id, status=internal_status)
+        print(f"Silpo order {tracked.external_id} status changed to {internal_status}")
+
+        # if started cooking?
+        if internal_status == OrderStatus.COOKING:
+            transition(tracked.order_id, OrderStatus.COOKING)
+        elif internal_status == OrderStatus.COOKED:
+            all_orders_cooked(tracked.order_id)
+
+    tracked.interval = tracked.next_interval(internal_status)
+    tracked.status = internal_status
+    tracked.failures = 0
+
+    return internal_status != OrderStatus.COOKED
+
+
+def _silpo_poll_applied(tracked: TrackedOrder, result: silpo.OrderResponse | Exception) -> bool:
+    """Apply the result of the poll. Return `True` if the order is still polled.
+
+    Errors of the order (unknown statuses, rejected requests) count as failed polls,
+    so a broken order is polled `POLL_MAX_FAILURES` times and does not stop other orders.
+    """
+
+    if isinstance(result, httpx.TransportError):  # Silpo is not reached - just back off
+        print(f"Silpo order {tracked.external_id} polling failed: {result!r}")
+        return _silpo_order_polled(tracked, None)
+
+    error = result
+    if not isinstance(result, Exception):
+        try:
+            return _silpo_order_polled(tracked, result)
+        except Exception as polling_error:
+            error = polling_error
+
+    print(f"Silpo order {tracked.external_id} poll {tracked.failures + 1} failed: {error!r}")
+    return tracked.failed()
 
-            # UPDATE CACHE WITH EXTERNAL ID AND STATE
-            tracking_order.restaurants[str(restaurant.pk)] |= {
-                "external_id": response.id,
-                "status": internal_status,
-            }
-            cache.set(namespace="orders", key=str(order_id), value=asdict(tracking_order), ttl=ORDER_LIFE_TIME)
-        else:
-            # ✨ IF ALREADY HAVE EXTERNAL ID - JUST RETRIEVE THE ORDER
-            # PASS EXTERNAL SILPO ORDER ID
-            response = client.get_order(silpo_order["external_id"])
-            internal_status = get_internal_status(response.status)
 
-            print(f"Tracking for Silpo Order with HTTP GET /api/order. Status: {internal_status}")
+def _silpo_orders_to_poll(registry: SilpoTrackingRegistry, tracked_orders: list[TrackedOrder]) -> list[TrackedOrder]:
+    """Unregister orders which restaurants do not cook anymore (failed, cancelled), return others."""
 
-            if silpo_order["status"] != internal_status:  # STATUS HAS CHANGED
-                tracking_order.restaurants[str(restaurant.pk)]["status"] = internal_status
-                print(f"Silpo order status changed to {internal_status}")
-                cache.set(namespace="orders", key=str(order_id), value=asdict(tracking_order), ttl=ORDER_LIFE_TIME)
-                # if started cooking?
-                if internal_status == OrderStatus.COOKING:
-                    Order.objects.filter(id=order_id).update(status=OrderStatus.COOKING)
+    order_ids = {tracked.order_id for tracked in tracked_orders}
+    stopped = set(Order.objects.filter(id__in=order_ids, status__in=STOPPED).values_list("id", flat=True))
 
-            if internal_status == OrderStatus.COOKED:
-                cooked = True
-                all_orders_cooked(order_id)
+    for tracked in tracked_orders:
+        if tracked.order_id in stopped:
+            print(f"Silpo order {tracked.external_id} is not polled anymore: the order is stopped")
+            registry.unregister(tracked.external_id)
+
+    return [tracked for tracked in tracked_orders if tracked.order_id not in stopped]
+
+
+@celery_app.task(queue="default")
+def poll_silpo_orders():
+    """Batched short polling of all in-flight Silpo orders.
+
+    Started by Celery Beat. Only due orders are requested, each one with
+    its own interval that grows while the status does not change.
+    """
+
+    client = silpo.Client()
+    registry = SilpoTrackingRegistry()
+
+    lock = registry.acquire_lock()
+    if lock is None:
+        print("Silpo poller is already running")
+        return
+
+    try:
+        due_orders = registry.due()
+        if not due_orders:
+            return
+
+        polled = _silpo_orders_to_poll(registry, due_orders)
+
+        def fetch(tracked: TrackedOrder) -> silpo.OrderResponse | Exception:
+            try:
+                return client.get_order(tracked.external_id)
+            except Exception as error:
+                return error
+
+        with ThreadPoolExecutor(max_workers=POLL_CONCURRENCY) as executor:
+            results = list(executor.map(fetch, polled))
+
+        in_progress: list[TrackedOrder] = []
+        for tracked, result in zip(polled, results):
+            if _silpo_poll_applied(tracked, result):
+                in_progress.append(tracked)
+            else:
+                registry.unregister(tracked.external_id)
+
+        registry.reschedule(in_progress)
+        print(f"Silpo poller: {len(polled)} polled, {len(in_progress)} in progress")
+    finally:
+        registry.release_lock(lock)
 
 
 @celery_app.task(queue="high_priority")
-def order_in_kfc(order_id: int, items):
+def order_in_kfc(message: dict):
+    """Create the KFC order from the `OrderDispatch` message."""
+
     client = kfc.Client()
-    cache = CacheService()
-    restaurant = Restaurant.objects.get(name="kfc")
+    dispatch = OrderDispatch.from_message(message)
+    restaurant_dispatch = dispatch.restaurants[0]
 
-    def get_internal_status(status: kfc.OrderStatus) -> OrderStatus:
-        return RESTAURANT_EXTERNAL_TO_INTERNAL["kfc"][status]
+    response: kfc.OrderResponse = client.create_order(kfc_request_body(restaurant_dispatch.items))
+    kfc_order_created(dispatch.order_id, restaurant_dispatch.restaurant.id, response)
+
+
+SUPPORTED_RESTAURANTS = ("silpo", "kfc")
+
+# orders of a single restaurant created by one `orders_in_restaurant` task
+BATCH_DISPATCH_SIZE = 50
 
-    # GET TRACKING ORDER FROM THE CACHE
-    tracking_order = TrackingOrder(**cache.get(namespace="orders", key=str(order_id)))
 
-    response: kfc.OrderResponse = client.create_order(
-        kfc.OrderRequestBody(order=[kfc.OrderItem(dish=item.dish.name, quantity=item.quantity) for item in items])
+def restaurant_order_request(restaurant: RestaurantRef, items: Iterable[DispatchItem]) -> Coroutine:
+    match restaurant.name.lower():
+        case "silpo":
+            return silpo.AsyncClient.create_order(silpo_request_body(items))
+        case "kfc":
+            return kfc.AsyncClient.create_order(kfc_request_body(items))
+        case _:
+            raise ValueError(f"Restaurant {restaurant.name} is not available for processing")
+
+
+async def create_restaurant_orders(
+    requests: dict[tuple[int, RestaurantRef], Coroutine],
+) -> dict[tuple[int, RestaurantRef], Any]:
+    """Create restaurant orders concurrently. Requests are keyed by `(order_id, restaurant)`.
+
+    Each provider call has its own deadline (`order_timeout` in `settings.HTTP_PROVIDERS`),
+    so the latency equals the slowest provider. Failed calls are returned as exceptions.
+    """
+
+    async def create(restaurant: RestaurantRef, request: Coroutine):
+        timeout = http_clients.get_config(restaurant.name.lower())["order_timeout"]
+        return await asyncio.wait_for(request, timeout=timeout)
+
+    keys = list(requests)
+    results = await asyncio.gather(
+        *(create(restaurant, requests[(order_id, restaurant)]) for order_id, restaurant in keys),
+        return_exceptions=True,
     )
-    internal_status = get_internal_status(response.status)
 
-    # UPDATE CACHE WITH EXTERNAL ID AND STATE
-    tracking_order.restaurants[str(restaurant.pk)] |= {
-        "external_id": response.id,
-        "status": internal_status,
+    return dict(zip(keys, results))
+
+
+def restaurant_orders_created(
+    dispatches: dict[int, OrderDispatch],
+    results: dict[tuple[int, RestaurantRef], Any],
+) -> None:
+    """Handle results of `create_restaurant_orders`.
+
+    If some provider call was not sent, its order is created by the restaurant specific task.
+    Other failures could happen after the provider created the order, so it is not repeated
+    and the order is failed instead of being cooked twice.
+    """
+
+    for (order_id, restaurant), result in results.items():
+        name = restaurant.name.lower()
+
+        if isinstance(result, BaseException) and not isinstance(result, CALL_NOT_SENT_ERRORS):
+            print(f"{name.upper()} order for order_id={order_id} failed: {result!r}")
+            transition(order_id, OrderStatus.FAILED)
+        elif isinstance(result, BaseException):
+            print(f"{name.upper()} order for order_id={order_id} is not sent: {result!r}. Retrying with a single task")
+            message = dispatches[order_id].only(restaurant).to_message()
+
+            match name:
+                case "silpo":
+                    order_in_silpo.delay(message)
+                case "kfc":
+                    order_in_kfc.delay(message)
+        else:
+            match name:
+                case "silpo":
+                    silpo_order_created(order_id, restaurant.id, result)
+                case "kfc":
+                    kfc_order_created(order_id, restaurant.id, result)
+
+
+def _not_created(dispatch: OrderDispatch, tracking_order: TrackingOrder | None):
+    """Skip restaurants with the external order, in case the task is retried."""
+
+    restaurants = tracking_order.restaurants if tracking_order is not None else {}
+
+    for restaurant_dispatch in dispatch.restaurants:
+        if not restaurants.get(str(restaurant_dispatch.restaurant.id), {}).get("external_id"):
+            yield restaurant_dispatch
+
+
+@celery_app.task(queue="high_priority")
+def order_in_restaurants(message: dict):
+    """Fan-out the order from the `OrderDispatch` message to all restaurants at once."""
+
+    dispatch = OrderDispatch.from_message(message)
+    tracking_order = TrackingOrderStore().get(dispatch.order_id)
+
+    requests: dict[tuple[int, RestaurantRef], Coroutine] = {
+        (dispatch.order_id, restaurant_dispatch.restaurant): restaurant_order_request(
+            restaurant_dispatch.restaurant, restaurant_dispatch.items
+        )
+        for restaurant_dispatch in _not_created(dispatch, tracking_order)
     }
 
-    print(f"Created KFC Order. External ID: {response.id} Status: {internal_status}")
-    cache.set(namespace="orders", key=str(order_id), value=asdict(tracking_order), ttl=ORDER_LIFE_TIME)
-
-    # save another item form Mapping to the Internal Order
-    cache.set(
-        namespace="kfc_orders",
-        key=response.id,  # external KFC order id
-        value={
-            "internal_order_id": order_id,
-        },
-    )
+    results = http_clients.run_in_loop(create_restaurant_orders(requests))
+    restaurant_orders_created({dispatch.order_id: dispatch}, results)
 
-    # 🚧 CHECK IF ALL ORDERS ARE COOKED
-    if all_orders_cooked(order_id):
-        cache.set(namespace="orders", key=str(order_id), value=asdict(tracking_order), ttl=ORDER_LIFE_TIME)
-        Order.objects.filter(id=order_id).update(status=OrderStatus.COOKED)
+
+@celery_app.task(queue="high_priority")
+def orders_in_restaurant(messages: list[dict]):
+    """Create orders of many `OrderDispatch` messages of a single restaurant at once.
+
+    Silpo and KFC accept one order per request, so calls are sent concurrently
+    over the pooled provider connections instead of one task per order.
+    """
+
+    dispatches = {dispatch.order_id: dispatch for dispatch in map(OrderDispatch.from_message, messages)}
+    tracking_orders = TrackingOrderStore().get_many(list(dispatches))
+
+    requests: dict[tuple[int, RestaurantRef], Coroutine] = {}
+    for order_id, dispatch in dispatches.items():
+        for restaurant_dispatch in _not_created(dispatch, tracking_orders[order_id]):
+            requests[(order_id, restaurant_dispatch.restaurant)] = restaurant_order_request(
+                restaurant_dispatch.restaurant, restaurant_dispatch.items
+            )
+
+    print(f"Creating {len(requests)} restaurant orders from the batch of {len(dispatches)}")
+
+    results = http_clients.run_in_loop(create_restaurant_orders(requests))
+    restaurant_orders_created(dispatches, results)
+
+
+def _validate_restaurants(restaurants: Iterable[RestaurantRef]) -> None:
+    for restaurant in restaurants:
+        if restaurant.name.lower() not in SUPPORTED_RESTAURANTS:
+            raise ValueError(f"Restaurant {restaurant.name} is not available for processing")
 
 
 def schedule_order(order: Order):
     # define services and data state
-    cache = CacheService()
-    tracking_order = TrackingOrder()
+    store = TrackingOrderStore()
 
     items_by_restaurants = order.items_by_restaurant()
-    for restaurant, items in items_by_restaurants.items():
-        # update tracking order instance to be saved to the cache
-        tracking_order.restaurants[str(restaurant.pk)] = {
-            "external_id": None,
-            "status": OrderStatus.NOT_STARTED,
-        }
+    _validate_restaurants(items_by_restaurants)
 
     # update cache insatnce only once in the end
-    cache.set(namespace="orders", key=str(order.pk), value=asdict(tracking_order), ttl=ORDER_LIFE_TIME)
+    store.create(order.pk, [restaurant.id for restaurant in items_by_restaurants])
 
     # start processing after cache is complete
-    for restaurant, items in items_by_restaurants.items():
-        match restaurant.name.lower():
-            case "silpo":
-                print(f"Sending order_in_silpo for order_id={order.pk} with {len(items)} items")
-                order_in_silpo.delay(order.pk, items)
-                # or
-                # order_in_silpo.apply_async()
-            case "kfc":
-                order_in_kfc.delay(order.pk, items)
-            case _:
-                raise ValueError(f"Restaurant {restaurant.name} is not available for processing")
+    print(f"Sending order_in_restaurants for order_id={order.pk} to {len(items_by_restaurants)} restaurants")
+    order_in_restaurants.delay(OrderDispatch.from_items(order.pk, items_by_restaurants).to_message())
+
+
+def schedule_orders(dispatches: list[OrderDispatch]):
+    """Schedule many orders at once.
+
+    Tracking orders are created in one round trip and the restaurant work is grouped
+    per restaurant, so each task carries up to `BATCH_DISPATCH_SIZE` orders.
+    """
+
+    store = TrackingOrderStore()
+    by_restaurant: dict[RestaurantRef, list[dict]] = {}
+
+    for dispatch in dispatches:
+        _validate_restaurants(restaurant_dispatch.restaurant for restaurant_dispatch in dispatch.restaurants)
+
+        for restaurant_dispatch in dispatch.restaurants:
+            restaurant = restaurant_dispatch.restaurant
+            by_restaurant.setdefault(restaurant, []).append(dispatch.only(restaurant).to_message())
+
+    pipe = store.redis.pipeline()
+    for dispatch in dispatches:
+        store.create(dispatch.order_id, [item.restaurant.id for item in dispatch.restaurants], pipe=pipe)
+    pipe.execute()
+
+    for restaurant, messages in by_restaurant.items():
+        print(f"Sending orders_in_restaurant for {len(messages)} orders to {restaurant.name}")
+
+        for start in range(0, len(messages), BATCH_DISPATCH_SIZE):
+            end = start + BATCH_DISPATCH_SIZE
+            orders_in_restaurant.delay(messages[start:end])
+
+
+@celery_app.task(queue="default")
+def import_dishes_file(job_id: str, path: str):
+    """Import dishes from the uploaded file in `default_storage` and report the progress after each batch."""
+
+    jobs = ImportJobs()
+    jobs.update(job_id, ImportStatus.RUNNING, ImportReport())
+
+    try:
+        with default_storage.open(path, "rb") as file:
+            report = import_dishes_csv(file, progress=lambda report: jobs.update(job_id, ImportStatus.RUNNING, report))
+    except (UnicodeDecodeError, csv.Error) as error:
+        jobs.update(job_id, ImportStatus.FAILED, ImportReport(), error=f"The file is not a valid UTF-8 CSV: {error}")
+    except Exception as error:
+        jobs.update(job_id, ImportStatus.FAILED, ImportReport(), error=repr(error))
+        raise
+    else:
+        jobs.update(job_id, ImportStatus.FINISHED, report)
+
+        # bulk upserts do not send model signals
+        if report.inserted or report.updated:
+            menu_changed()
+    finally:
+        default_storage.delete(path)
+
+
+@celery_app.task(queue="default")
+def materialize_menu(version: int):
+    menu = MenuCache()
+
+    if menu.version() != version:
+        print(f"Menu v{version} is outdated, skipping")
+        return
+
+    menu.materialize(version)
+
+
+def menu_changed():
+    """Bump the menu version and materialize the new menu in the background."""
+
+    try:
+        version = MenuCache().bump()
+    except redis.RedisError as error:
+        # the change is already committed, so it must not fail. The menu is stale until the next change
+        print(f"Menu version is not bumped: {error}")
+        return
+
+    materialize_menu.delay(version)
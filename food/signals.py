@@ -0,0 +1,14 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Dish, Restaurant
+from .services import menu_changed
+
+
+@receiver([post_save, post_delete], sender=Dish)
+@receiver([post_save, post_delete], sender=Restaurant)
+def dish_or_restaurant_changed(sender, **kwargs):
+    """Invalidate the menu after the change is committed, so it is not materialized from old data."""
+
+    transaction.on_commit(menu_changed)
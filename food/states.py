@@ -0,0 +1,118 @@
+"""
+State machine of the Order status.
+
+All status changes go through `transition`, which updates the database with
+a compare-and-set UPDATE, so concurrent or duplicated events (webhooks, polling,
+retried tasks) can not move the order backwards or apply the same change twice.
+
+    NOT_STARTED -> COOKING -> COOKED -> DELIVERY_LOOKUP -> DELIVERY -> DELIVERED
+"""
+
+from redis.client import Pipeline
+
+from .enums import OrderStatus
+from .models import Order
+from .tracking import TrackingOrderStore
+
+CANCELLED: frozenset[OrderStatus] = frozenset(
+    {
+        OrderStatus.CANCELLED_BY_CUSTOMER,
+        OrderStatus.CANCELLED_BY_MANAGER,
+        OrderStatus.CANCELLED_BY_ADMIN,
+    }
+)
+
+TRANSITIONS: dict[OrderStatus, frozenset[OrderStatus]] = {
+    OrderStatus.NOT_STARTED: frozenset(
+        {
+            OrderStatus.COOKING,
+            OrderStatus.COOKED,  # restaurants may skip the cooking status between polls
+            OrderStatus.COOKING_REJECTED,
+            OrderStatus.CANCELLED_BY_RESTAURANT,
+            OrderStatus.FAILED,
+            *CANCELLED,
+        }
+    ),
+    OrderStatus.COOKING: frozenset(
+        {
+            OrderStatus.COOKED,
+            OrderStatus.COOKING_REJECTED,
+            OrderStatus.CANCELLED_BY_RESTAURANT,
+            OrderStatus.FAILED,
+            *CANCELLED,
+        }
+    ),
+    OrderStatus.COOKED: frozenset({OrderStatus.DELIVERY_LOOKUP, OrderStatus.FAILED, *CANCELLED}),
+    OrderStatus.DELIVERY_LOOKUP: frozenset(
+        {
+            OrderStatus.DELIVERY,
+            OrderStatus.DELIVERED,
+            OrderStatus.NOT_DELIVERED,
+            OrderStatus.CANCELLED_BY_DRIVER,
+            OrderStatus.FAILED,
+            *CANCELLED,
+        }
+    ),
+    OrderStatus.DELIVERY: frozenset(
+        {
+            OrderStatus.DELIVERED,
+            OrderStatus.NOT_DELIVERED,
+            OrderStatus.CANCELLED_BY_DRIVER,
+            OrderStatus.FAILED,
+        }
+    ),
+}
+
+# statuses the order may be moved from to the key status
+SOURCES: dict[OrderStatus, frozenset[OrderStatus]] = {
+    status: frozenset(source for source, targets in TRANSITIONS.items() if status in targets) for status in OrderStatus
+}
+
+# the order moves along this path, or leaves it to a final status
+PROGRESS: list[OrderStatus] = [
+    OrderStatus.NOT_STARTED,
+    OrderStatus.COOKING,
+    OrderStatus.COOKED,
+    OrderStatus.DELIVERY_LOOKUP,
+    OrderStatus.DELIVERY,
+]
+
+# the cached status is only moved forward, so it catches up with the database after a lost write
+EARLIER: dict[OrderStatus, frozenset[OrderStatus]] = {
+    status: frozenset(PROGRESS[: PROGRESS.index(status)] if status in PROGRESS else PROGRESS) for status in OrderStatus
+}
+
+
+def transition(order_id: int, status: OrderStatus, pipe: Pipeline | None = None) -> bool:
+    """Move the order to the status if the transition is allowed from its current status.
+
+    Returns `False` without any writes if the order already has the status
+    or the transition is not allowed, so duplicated events are no-ops.
+    The cached status is updated only after the database, with the pipeline if it is passed.
+    """
+
+    changed = Order.objects.filter(id=order_id, status__in=SOURCES[status]).update(status=status) == 1
+
+    if changed:
+        TrackingOrderStore().update_status(order_id, status, sources=EARLIER[status], pipe=pipe)
+        print(f"Order {order_id} status changed to {status}")
+    else:
+        print(f"Order {order_id} status is not changed to {status}: the transition is not allowed")
+
+    return changed
+
+
+def revert(order_id: int, status: OrderStatus, previous: OrderStatus) -> bool:
+    """Move the order back from the status it was moved to for an action which was not done.
+
+    Like `transition`, it is a compare-and-set of the database and the cached status,
+    so the order is not moved back if it has already left the status.
+    """
+
+    changed = Order.objects.filter(id=order_id, status=status).update(status=previous) == 1
+
+    if changed:
+        TrackingOrderStore().update_status(order_id, previous, sources=[status])
+        print(f"Order {order_id} status is reverted to {previous}")
+
+    return changed
@@ -0,0 +1,136 @@
+"""
+Live updates of tracking orders over Redis pub/sub.
+
+Every change of a TrackingOrder (statuses, the delivery location) is published
+once to the `TRACKING_CHANNEL` as a part of the TrackingOrder:
+    {"order_id": 17, "update": {"restaurants": {"1": {"status": "cooked"}}}}
+
+Each ASGI process keeps one subscription to the channel and fans messages out
+to local queues of connected clients (see `food.asgi`), so the load of Redis
+does not depend on the number of watchers.
+
+REDIS STRUCTURE:
+    tracking:updates  PUBSUB  updates of all tracking orders
+"""
+
+import asyncio
+import json
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+import redis.asyncio
+from django.conf import settings
+from redis.exceptions import RedisError
+
+TRACKING_CHANNEL = "tracking:updates"
+STREAM_QUEUE_SIZE = 100
+RECONNECT_DELAY = 1.0
+
+# a client should fetch the whole TrackingOrder again: its queue is overflown or updates are lost
+RESYNC = None
+
+
+def tracking_message(order_id: int | str, update: dict) -> str:
+    return json.dumps({"order_id": int(order_id), "update": update}, separators=(",", ":"))
+
+
+def sse_event(event: str, data: dict) -> bytes:
+    """Encode the Server-Sent Event."""
+
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n".encode()
+
+
+class TrackingHub:
+    """One subscription to the `TRACKING_CHANNEL` per process, shared by all streams.
+
+    Each message is encoded to the event once and put to queues of its order only.
+    """
+
+    def __init__(self):
+        self._subscribers: dict[int, set[asyncio.Queue]] = {}
+        self._listener: asyncio.Task | None = None
+
+    @asynccontextmanager
+    async def subscribe(self, order_id: int) -> AsyncIterator[asyncio.Queue]:
+        queue: asyncio.Queue[bytes | None] = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+        self._subscribers.setdefault(order_id, set()).add(queue)
+        self._start()
+
+        try:
+            yield queue
+        finally:
+            queues = self._subscribers.get(order_id, set())
+            queues.discard(queue)
+            if not queues:
+                self._subscribers.pop(order_id, None)
+
+    def _start(self) -> None:
+        if (
+            self._listener is None
+            or self._listener.done()
+            or self._listener.get_loop() is not asyncio.get_running_loop()
+        ):
+            self._listener = asyncio.create_task(self._listen(), name="tracking-hub")
+            self._listener.add_done_callback(self._stopped)
+
+    async def _listen(self) -> None:
+        while True:
+            client = redis.asyncio.Redis.from_url(settings.CACHES["default"]["LOCATION"])
+            pubsub = client.pubsub(ignore_subscribe_messages=True)
+
+            try:
+                await pubsub.subscribe(TRACKING_CHANNEL)
+
+                async for message in pubsub.listen():
+                    try:
+                        self.dispatch(message["data"])
+                    except Exception as error:
+                        # a broken message must not stop updates of other orders
+                        print(f"Tracking update {message['data']!r} is not dispatched: {error!r}")
+            except RedisError as error:
+                # updates could be lost while disconnected
+                print(f"Tracking hub listener failed: {error}")
+                self._resync()
+                await asyncio.sleep(RECONNECT_DELAY)
+            finally:
+                await pubsub.aclose()
+                await client.aclose()
+
+    def _stopped(self, listener: asyncio.Task) -> None:
+        """Resync streams of the failed listener and start it again while there are subscribers."""
+
+        if listener.cancelled() or listener is not self._listener:
+            return
+
+        print(f"Tracking hub listener stopped: {listener.exception()!r}")
+        self._resync()
+        if self._subscribers:
+            asyncio.get_running_loop().call_later(RECONNECT_DELAY, self._restart)
+
+    def _restart(self) -> None:
+        if self._subscribers:
+            self._start()
+
+    def _resync(self) -> None:
+        for order_id in list(self._subscribers):
+            self._put(order_id, RESYNC)
+
+    def dispatch(self, data: bytes) -> None:
+        message = json.loads(data)
+        order_id = message["order_id"]
+
+        if order_id in self._subscribers:
+            self._put(order_id, sse_event("update", message["update"]))
+
+    def _put(self, order_id: int, event: bytes | None) -> None:
+        for queue in self._subscribers.get(order_id, ()):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # the client is too slow, it gets the whole order instead of missed updates
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(RESYNC)
+
+
+hub = TrackingHub()
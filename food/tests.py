@@ -0,0 +1,1508 @@
+import asyncio
+import http.server
+import io
+import json
+import os
+import pickle
+import tempfile
+import threading
+import time
+import warnings
+import weakref
+from datetime import date, timedelta
+from typing import Any, Callable, cast
+from unittest import mock
+
+import fakeredis
+import fakeredis.aioredis
+import httpx
+import redis
+from asgiref.typing import HTTPScope, Scope
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.http import StreamingHttpResponse
+from django.test import AsyncClient, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from shared import codecs, http_clients, local_cache, metrics
+from shared.cache import CacheService
+from shared.limits import LimitExceeded, ProviderLimiter
+from shared.local_cache import INVALIDATION_CHANNEL, LocalCache
+from shared.resilience import CircuitOpen, ProviderGuard
+from users.models import User
+
+from .asgi import with_tracking_stream
+from .deliveries import DELIVERY_WINDOW, DeliveryWindow, uklon_order_ids
+from .enums import OrderStatus
+from .imports import ImportStatus, import_dishes_csv
+from .menu import MenuCache
+from .models import Dish, DispatchItem, Order, OrderItem, Restaurant, RestaurantRef
+from .payloads import OrderDispatch
+from .polling import POLL_MAX_FAILURES, SilpoTrackingRegistry
+from .providers import silpo, uklon
+from .services import (
+    BATCH_DISPATCH_SIZE,
+    consolidate_deliveries,
+    deliver_orders,
+    import_dishes_file,
+    kfc_order_webhook,
+    poll_silpo_orders,
+    restaurant_orders_created,
+    schedule_order,
+    schedule_orders,
+)
+from .states import EARLIER, TRANSITIONS, transition
+from .streams import RESYNC, STREAM_QUEUE_SIZE, TRACKING_CHANNEL, TrackingHub, hub, sse_event, tracking_message
+from .tracking import TrackingOrder, TrackingOrderStore
+from .views import OrderSerializer, RestaurantSerializer
+from .webhooks import WEBHOOK_MAX_RETRIES
+
+
+class CateringTestCase(TestCase):
+    """Test case with the customer `user`. `client` is the API client authenticated as the user."""
+
+    client: APIClient
+    user: User
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email="jane@catering.com",
+            password="password",
+            phone_number="0630000001",
+            first_name="Jane",
+            last_name="Doe",
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    @staticmethod
+    def create_admin(email: str) -> User:
+        return User.objects.create_superuser(
+            email=email, password="password", phone_number="0630000003", first_name="Admin", last_name="Doe"
+        )
+
+
+class RedisTestCase(TestCase):
+    """Test case with the Redis client replaced by fakeredis, which runs Lua scripts with lupa."""
+
+    redis: fakeredis.FakeRedis
+
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis()
+        patcher = mock.patch("shared.cache._redis_client", self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class OrderItemsByRestaurantTestCase(CateringTestCase):
+    order: Order
+
+    RESTAURANTS = 10
+    DISHES_PER_RESTAURANT = 3
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.order = Order.objects.create(user=cls.user, eta=date.today() + timedelta(days=1), delivery_provider="uklon")
+
+        for number in range(cls.RESTAURANTS):
+            restaurant = Restaurant.objects.create(name="silpo" if number % 2 else "kfc", address=f"Street {number}")
+            for dish_number in range(cls.DISHES_PER_RESTAURANT):
+                dish = Dish.objects.create(name=f"Dish {number}.{dish_number}", price=100, restaurant=restaurant)
+                OrderItem.objects.create(order=cls.order, dish=dish, quantity=dish_number + 1)
+
+    def test_single_query(self):
+        with self.assertNumQueries(1):
+            results = self.order.items_by_restaurant()
+
+            # items are materialized, so nothing is requested again
+            self.assertEqual(len(results), self.RESTAURANTS)
+            for restaurant, items in results.items():
+                self.assertIsInstance(restaurant, RestaurantRef)
+                self.assertEqual(len(items), self.DISHES_PER_RESTAURANT)
+                self.assertTrue(all(isinstance(item, DispatchItem) for item in items))
+                self.assertTrue(all(item.restaurant_id == restaurant.id for item in items))
+
+    def test_items_payload(self):
+        results = self.order.items_by_restaurant()
+        restaurant = next(iter(results))
+
+        self.assertEqual(
+            [(item.dish, item.quantity) for item in results[restaurant]],
+            [(f"Dish 0.{number}", number + 1) for number in range(self.DISHES_PER_RESTAURANT)],
+        )
+
+    @mock.patch("food.services.order_in_restaurants.delay")
+    @mock.patch("food.services.TrackingOrderStore")
+    def test_schedule_order_single_query(self, store_mock, delay_mock):
+        with self.assertNumQueries(1):
+            schedule_order(self.order)
+
+        store_mock.return_value.create.assert_called_once()
+        delay_mock.assert_called_once()
+
+        # the task message is a plain JSON-serializable dispatch payload
+        message = delay_mock.call_args.args[0]
+        self.assertEqual(json.loads(json.dumps(message)), message)
+
+        dispatch = OrderDispatch.from_message(message)
+        self.assertEqual(dispatch.order_id, self.order.pk)
+        self.assertEqual(len(dispatch.restaurants), self.RESTAURANTS)
+
+
+class CreateOrderTestCase(CateringTestCase):
+    dishes: list[Dish]
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        restaurant = Restaurant.objects.create(name="silpo", address="Street 1")
+        cls.dishes = [
+            Dish.objects.create(name=f"Dish {number}", price=100, restaurant=restaurant) for number in range(20)
+        ]
+
+    def create_order(self, dishes: list[Dish]):
+        payload = {
+            "eta": str(date.today() + timedelta(days=2)),
+            "delivery_provider": "uklon",
+            "items": [{"dish": dish.pk, "quantity": 2} for dish in dishes],
+        }
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post("/food/orders/", payload, format="json")
+
+        self.assertEqual(response.status_code, 201, response.data)
+        return response, len(context.captured_queries)
+
+    @mock.patch("food.views.schedule_order")
+    def test_constant_number_of_queries(self, _):
+        _, single_item_queries = self.create_order(self.dishes[:1])
+        response, many_items_queries = self.create_order(self.dishes)
+
+        self.assertEqual(single_item_queries, many_items_queries)
+        self.assertEqual(response.data["total"], 20 * 100 * 2)
+        self.assertEqual(OrderItem.objects.filter(order_id=response.data["id"]).count(), 20)
+
+    def test_dishes_are_loaded_with_restaurants(self):
+        serializer = OrderSerializer(
+            data={
+                "eta": str(date.today() + timedelta(days=2)),
+                "delivery_provider": "uklon",
+                "items": [{"dish": dish.pk, "quantity": 1} for dish in self.dishes[:3]],
+            }
+        )
+
+        with self.assertNumQueries(1):
+            serializer.is_valid(raise_exception=True)
+            self.assertEqual(
+                len(serializer.items_by_restaurant[RestaurantRef(id=self.dishes[0].restaurant_id, name="silpo")]), 3
+            )
+
+    def test_unknown_dish(self):
+        response = self.client.post(
+            "/food/orders/",
+            {
+                "eta": str(date.today() + timedelta(days=2)),
+                "delivery_provider": "uklon",
+                "items": [{"dish": self.dishes[0].pk, "quantity": 1}, {"dish": 0, "quantity": 1}],
+            },
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Order.objects.count(), 0)
+
+
+class BatchOrdersTestCase(CateringTestCase):
+    salad: Dish
+    wings: Dish
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        silpo = Restaurant.objects.create(name="silpo", address="Street 1")
+        kfc = Restaurant.objects.create(name="kfc", address="Street 2")
+        cls.salad = Dish.objects.create(name="Salad", price=100, restaurant=silpo)
+        cls.wings = Dish.objects.create(name="Wings", price=200, restaurant=kfc)
+
+    def order_payload(self, *dishes: int) -> dict:
+        return {
+            "eta": str(date.today() + timedelta(days=2)),
+            "delivery_provider": "uklon",
+            "items": [{"dish": dish, "quantity": 1} for dish in dishes],
+        }
+
+    def post_batch(self, orders: list[dict]):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post("/food/orders/batch/", {"orders": orders}, format="json")
+
+        return response, len(context.captured_queries)
+
+    @mock.patch("food.views.schedule_orders")
+    def test_constant_number_of_queries(self, _):
+        _, single_order_queries = self.post_batch([self.order_payload(self.salad.pk, self.wings.pk)])
+        response, many_orders_queries = self.post_batch(
+            [self.order_payload(self.salad.pk, self.wings.pk) for _ in range(30)]
+        )
+
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(single_order_queries, many_orders_queries)
+        self.assertEqual(Order.objects.count(), 31)
+        self.assertEqual(OrderItem.objects.count(), 31 * 2)
+        self.assertEqual([result["order"]["total"] for result in response.data["results"]], [300] * 30)
+
+    @mock.patch("food.views.schedule_orders")
+    def test_per_order_results(self, schedule_mock):
+        response, _ = self.post_batch(
+            [self.order_payload(self.salad.pk), self.order_payload(0), self.order_payload(self.wings.pk)]
+        )
+
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual([result["status"] for result in response.data["results"]], [201, 400, 201])
+        self.assertIn("items", response.data["results"][1]["errors"])
+        self.assertEqual(Order.objects.count(), 2)
+
+        dispatches = schedule_mock.call_args.args[0]
+        self.assertEqual([len(dispatch.restaurants) for dispatch in dispatches], [1, 1])
+
+    @mock.patch("food.views.schedule_orders")
+    def test_unsupported_restaurant(self, schedule_mock):
+        pizza = Dish.objects.create(
+            name="Pizza", price=300, restaurant=Restaurant.objects.create(name="pizzeria", address="Street 3")
+        )
+
+        response, _ = self.post_batch(
+            [
+                self.order_payload(self.salad.pk),
+                self.order_payload(self.wings.pk, pizza.pk),
+                self.order_payload(self.wings.pk),
+            ]
+        )
+
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual([result["status"] for result in response.data["results"]], [201, 400, 201])
+        self.assertIn("pizzeria", str(response.data["results"][1]["errors"]["items"]))
+        self.assertEqual(Order.objects.count(), 2)
+        self.assertEqual(len(schedule_mock.call_args.args[0]), 2)
+
+    @mock.patch("food.views.schedule_orders")
+    def test_invalid_orders_do_not_query_dishes(self, _):
+        _, valid_queries = self.post_batch([self.order_payload(self.salad.pk)])
+        _, queries = self.post_batch([self.order_payload(self.salad.pk)] + [self.order_payload(0, -1)] * 10)
+
+        self.assertEqual(queries, valid_queries)
+
+    @mock.patch("food.services.orders_in_restaurant.delay")
+    @mock.patch("food.services.TrackingOrderStore")
+    def test_schedule_grouped_by_restaurant(self, store_mock, delay_mock):
+        dispatches = [
+            OrderDispatch.from_items(
+                order_id,
+                {
+                    RestaurantRef(id=self.salad.restaurant_id, name="silpo"): [
+                        DispatchItem(dish="Salad", quantity=1, restaurant_id=self.salad.restaurant_id)
+                    ],
+                    RestaurantRef(id=self.wings.restaurant_id, name="kfc"): [
+                        DispatchItem(dish="Wings", quantity=1, restaurant_id=self.wings.restaurant_id)
+                    ],
+                },
+            )
+            for order_id in range(1, BATCH_DISPATCH_SIZE + 2)
+        ]
+
+        schedule_orders(dispatches)
+
+        # tracking orders are created in a single pipeline
+        store_mock.return_value.redis.pipeline.return_value.execute.assert_called_once()
+
+        # every restaurant gets a full and a partial batch of single restaurant messages
+        messages = [call.args[0] for call in delay_mock.call_args_list]
+        self.assertEqual([len(batch) for batch in messages], [BATCH_DISPATCH_SIZE, 1, BATCH_DISPATCH_SIZE, 1])
+        self.assertTrue(all(len(message["restaurants"]) == 1 for batch in messages for message in batch))
+
+
+class AllOrdersTestCase(CateringTestCase):
+    admin: User
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.admin = cls.create_admin("admin@catering.com")
+        restaurant = Restaurant.objects.create(name="silpo", address="Street 1")
+        dish = Dish.objects.create(name="Salad", price=100, restaurant=restaurant)
+
+        for number in range(7):
+            order = Order.objects.create(
+                user=cls.admin,
+                eta=date.today() + timedelta(days=number % 2 + 1),
+                delivery_provider="uklon",
+                status=OrderStatus.DELIVERED if number % 2 else OrderStatus.NOT_STARTED,
+            )
+            OrderItem.objects.create(order=order, dish=dish, quantity=1)
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.admin)
+
+    def test_cursor_pages(self):
+        ids: list[int] = []
+        url = "/food/orders/?size=3"
+
+        while url:
+            with self.assertNumQueries(2):  # orders and their items
+                response = self.client.get(url)
+
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn("count", response.data)
+            ids += [order["id"] for order in response.data["results"]]
+            url = response.data["next"]
+
+        self.assertEqual(ids, list(Order.objects.order_by("-id").values_list("id", flat=True)))
+
+    def test_filters(self):
+        eta = date.today() + timedelta(days=2)
+        params = {"status": "delivered", "eta": str(eta), "user": str(self.admin.pk), "format": "json"}
+        response = self.client.get("/food/orders/", params)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["results"]), 3)
+        self.assertTrue(all(order["status"] == OrderStatus.DELIVERED for order in response.data["results"]))
+
+    def test_invalid_filter(self):
+        response = self.client.get("/food/orders/", {"status": "unknown"})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("status", response.data["queryParams"])
+
+
+class ExportOrdersTestCase(CateringTestCase):
+    admin: User
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.admin = cls.create_admin("accounting@catering.com")
+        silpo = Restaurant.objects.create(name="silpo", address="Street 1")
+        kfc = Restaurant.objects.create(name="kfc", address="Street 2")
+        salad = Dish.objects.create(name="Salad", price=100, restaurant=silpo)
+        wings = Dish.objects.create(name="Wings", price=200, restaurant=kfc)
+
+        for days in (1, 2, 3):
+            order = Order.objects.create(user=cls.admin, eta=date(2025, 7, days), delivery_provider="uklon", total=500)
+            OrderItem.objects.create(order=order, dish=salad, quantity=1)
+            OrderItem.objects.create(order=order, dish=wings, quantity=2)
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.admin)
+
+    def export(self, **params) -> list[str]:
+        response = self.client.get("/food/orders/export/", params)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return response.getvalue().decode().splitlines()
+
+    def test_csv(self):
+        lines = self.export(etaFrom="2025-07-02")
+
+        self.assertEqual(lines[0], "order_id,status,eta,delivery_provider,total,user_id,restaurant,dish,price,quantity")
+        self.assertEqual(len(lines), 1 + 2 * 2)
+        self.assertTrue(lines[1].endswith(",not_started,2025-07-02,uklon,500,%s,silpo,Salad,100,1" % self.admin.pk))
+
+    def test_ndjson(self):
+        orders = [json.loads(line) for line in self.export(type="ndjson")]
+
+        self.assertEqual([order["eta"] for order in orders], ["2025-07-01", "2025-07-02", "2025-07-03"])
+        self.assertEqual(
+            orders[0]["items"],
+            [
+                {"restaurant": "silpo", "dish": "Salad", "price": 100, "quantity": 1},
+                {"restaurant": "kfc", "dish": "Wings", "price": 200, "quantity": 2},
+            ],
+        )
+
+    async def test_asgi_stream(self):
+        client = AsyncClient()
+        headers = {"Authorization": f"Bearer {AccessToken.for_user(self.admin)}"}
+
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")  # a sync iterator would be read to the end before it is sent
+            response = cast(
+                StreamingHttpResponse, await client.get("/food/orders/export/", {"type": "ndjson"}, headers=headers)
+            )
+            lines = b"".join([chunk async for chunk in response]).splitlines()
+
+        self.assertTrue(response.is_async)
+        self.assertEqual(len(lines), 3)
+
+    def test_unknown_type(self):
+        response = self.client.get("/food/orders/export/", {"type": "xml"})
+
+        self.assertEqual(response.status_code, 400)
+
+
+class ImportDishesTestCase(CateringTestCase):
+    silpo: Restaurant
+    kfc: Restaurant
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.silpo = Restaurant.objects.create(name="Silpo", address="Street 1")
+        cls.kfc = Restaurant.objects.create(name="KFC", address="Street 2")
+        Dish.objects.create(name="Salad", price=100, restaurant=cls.silpo)
+
+    def test_report(self):
+        rows = "\n".join(f"Dish {number},{number},kfc" for number in range(50))
+        content = f"name,price,restaurant\nSalad,150,silpo\n{rows}\nBurger,10,mcdonalds\nSoda,free,kfc\n"
+
+        # restaurants, savepoint and its release, existing dishes and upsert of 3 batches
+        with self.assertNumQueries(1 + 2 + 3 * 2):
+            report = import_dishes_csv(io.BytesIO(content.encode()), batch_size=20)
+
+        self.assertEqual((report.inserted, report.updated, report.skipped), (50, 1, 2))
+        self.assertEqual(report.errors[0], "Line 53: Restaurant 'mcdonalds' does not exist")
+        self.assertEqual(Dish.objects.get(name="Salad").price, 150)
+        self.assertEqual(Dish.objects.filter(restaurant=self.kfc).count(), 50)
+
+    @mock.patch("food.services.menu_changed")
+    @mock.patch("food.services.ImportJobs")
+    @mock.patch("food.views.ImportJobs")
+    def test_background_upload(self, views_jobs_mock, services_jobs_mock, menu_changed_mock):
+        views_jobs_mock.return_value.create.return_value = "job"
+        admin = self.create_admin("menu@catering.com")
+        self.client.force_login(admin)
+
+        with tempfile.TemporaryDirectory() as media_root, self.settings(MEDIA_ROOT=media_root):
+            with mock.patch("food.views.import_dishes_file.delay") as delay_mock:
+                response = self.client.post(
+                    "/admin/food/dish/import-dishes/",
+                    {
+                        "file": SimpleUploadedFile(
+                            "dishes.csv", b"name,price,restaurant\nSalad,120,silpo\nWings,200,kfc\n"
+                        )
+                    },
+                )
+
+            self.assertEqual(response.status_code, 302)
+            self.assertEqual(self.client.session["dish_import_job"], "job")
+            self.assertEqual(Dish.objects.count(), 1)  # nothing is imported by the request
+
+            job_id, path = delay_mock.call_args.args
+            import_dishes_file(job_id, path)
+
+            self.assertEqual(Dish.objects.count(), 2)
+            self.assertEqual(Dish.objects.get(name="Salad").price, 120)
+            self.assertEqual(os.listdir(os.path.join(media_root, "imports")), [])
+
+        _, status, report = services_jobs_mock.return_value.update.call_args.args
+        self.assertEqual(status, ImportStatus.FINISHED)
+        self.assertEqual((report.processed, report.inserted, report.updated), (2, 1, 1))
+        menu_changed_mock.assert_called_once()
+
+
+class MenuTestCase(CateringTestCase):
+    restaurant: Restaurant
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.restaurant = Restaurant.objects.create(name="silpo", address="Street 1")
+        Restaurant.objects.create(name="kfc", address="Street 2")
+        Dish.objects.create(name="Salad", price=100, restaurant=cls.restaurant)
+        Dish.objects.create(name="Сирники", price=80, restaurant=cls.restaurant)
+
+    def test_snapshot_is_serializer_output(self):
+        with mock.patch("food.menu.get_redis_client"), self.assertNumQueries(2):
+            menu = MenuCache()._build(7)
+
+        restaurants = Restaurant.objects.order_by("id")
+        self.assertEqual(menu, JSONRenderer().render(RestaurantSerializer(restaurants, many=True).data))
+
+    @mock.patch("food.views.MenuCache")
+    def test_served_as_is(self, menu_mock):
+        menu_mock.return_value.version.return_value = 7
+        menu_mock.return_value.get.return_value = b'[{"id":1}]'
+        menu_mock.return_value.restaurant.return_value = None
+        menu_mock.return_value.etag.side_effect = MenuCache.etag
+
+        with self.assertNumQueries(0):
+            response = self.client.get("/food/dishes/")
+            not_modified = self.client.get("/food/dishes/", HTTP_IF_NONE_MATCH='"menu-7"')
+            not_found = self.client.get("/food/dishes/100/")
+
+        self.assertEqual((response.status_code, response.content, response["ETag"]), (200, b'[{"id":1}]', '"menu-7"'))
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_found.status_code, 404)
+        menu_mock.return_value.get.assert_called_once_with(7)
+
+    @mock.patch("food.signals.menu_changed")
+    def test_version_bumped_on_commit(self, menu_changed_mock):
+        with self.captureOnCommitCallbacks(execute=True):
+            Dish.objects.filter(name="Salad").get().delete()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.restaurant.save()
+
+        self.assertEqual(menu_changed_mock.call_count, 2)
+
+
+@mock.patch("food.states.TrackingOrderStore")
+class OrderTransitionTestCase(CateringTestCase):
+    order: Order
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.order = Order.objects.create(user=cls.user, eta=date.today() + timedelta(days=1), delivery_provider="uklon")
+
+    def status(self) -> str:
+        return Order.objects.values_list("status", flat=True).get(id=self.order.pk)
+
+    def test_happy_path(self, store_mock):
+        for status in (
+            OrderStatus.COOKING,
+            OrderStatus.COOKED,
+            OrderStatus.DELIVERY_LOOKUP,
+            OrderStatus.DELIVERY,
+            OrderStatus.DELIVERED,
+        ):
+            self.assertTrue(transition(self.order.pk, status))
+            self.assertEqual(self.status(), status)
+
+            store_mock.return_value.update_status.assert_called_with(
+                self.order.pk, status, sources=EARLIER[status], pipe=None
+            )
+
+    def test_no_regressions(self, store_mock):
+        Order.objects.filter(id=self.order.pk).update(status=OrderStatus.DELIVERED)
+
+        self.assertFalse(transition(self.order.pk, OrderStatus.DELIVERY))
+        self.assertFalse(transition(self.order.pk, OrderStatus.COOKING))
+        self.assertEqual(self.status(), OrderStatus.DELIVERED)
+        store_mock.return_value.update_status.assert_not_called()
+
+    def test_duplicate_is_noop(self, store_mock):
+        self.assertTrue(transition(self.order.pk, OrderStatus.COOKING))
+
+        with self.assertNumQueries(1):  # a single conditional UPDATE
+            self.assertFalse(transition(self.order.pk, OrderStatus.COOKING))
+
+        store_mock.return_value.update_status.assert_called_once()
+
+    @mock.patch("food.services.order_in_kfc.delay")
+    @mock.patch("food.services.order_in_silpo.delay")
+    def test_failed_restaurant_calls(self, silpo_delay_mock, kfc_delay_mock, _):
+        silpo, kfc = RestaurantRef(id=1, name="Silpo"), RestaurantRef(id=2, name="KFC")
+        dispatch = OrderDispatch.from_items(
+            self.order.pk,
+            {
+                silpo: [DispatchItem(dish="Salad", quantity=1, restaurant_id=1)],
+                kfc: [DispatchItem(dish="Wings", quantity=2, restaurant_id=2)],
+            },
+        )
+
+        # the Silpo call is not sent, the KFC response is lost after it could create the order
+        restaurant_orders_created(
+            {self.order.pk: dispatch},
+            {(self.order.pk, silpo): CircuitOpen("open"), (self.order.pk, kfc): httpx.ReadTimeout("timeout")},
+        )
+
+        silpo_delay_mock.assert_called_once_with(dispatch.only(silpo).to_message())
+        kfc_delay_mock.assert_not_called()
+        self.assertEqual(self.status(), OrderStatus.FAILED)
+
+    def test_no_self_transitions(self, _):
+        # otherwise duplicated events would be applied again
+        self.assertFalse(any(status in targets for status, targets in TRANSITIONS.items()))
+        self.assertNotIn(OrderStatus.DELIVERED, TRANSITIONS)
+
+
+class WebhooksTestCase(TestCase):
+    KFC_URL = "/webhook/kfc/ba407b9e-5c23-4726-8ad9-28c084b6ee8d/"
+    UKLON_URL = "/webhook/uklon/3392cc8d-843f-4999-aa72-f914072f7f69/"
+
+    def setUp(self):
+        # SET NX: only the first event is accepted
+        accepted: set[str] = set()
+        redis_mock = mock.MagicMock()
+
+        def set_nx(key, *args, **kwargs):
+            if key in accepted:
+                return None
+            accepted.add(key)
+            return True
+
+        redis_mock.set.side_effect = set_nx
+        redis_mock.delete.side_effect = accepted.discard
+
+        patcher = mock.patch("food.webhooks.get_redis_client", return_value=redis_mock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @mock.patch("food.views.kfc_order_webhook.delay")
+    def test_duplicates_are_queued_once(self, delay_mock):
+        with self.assertNumQueries(0):
+            for _ in range(3):
+                response = self.client.post(self.KFC_URL, {"id": "kfc-1", "status": "finished"})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.json(), {"message": "ok"})
+
+            self.client.post(self.KFC_URL, {"id": "kfc-1", "status": "cooking"})
+
+        self.assertEqual(
+            [call.args[0]["status"] for call in delay_mock.call_args_list],
+            ["finished", "cooking"],
+        )
+
+    @mock.patch("food.views.record_uklon_location")
+    @mock.patch("food.views.uklon_order_webhook.delay")
+    def test_uklon_locations(self, delay_mock, record_mock):
+        for number in range(5):
+            response = self.client.post(
+                self.UKLON_URL, {"id": "uklon-1", "status": "delivery", "location": [number, 0.2]}
+            )
+            self.assertEqual(response.status_code, 200)
+
+        # every location is saved, the status is processed once
+        self.assertEqual(record_mock.call_args_list, [mock.call("uklon-1", [number, 0.2]) for number in range(5)])
+        delay_mock.assert_called_once_with(
+            {"provider": "uklon", "external_id": "uklon-1", "status": "delivery", "location": [0.0, 0.2]}
+        )
+
+    @mock.patch("food.views.kfc_order_webhook.delay")
+    def test_invalid_event(self, delay_mock):
+        response = self.client.post(self.KFC_URL, {"id": "kfc-1", "status": "lost"})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get(self.KFC_URL).status_code, 405)
+        delay_mock.assert_not_called()
+
+    @mock.patch("food.views.kfc_order_webhook.delay", side_effect=ConnectionError)
+    def test_retry_if_not_queued(self, _):
+        for _ in range(2):
+            response = self.client.post(self.KFC_URL, {"id": "kfc-1", "status": "finished"})
+            self.assertEqual(response.status_code, 503)
+
+    @mock.patch("food.services.CacheService", side_effect=redis.ConnectionError)
+    @mock.patch("food.views.kfc_order_webhook.delay")
+    def test_release_if_not_processed(self, delay_mock, cache_mock):
+        self.client.post(self.KFC_URL, {"id": "kfc-1", "status": "finished"})
+
+        result = kfc_order_webhook.apply(args=delay_mock.call_args.args)
+
+        self.assertTrue(result.failed())
+        self.assertEqual(cache_mock.call_count, 1 + WEBHOOK_MAX_RETRIES)
+
+        # the provider delivers the event again
+        self.client.post(self.KFC_URL, {"id": "kfc-1", "status": "finished"})
+        self.assertEqual(delay_mock.call_count, 2)
+
+    @mock.patch("food.services.all_orders_cooked")
+    @mock.patch("food.services.TrackingOrderStore")
+    @mock.patch("food.services.CacheService")
+    @mock.patch("food.views.kfc_order_webhook.delay")
+    def test_retry_until_order_is_mapped(self, delay_mock, cache_mock, store_mock, cooked_mock):
+        self.client.post(self.KFC_URL, {"id": "kfc-1", "status": "finished"})
+
+        def get(namespace, key):
+            if cache_mock.return_value.get.call_count == 1:
+                return None
+            # the event is released while it is retried, so the provider redelivery is queued
+            self.client.post(self.KFC_URL, {"id": "kfc-1", "status": "finished"})
+            return {"internal_order_id": 17, "restaurant_id": 3}
+
+        cache_mock.return_value.get.side_effect = get
+
+        result = kfc_order_webhook.apply(args=delay_mock.call_args.args)
+
+        self.assertTrue(result.successful())
+        self.assertEqual(delay_mock.call_count, 2)
+        store_mock.return_value.update_restaurant.assert_called_once_with(17, 3, status=OrderStatus.COOKED)
+        cooked_mock.assert_called_once_with(17)
+
+
+@mock.patch("food.streams.TrackingHub._start")
+class TrackingStreamTestCase(CateringTestCase):
+    order: Order
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.order = Order.objects.create(
+            status=OrderStatus.COOKING, user=cls.user, delivery_provider="uklon", eta=date.today(), total=100
+        )
+
+    async def stream(self, user: User, events: list[dict]) -> list[dict]:
+        """Run the stream until the client disconnects after `events` are published."""
+
+        sent: list[dict] = []
+        received = asyncio.Event()
+
+        async def send(message: Any) -> None:
+            sent.append(message)
+            received.set()
+
+        async def receive() -> Any:
+            await received.wait()  # the snapshot is sent
+            for update in events:
+                hub.dispatch(tracking_message(self.order.pk, update).encode())
+            await asyncio.sleep(0.01)
+            return {"type": "http.disconnect"}
+
+        # the stream reads only these keys
+        scope = cast(
+            HTTPScope,
+            {
+                "type": "http",
+                "path": f"/food/orders/{self.order.pk}/stream/",
+                "query_string": f"token={AccessToken.for_user(user)}".encode(),
+            },
+        )
+
+        await with_tracking_stream(mock.AsyncMock())(scope, receive, send)
+        return sent
+
+    @mock.patch("food.asgi.TrackingOrderStore")
+    async def test_snapshot_and_updates(self, store_mock, _):
+        store_mock.return_value.get.return_value = TrackingOrder(restaurants={"1": {"status": "cooking"}})
+
+        sent = await self.stream(self.user, [{"delivery": {"location": [50.45, 30.52]}}])
+
+        self.assertEqual(sent[0]["status"], 200)
+        self.assertEqual(
+            [message["body"] for message in sent[1:]],
+            [
+                b'event: snapshot\ndata: {"restaurants":{"1":{"status":"cooking"}},"delivery":{},"status":null}\n\n',
+                b'event: update\ndata: {"delivery":{"location":[50.45,30.52]}}\n\n',
+            ],
+        )
+        self.assertEqual(hub._subscribers, {})
+
+    async def test_only_for_the_customer(self, _):
+        other = await User.objects.acreate(email="john@catering.com", phone_number="0630000002")
+        sent = await self.stream(other, [])
+
+        self.assertEqual(sent[0]["status"], 403)
+
+    def test_slow_client_resyncs(self, _):
+        async def overflow() -> list:
+            async with hub.subscribe(self.order.pk) as queue:
+                for number in range(STREAM_QUEUE_SIZE + 1):
+                    hub.dispatch(tracking_message(self.order.pk, {"status": number}).encode())
+                return [queue.get_nowait() for _ in range(queue.qsize())]
+
+        self.assertEqual(asyncio.run(overflow()), [RESYNC])
+
+
+@mock.patch("food.streams.RECONNECT_DELAY", 0.01)
+class TrackingHubTestCase(TestCase):
+    async def listen(self, failures: list[Exception], messages: list[bytes]) -> list[bytes | None]:
+        """Return events of the order 17 until its update, `messages` are published once the hub is subscribed.
+
+        The hub listener fails to connect with `failures` first.
+        """
+
+        server = fakeredis.FakeServer()
+        publisher = fakeredis.aioredis.FakeRedis(server=server)
+        connections = [*failures, fakeredis.aioredis.FakeRedis(server=server)]
+        events: list[bytes | None] = []
+
+        with mock.patch("food.streams.redis.asyncio.Redis.from_url", side_effect=connections):
+            async with TrackingHub().subscribe(17) as queue:
+                while not (await publisher.pubsub_numsub(TRACKING_CHANNEL))[0][1]:
+                    await asyncio.sleep(0.005)
+
+                for message in messages:
+                    await publisher.publish(TRACKING_CHANNEL, message)
+
+                while not events or events[-1] is RESYNC:
+                    events.append(await asyncio.wait_for(queue.get(), timeout=1))
+
+        return events
+
+    def test_broken_message_is_skipped(self):
+        update = tracking_message(17, {"status": "cooked"}).encode()
+        events = asyncio.run(self.listen([], [b"not json", tracking_message(18, {}).encode(), update]))
+
+        self.assertEqual(events, [sse_event("update", {"status": "cooked"})])
+
+    def test_failed_listener_is_restarted(self):
+        update = tracking_message(17, {"status": "cooked"}).encode()
+        events = asyncio.run(self.listen([ValueError("Invalid URL")], [update]))
+
+        # updates could be missed while the listener is stopped
+        self.assertEqual(events, [RESYNC, sse_event("update", {"status": "cooked"})])
+
+
+class RetrieveOrderTestCase(CateringTestCase):
+    dish: Dish
+    order: Order
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        restaurant = Restaurant.objects.create(name="silpo", address="Street 1")
+        cls.dish = Dish.objects.create(name="Salad", price=100, restaurant=restaurant)
+        cls.order = Order.objects.create(
+            status=OrderStatus.NOT_STARTED, user=cls.user, delivery_provider="uklon", eta=date(2025, 7, 1), total=200
+        )
+        OrderItem.objects.create(order=cls.order, dish=cls.dish, quantity=2)
+
+    def setUp(self):
+        super().setUp()
+        self.url = f"/food/orders/{self.order.pk}/"
+
+        patcher = mock.patch("shared.cache._redis_client", fakeredis.FakeRedis())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.store = TrackingOrderStore()
+        self.store.create(self.order.pk, [1])
+        self.store.update_status(self.order.pk, OrderStatus.COOKING, sources=EARLIER[OrderStatus.COOKING])
+        self.store.update_restaurant(self.order.pk, 1, status=OrderStatus.COOKING)
+
+    def test_polling_does_not_query_database(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url)
+
+        self.assertEqual(
+            response.json(),
+            {
+                "id": self.order.pk,
+                "items": [{"dish": self.dish.pk, "quantity": 2}],
+                "eta": "2025-07-01",
+                "total": 200,
+                "delivery_provider": "uklon",
+                "status": "cooking",
+                "tracking": {"restaurants": {"1": {"status": "cooking", "external_id": None}}, "delivery": {}},
+            },
+        )
+
+        with self.assertNumQueries(0):
+            cached = self.client.get(self.url, HTTP_IF_NONE_MATCH=response["ETag"])
+
+        self.assertEqual(cached.status_code, 304)
+
+        self.store.update_status(self.order.pk, OrderStatus.COOKED, sources=EARLIER[OrderStatus.COOKED])
+        with self.assertNumQueries(0):
+            changed = self.client.get(self.url, HTTP_IF_NONE_MATCH=response["ETag"])
+
+        self.assertEqual(changed.status_code, 200)
+        self.assertEqual(changed.json()["status"], "cooked")
+
+    def test_not_tracked_order(self):
+        self.store.redis.delete(TrackingOrderStore._key(self.order.pk))
+
+        self.assertEqual(self.client.get(self.url).json()["status"], "not_started")
+        self.assertEqual(self.client.get("/food/orders/0/").status_code, 404)
+
+    def test_order_of_another_user(self):
+        self.assertEqual(self.client.get(self.url).status_code, 200)  # the document is stored
+
+        another = User.objects.create_user(email="john@catering.com", password="password", phone_number="0630000002")
+        self.client.force_authenticate(another)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+        self.client.force_authenticate(self.create_admin("admin@catering.com"))
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+
+
+class ProviderLimiterTestCase(RedisTestCase):
+    def test_token_bucket(self):
+        limiter = ProviderLimiter("silpo", rate=100, burst=2)
+
+        started = time.monotonic()
+        for _ in range(3):
+            self.assertIsNone(limiter.acquire())  # concurrency is not limited, there is no lease
+
+        # the burst is sent at once, the third request waits 10 ms for a token
+        self.assertGreaterEqual(time.monotonic() - started, 0.009)
+        self.assertEqual((limiter.stats.requests, limiter.stats.throttled), (3, 1))
+        self.assertGreater(limiter._try_acquire("next"), 0)  # the bucket is empty
+
+    def test_concurrency_leases(self):
+        limiter = ProviderLimiter("kfc", max_concurrency=2, limit_timeout=0.2)
+        first, second = limiter.acquire(), limiter.acquire()
+
+        with self.assertRaises(LimitExceeded):
+            limiter.acquire()  # polls for a free slot until the timeout
+
+        limiter.release(first)
+        third = limiter.acquire()
+
+        self.assertIsNone(self.redis.zscore("limits:kfc:leases", str(first)))
+        self.assertIsNotNone(self.redis.zscore("limits:kfc:leases", str(second)))
+        self.assertIsNotNone(self.redis.zscore("limits:kfc:leases", str(third)))
+        self.assertEqual(limiter.stats.rejected, 1)
+
+    def test_too_many_requests_empties_bucket(self):
+        limiter = ProviderLimiter("uklon", rate=10, burst=10, max_concurrency=5, limit_timeout=1.0)
+        lease_id = limiter.acquire()
+
+        limiter.release(lease_id, httpx.Response(429, headers={"Retry-After": "3"}))
+
+        # every process waits about 3 seconds, more than the limit timeout
+        self.assertGreater(ProviderLimiter("uklon", rate=10, burst=10)._try_acquire("other"), 2.9)
+        with self.assertRaises(LimitExceeded):
+            limiter.acquire()
+        self.assertEqual(self.redis.zcard("limits:uklon:leases"), 0)
+        self.assertEqual((limiter.stats.too_many_requests, limiter.stats.rejected), (1, 1))
+
+    @mock.patch("shared.limits.get_redis_client")
+    def test_async_calls_do_not_block_the_loop(self, redis_mock):
+        threads: list[int] = []
+
+        def call_redis(*args, **kwargs) -> int:
+            threads.append(threading.get_ident())
+            return 0
+
+        redis_mock.return_value.register_script.return_value.side_effect = call_redis
+        redis_mock.return_value.zrem.side_effect = call_redis
+        limiter = ProviderLimiter("silpo", rate=10, max_concurrency=5)
+
+        async def call():
+            await limiter.release_async(await limiter.acquire_async())
+
+        asyncio.run(call())
+
+        # Redis is called from threads, not from the thread of the event loop
+        self.assertEqual(len(threads), 2)
+        self.assertNotIn(threading.get_ident(), threads)
+
+
+class ProviderGuardTestCase(RedisTestCase):
+    def test_retries(self):
+        guard = ProviderGuard("silpo", retries=2, retry_budget=1)
+        deadline, _ = guard.start()
+        post = httpx.Request("POST", "http://silpo/api/orders")
+        get = httpx.Request("GET", "http://silpo/api/orders/1")
+
+        # the POST may be received by the provider, so it is not sent again
+        self.assertIsNone(guard.retry_delay(post, 0, deadline, error=httpx.ReadTimeout("slow")))
+        self.assertIsNotNone(guard.retry_delay(post, 0, deadline, error=httpx.ConnectError("refused")))
+        self.assertIsNone(guard.retry_delay(get, 0, deadline, response=httpx.Response(503)))  # out of the budget
+        self.assertIsNone(guard.retry_delay(get, 0, deadline, response=httpx.Response(404)))
+        self.assertEqual((guard.stats.retries, guard.stats.budget_exhausted), (1, 1))
+
+    def test_open_circuit_fails_fast(self):
+        guard = ProviderGuard("kfc", failure_threshold=2, failure_window=30.0)
+        other = ProviderGuard("kfc")  # of another process
+
+        guard.finish(probe=False, error=httpx.ConnectTimeout("timeout"))
+        other.start()  # below the threshold
+        guard.finish(probe=False, response=httpx.Response(500))
+
+        with mock.patch.object(guard.breaker, "_allow") as allow_mock, self.assertRaises(CircuitOpen):
+            guard.start()
+        allow_mock.assert_not_called()  # known in the process
+
+        with self.assertRaises(CircuitOpen):
+            other.start()  # shared by processes
+
+        self.assertEqual((guard.stats.failures, guard.stats.opened, guard.stats.fast_failures), (2, 1, 1))
+
+    def test_half_open_probe(self):
+        guard = ProviderGuard("uklon", failure_threshold=1, open_timeout=0.05)
+        guard.finish(probe=False, error=httpx.ConnectError("refused"))
+        time.sleep(0.06)
+
+        # only one call probes the provider after the open timeout
+        _, probe = ProviderGuard("uklon").start()
+        self.assertTrue(probe)
+        with self.assertRaises(CircuitOpen):
+            ProviderGuard("uklon").start()
+
+        # the failed probe opens the breaker again, the next one closes it
+        guard.finish(probe=True, response=httpx.Response(503))
+        self.assertTrue(self.redis.exists("breakers:uklon:open"))
+        time.sleep(0.06)
+
+        _, probe = guard.start()
+        self.assertTrue(probe)
+        guard.finish(probe=True, response=httpx.Response(200))
+
+        self.assertEqual(ProviderGuard("uklon").start()[1], False)
+        self.assertEqual(self.redis.keys("breakers:uklon:*"), [])
+
+    @mock.patch("shared.resilience.get_redis_client")
+    def test_async_calls_do_not_block_the_loop(self, redis_mock):
+        threads: list[int] = []
+
+        def call_redis(*args, **kwargs) -> int:
+            threads.append(threading.get_ident())
+            return 1
+
+        redis_mock.return_value.register_script.return_value.side_effect = call_redis
+        guard = ProviderGuard("uklon", failure_threshold=1)
+
+        async def call():
+            _, probe = await guard.start_async()
+            await guard.finish_async(probe, response=httpx.Response(200))  # nothing to record
+            await guard.finish_async(probe, error=httpx.ConnectError("refused"))
+
+        asyncio.run(call())
+
+        self.assertEqual(len(threads), 2)  # the check and the failure
+        self.assertNotIn(threading.get_ident(), threads)
+        self.assertEqual(guard.stats.opened, 1)
+
+
+class DeliveryConsolidationTestCase(CateringTestCase):
+    orders: list[Order]
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        silpo = Restaurant.objects.create(name="silpo", address="Street 1")
+        kfc = Restaurant.objects.create(name="kfc", address="Street 2")
+        salad = Dish.objects.create(name="Salad", price=100, restaurant=silpo)
+        burger = Dish.objects.create(name="Burger", price=100, restaurant=kfc)
+
+        cls.orders = []
+        for dishes in ([salad, burger], [burger, salad, salad], [salad]):
+            order = Order.objects.create(
+                status=OrderStatus.COOKED, user=cls.user, delivery_provider="uklon", eta=date(2025, 7, 1), total=100
+            )
+            OrderItem.objects.bulk_create(OrderItem(order=order, dish=dish, quantity=1) for dish in dishes)
+            cls.orders.append(order)
+
+    @mock.patch("food.deliveries.get_redis_client")
+    def test_orders_with_same_pickups_are_grouped(self, redis_mock):
+        first, second, alone = (order.pk for order in self.orders)
+        now = time.time()
+        redis_mock.return_value.zrange.return_value = [
+            (str(first).encode(), now - DELIVERY_WINDOW),
+            (str(second).encode(), now),  # goes with the first one
+            (str(alone).encode(), now),  # waits for other orders with the same pickups
+        ]
+        redis_mock.return_value.pipeline.return_value.execute.return_value = [1, 1]
+
+        with self.assertNumQueries(1):
+            groups = DeliveryWindow().take_due()
+
+        self.assertEqual([group.order_ids for group in groups], [[first, second]])
+        self.assertEqual(groups[0].pickups, (("kfc", "Street 2"), ("silpo", "Street 1")))
+
+    @mock.patch("food.services.LocationStore")
+    @mock.patch("food.services.TrackingOrderStore")
+    @mock.patch("food.services.CacheService")
+    @mock.patch("food.services.transition", return_value=True)
+    @mock.patch("food.services.uklon.Client.create_order")
+    def test_one_trip_for_many_orders(self, create_mock, transition_mock, cache_mock, *_):
+        order_ids = [order.pk for order in self.orders[:2]]
+        create_mock.return_value = uklon.OrderResponse(
+            id="uklon-1", status=uklon.OrderStatus.DELIVERY, location=(50.45, 30.52), addresses=[], comments=[]
+        )
+
+        deliver_orders(order_ids)
+
+        body = create_mock.call_args.args[0]
+        self.assertEqual(body.addresses, ["Street 2", "Street 1"])
+        pipe = cache_mock.return_value.pipeline.return_value.__enter__.return_value
+        pipe.set.assert_called_once_with(
+            namespace="uklon_orders", key="uklon-1", value={"internal_order_ids": order_ids}
+        )
+        self.assertIn(mock.call(order_ids[1], OrderStatus.DELIVERY, pipe=pipe.pipe), transition_mock.call_args_list)
+
+        # mappings created before consolidation
+        self.assertEqual(uklon_order_ids({"internal_order_id": 17}), [17])
+
+    @mock.patch("food.services.LocationStore")
+    @mock.patch("food.services.TrackingOrderStore")
+    @mock.patch("food.services.CacheService")
+    @mock.patch("food.services.transition", return_value=True)
+    @mock.patch("food.services.uklon.Client.create_order")
+    def test_trip_is_not_started(self, create_mock, transition_mock, *_):
+        create_mock.return_value = uklon.OrderResponse(
+            id="uklon-1", status=uklon.OrderStatus.NOT_STARTED, location=(50.45, 30.52), addresses=[], comments=[]
+        )
+
+        deliver_orders([self.orders[0].pk])
+
+        transition_mock.assert_called_once_with(self.orders[0].pk, OrderStatus.DELIVERY_LOOKUP)
+
+    def test_unsent_groups_wait_for_next_run(self):
+        first, second, alone = (order.pk for order in self.orders)
+        redis_client = fakeredis.FakeRedis()
+        now = time.time()
+        redis_client.zadd(DeliveryWindow.KEY, {str(first): now - 30, str(second): now - 30, str(alone): now - 25})
+
+        with (
+            mock.patch("shared.cache._redis_client", redis_client),
+            mock.patch("food.services.orders_delivery.delay", side_effect=[None, ConnectionError]) as delay_mock,
+        ):
+            with self.assertRaises(ConnectionError):
+                consolidate_deliveries()
+
+        self.assertEqual(delay_mock.call_args_list, [mock.call([first, second]), mock.call([alone])])
+        self.assertEqual(redis_client.zrange(DeliveryWindow.KEY, 0, -1), [str(alone).encode()])
+
+    def test_delivery_is_not_requested(self):
+        order_ids = [order.pk for order in self.orders[:2]]
+        redis_client = fakeredis.FakeRedis()
+
+        with (
+            mock.patch("shared.cache._redis_client", redis_client),
+            mock.patch("food.services.uklon.Client.create_order", side_effect=httpx.ConnectError("refused")),
+        ):
+            deliver_orders(order_ids)
+
+        # orders are not stuck in the delivery lookup, they are delivered by the next run
+        self.assertEqual(set(Order.objects.filter(id__in=order_ids).values_list("status", flat=True)), {"cooked"})
+        self.assertEqual(redis_client.zcard(DeliveryWindow.KEY), 2)
+
+    def test_delivery_could_be_created(self):
+        order_ids = [order.pk for order in self.orders[:2]]
+
+        with (
+            mock.patch("shared.cache._redis_client", fakeredis.FakeRedis()),
+            mock.patch("food.services.uklon.Client.create_order", side_effect=httpx.ReadTimeout("timeout")),
+        ):
+            with self.assertRaises(httpx.ReadTimeout):
+                deliver_orders(order_ids)
+
+        self.assertEqual(set(Order.objects.filter(id__in=order_ids).values_list("status", flat=True)), {"failed"})
+
+
+class TrackingOrderStoreTestCase(RedisTestCase):
+    def setUp(self):
+        super().setUp()
+        self.store = TrackingOrderStore()
+        self.store.create(17, [1, 2])
+
+    def test_restaurant_status_moves_forward(self):
+        self.store.update_restaurant(17, 1, status=OrderStatus.COOKED, external_id="13")
+        self.store.update_restaurant(17, 1, status=OrderStatus.COOKING)  # a late poll
+        self.store.update_restaurant(17, 2, status=OrderStatus.COOKING)
+        self.store.update_restaurant(17, 2, status=OrderStatus.CANCELLED_BY_RESTAURANT)
+
+        tracking_order = self.store.get(17) or TrackingOrder()
+        self.assertEqual(tracking_order.restaurants["1"], {"status": OrderStatus.COOKED, "external_id": "13"})
+        self.assertEqual(tracking_order.restaurants["2"]["status"], OrderStatus.CANCELLED_BY_RESTAURANT)
+
+    def test_order_status_moves_from_sources(self):
+        pubsub = self.redis.pubsub()
+        pubsub.subscribe(TRACKING_CHANNEL)
+        pubsub.get_message(timeout=0.01)  # the subscription is confirmed
+
+        self.store.update_status(17, OrderStatus.COOKED, sources=EARLIER[OrderStatus.COOKED])
+        self.store.update_status(17, OrderStatus.COOKING, sources=EARLIER[OrderStatus.COOKING])  # a late update
+
+        self.assertEqual((self.store.get(17) or TrackingOrder()).status, OrderStatus.COOKED)
+        # only the applied update is published
+        messages = iter(lambda: pubsub.get_message(timeout=0.01), None)
+        self.assertEqual(
+            [json.loads(message["data"]) for message in messages], [{"order_id": 17, "update": {"status": "cooked"}}]
+        )
+
+    def test_all_cooked_is_claimed_once(self):
+        self.store.update_restaurant(17, 1, status=OrderStatus.COOKED)
+        self.assertFalse(self.store.claim_all_cooked(17))
+
+        self.store.update_restaurant(17, 2, status=OrderStatus.COOKED)
+        self.assertTrue(self.store.claim_all_cooked(17))
+        self.assertFalse(self.store.claim_all_cooked(17))
+
+        # the order is not tracked
+        self.assertFalse(self.store.claim_all_cooked(18))
+
+
+class SilpoPollerTestCase(RedisTestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch("food.polling.time")
+        self.time = patcher.start().time
+        self.addCleanup(patcher.stop)
+
+        self.time.return_value = 1000.0
+        self.registry = SilpoTrackingRegistry()
+        self.registry.register("13", order_id=17, restaurant_id=1, status=OrderStatus.NOT_STARTED)  # polled in 2s
+        self.registry.register("14", order_id=18, restaurant_id=1, status=OrderStatus.COOKING)  # polled in 1s
+
+    def test_due_orders(self):
+        self.time.return_value = 1001.5
+        self.assertEqual([tracked.external_id for tracked in self.registry.due()], ["14"])
+
+        self.time.return_value = 1002.5
+        self.assertEqual([tracked.external_id for tracked in self.registry.due()], ["14", "13"])
+
+        self.redis.hdel(SilpoTrackingRegistry.ORDERS_KEY, "13")
+        self.assertEqual([tracked.external_id for tracked in self.registry.due()], ["14"])
+        self.assertIsNone(self.redis.zscore(SilpoTrackingRegistry.SCHEDULE_KEY, "13"))
+
+    @mock.patch("food.services.all_orders_cooked")
+    @mock.patch("food.services.transition")
+    @mock.patch("food.services.silpo.Client")
+    def test_poll(self, client_mock, transition_mock, cooked_mock):
+        statuses = {"13": silpo.OrderStatus.NOT_STARTED, "14": silpo.OrderStatus.COOKED}
+        client_mock.return_value.get_order.side_effect = lambda external_id: silpo.OrderResponse(
+            id=external_id, status=statuses[external_id]
+        )
+
+        self.time.return_value = 1010.0
+        poll_silpo_orders()
+
+        # the same status backs off, the cooked order is not polled anymore
+        self.assertEqual(self.redis.zscore(SilpoTrackingRegistry.SCHEDULE_KEY, "13"), 1013.0)
+        self.assertEqual(len(self.registry), 1)
+        cooked_mock.assert_called_once_with(18)
+        transition_mock.assert_not_called()
+        self.assertIsNone(self.redis.get(SilpoTrackingRegistry.LOCK_KEY))
+
+    @mock.patch("food.services.transition")
+    @mock.patch("food.services.silpo.Client")
+    def test_unknown_order_does_not_stop_others(self, client_mock, _):
+        # Silpo answers without the status for orders it does not know
+        statuses: dict[str, Any] = {"13": None, "14": silpo.OrderStatus.COOKING}
+        client_mock.return_value.get_order.side_effect = lambda external_id: silpo.OrderResponse(
+            id=external_id, status=statuses[external_id]
+        )
+
+        for poll in range(1, POLL_MAX_FAILURES + 1):
+            self.time.return_value = 1000.0 + 100 * poll
+            poll_silpo_orders()
+
+            if poll < POLL_MAX_FAILURES:
+                payload = cast(bytes, self.redis.hget(SilpoTrackingRegistry.ORDERS_KEY, "13"))
+                self.assertEqual(json.loads(payload)["failures"], poll)
+
+        # the order "14" is still polled
+        self.assertEqual(client_mock.return_value.get_order.call_count, 2 * POLL_MAX_FAILURES)
+        self.assertEqual(self.redis.hkeys(SilpoTrackingRegistry.ORDERS_KEY), [b"14"])
+        self.assertEqual(self.redis.zcard(SilpoTrackingRegistry.SCHEDULE_KEY), 1)
+
+    @mock.patch("food.services.silpo.Client")
+    def test_stopped_orders_are_not_polled(self, client_mock):
+        user = User.objects.create_user(email="jane@catering.com", password="password", phone_number="0630000001")
+        order = Order.objects.create(
+            status=OrderStatus.CANCELLED_BY_CUSTOMER, user=user, delivery_provider="uklon", eta=date.today(), total=100
+        )
+        self.registry.register("15", order_id=order.pk, restaurant_id=1, status=OrderStatus.COOKING)
+        client_mock.return_value.get_order.side_effect = httpx.ConnectError("Silpo is not available")
+
+        self.time.return_value = 1010.0
+        poll_silpo_orders()
+
+        self.assertEqual(len(self.registry), 2)
+        self.assertEqual([call.args for call in client_mock.return_value.get_order.call_args_list], [("14",), ("13",)])
+
+    def test_lock_is_released_by_its_owner(self):
+        token = cast(str, self.registry.acquire_lock())
+        self.assertTrue(token)
+        self.assertIsNone(self.registry.acquire_lock())
+
+        # the lock expired and is taken by another poller
+        self.redis.set(SilpoTrackingRegistry.LOCK_KEY, "another")
+        self.registry.release_lock(token)
+
+        self.assertEqual(self.redis.get(SilpoTrackingRegistry.LOCK_KEY), b"another")
+
+
+class CacheServiceTestCase(RedisTestCase):
+    def setUp(self):
+        super().setUp()
+        self.service = CacheService()
+
+    def test_pipeline(self):
+        self.service.set("orders", "18", {"id": 18})
+
+        with self.service.pipeline() as pipe:
+            pipe.set("orders", "17", {"id": 17})
+            pipe.get("orders", "17")
+            pipe.pipe.hset("orders_meta", "17", "raw")  # results of raw commands are not decoded
+            pipe.delete("orders", "18")
+            pipe.get("orders", "18")
+
+        self.assertEqual(pipe.results, [True, {"id": 17}, 1, 1, None])
+        self.assertEqual(self.service.get_many("orders", ["17", "18"]), {"17": {"id": 17}})
+
+    def test_legacy_payloads(self):
+        # written by the Django Redis backend before codecs: pickled JSON strings
+        legacy = pickle.dumps(json.dumps({"id": 17}), pickle.HIGHEST_PROTOCOL)
+        self.redis.set(self.service._make_key("orders", "17"), legacy)
+
+        self.assertEqual(legacy[0], codecs.PICKLE_PROTOCOL_BYTE)
+        self.assertEqual(self.service.get("orders", "17"), {"id": 17})
+
+        self.assertEqual(codecs.decode(codecs.encode(codecs.get_codec("json"), {"id": 18})), {"id": 18})
+        with self.assertRaises(ValueError):
+            codecs.decode(b"\x7f{}")
+
+    @staticmethod
+    def wait_for(condition: Callable[[], Any], timeout: float = 1.0) -> None:
+        deadline = time.monotonic() + timeout
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.005)
+
+    @mock.patch.multiple("shared.local_cache", _tiers={}, _listener=None, _pid=None, _token="", _subscribed=None)
+    def test_local_tier_is_invalidated_by_other_processes(self):
+        tier = cast(LocalCache, self.service._local("kfc_orders"))
+        # subscribed before the tier is used
+        self.assertEqual(self.redis.pubsub_numsub(INVALIDATION_CHANNEL), [(INVALIDATION_CHANNEL.encode(), 1)])
+
+        self.service.set("kfc_orders", "13", {"internal_order_id": 17})
+        self.service.set("kfc_orders", "13", {"internal_order_id": 18})
+        # another process overwrites the key
+        self.redis.set(
+            self.service._make_key("kfc_orders", "13"),
+            codecs.encode(codecs.get_codec("json"), {"internal_order_id": 19}),
+        )
+        self.redis.publish(INVALIDATION_CHANNEL, "another|kfc_orders|13")
+        self.wait_for(lambda: tier.stats.invalidations)
+
+        # own messages are skipped
+        self.assertEqual(tier.stats.invalidations, 1)
+        self.assertEqual(self.service.get("kfc_orders", "13"), {"internal_order_id": 19})
+        self.assertEqual(self.service.get("kfc_orders", "13"), {"internal_order_id": 19})
+        self.assertEqual(tier.stats.hits, 1)
+
+    @mock.patch.multiple("shared.local_cache", _tiers={}, _listener=None, _pid=None, _token="", _subscribed=None)
+    def test_broken_invalidations_are_skipped(self):
+        self.service.set("kfc_orders", "13", {"internal_order_id": 17})
+        tier = cast(LocalCache, self.service._local("kfc_orders"))
+
+        for message in [b"broken", b"\xff|kfc_orders|13", b"another|kfc_orders|13"]:
+            self.redis.publish(INVALIDATION_CHANNEL, message)
+        self.wait_for(lambda: tier.stats.invalidations)
+
+        self.assertEqual(tier.stats.invalidations, 1)
+        self.assertTrue(local_cache._listener and local_cache._listener.is_alive())
+
+
+class LocalProviderHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+    server: "LocalProvider"
+
+    def do_GET(self):
+        time.sleep(self.server.delay)
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"{}")
+
+    def log_message(self, *args):
+        pass
+
+
+class LocalProvider(http.server.ThreadingHTTPServer):
+    delay = 0.0
+
+
+class HTTPClientsTestCase(RedisTestCase):
+    """Pools of the `local` provider, served by the HTTP server in a thread."""
+
+    def setUp(self):
+        super().setUp()
+        self.provider = LocalProvider(("127.0.0.1", 0), LocalProviderHandler)
+        self.url = f"http://127.0.0.1:{self.provider.server_port}/orders"
+        threading.Thread(target=self.provider.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True).start()
+        self.addCleanup(self.provider.server_close)
+        self.addCleanup(self.provider.shutdown)
+
+        patcher = mock.patch.multiple(
+            "shared.http_clients",
+            _clients={},
+            _async_clients=weakref.WeakKeyDictionary(),
+            _stats={},
+            _limiters={},
+            _guards={},
+            _loop=None,
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(http_clients.close_clients)
+
+    def pool_stats(self) -> dict:
+        stats = http_clients.pool_stats()["local"]
+        return {name: stats[name] for name in ("requests", "hits", "misses", "waits")}
+
+    def test_connections_are_reused(self):
+        for _ in range(3):
+            http_clients.get_client("local").get(self.url).raise_for_status()
+
+        self.assertEqual(self.pool_stats(), {"requests": 3, "hits": 2, "misses": 1, "waits": 0})
+        self.assertEqual(http_clients.resilience_stats()["local"]["calls"], 3)
+
+    @override_settings(HTTP_PROVIDERS={"local": {"max_connections": 1}})
+    def test_requests_wait_for_connections(self):
+        self.provider.delay = 0.05
+        client = http_clients.get_client("local")
+
+        requests = [threading.Thread(target=client.get, args=(self.url,)) for _ in range(2)]
+        for request in requests:
+            request.start()
+        for request in requests:
+            request.join()
+
+        self.assertEqual(self.pool_stats(), {"requests": 2, "hits": 1, "misses": 1, "waits": 1})
+
+    def test_clients_are_closed(self):
+        async def get() -> httpx.AsyncClient:
+            client = http_clients.get_async_client("local")
+            for _ in range(2):
+                (await client.get(self.url)).raise_for_status()
+            return client
+
+        async_client = http_clients.run_in_loop(get())
+        client = http_clients.get_client("local")
+        self.assertEqual(http_clients.pool_stats()["local"]["hits"], 1)
+
+        http_clients.close_clients()
+
+        self.assertTrue(client.is_closed)
+        self.assertTrue(async_client.is_closed)
+        self.assertIsNone(http_clients._loop)
+
+    def test_lifespan_shutdown_closes_clients(self):
+        events = iter([{"type": "lifespan.startup"}, {"type": "lifespan.shutdown"}])
+        sent: list[dict] = []
+
+        async def receive() -> Any:
+            return next(events)
+
+        async def send(message: Any) -> None:
+            sent.append(message)
+
+        async def serve() -> httpx.AsyncClient:
+            client = http_clients.get_async_client("local")
+            await client.get(self.url)
+            await with_tracking_stream(mock.AsyncMock())(cast(Scope, {"type": "lifespan"}), receive, send)
+            return client
+
+        client = http_clients.get_client("local")
+        async_client = asyncio.run(serve())
+
+        self.assertEqual(
+            [message["type"] for message in sent], ["lifespan.startup.complete", "lifespan.shutdown.complete"]
+        )
+        self.assertTrue(client.is_closed)
+        self.assertTrue(async_client.is_closed)
+
+    def test_stats_are_served_to_admins(self):
+        http_clients.get_client("local").get(self.url)
+        api = APIClient()
+
+        api.force_authenticate(CateringTestCase.create_admin("admin@catering.com"))
+        stats = api.get("/food/stats/").json()
+        self.assertEqual(stats["pools"]["local"]["requests"], 1)
+        self.assertEqual(set(stats), {"pools", "limits", "resilience", "local_cache"})
+
+        api.force_authenticate(User.objects.create_user(email="jane@catering.com", password="password"))
+        self.assertEqual(api.get("/food/stats/").status_code, 403)
+
+    @mock.patch("shared.metrics.print", create=True)
+    @mock.patch("shared.metrics._logged_at", None)
+    @mock.patch("shared.metrics.time.monotonic", side_effect=[100.0, 130.0, 161.0])
+    def test_stats_are_logged_periodically(self, _, print_mock):
+        for _ in range(3):
+            metrics.log_stats()
+
+        self.assertEqual(print_mock.call_count, 2)
@@ -0,0 +1,287 @@
+"""
+TrackingOrder storage backed by Redis hashes.
+
+Each field is updated separately, so a status change is one round trip
+and concurrent updates of different restaurants do not overwrite each other.
+
+REDIS STRUCTURE:
+    orders:17  HASH  {
+        "status": "cooking",  // the Order status, set by `food.states.transition`
+        "restaurant:1:status": "cooking",
+        "restaurant:1:external_id": "13",
+        "restaurant:2:status": "not_started",
+        "restaurant:2:external_id": "",
+        "delivery:status": "delivery",
+        "cooked": "1",  // set once, when all restaurants are cooked
+    }
+
+The delivery location is kept by `food.locations.LocationStore` and added on read.
+Every update is also published to live streams, see `food.streams`.
+"""
+
+import json
+from dataclasses import dataclass, field
+from typing import Any, Iterable
+
+from redis.client import Pipeline
+
+from shared.cache import CacheService, get_redis_client
+
+from .enums import OrderStatus
+from .locations import location_key
+from .streams import TRACKING_CHANNEL, tracking_message
+
+ORDER_LIFE_TIME = 604800
+
+# returns 1 only for the first caller which sees all restaurants COOKED
+CLAIM_ALL_COOKED_SCRIPT = """
+local fields = redis.call('HGETALL', KEYS[1])
+local restaurants = 0
+for i = 1, #fields, 2 do
+    local name = fields[i]
+    if string.sub(name, 1, 11) == 'restaurant:' and string.sub(name, -7) == ':status' then
+        restaurants = restaurants + 1
+        if fields[i + 1] ~= ARGV[1] then
+            return 0
+        end
+    end
+end
+if restaurants == 0 then
+    return 0
+end
+return redis.call('HSETNX', KEYS[1], 'cooked', 1)
+"""
+
+# sets the ARGV[1] field to the ARGV[2] status only if the current one is one of ARGV[6..], or missing,
+# and publishes the ARGV[5] message
+UPDATE_STATUS_SCRIPT = """
+local current = redis.call('HGET', KEYS[1], ARGV[1])
+local allowed = current == false
+for i = 6, #ARGV do
+    if current == ARGV[i] then
+        allowed = true
+    end
+end
+if not allowed then
+    return 0
+end
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+redis.call('PUBLISH', ARGV[4], ARGV[5])
+return 1
+"""
+
+# restaurants move along this path, or leave it to a final status
+RESTAURANT_PROGRESS: list[OrderStatus] = [OrderStatus.NOT_STARTED, OrderStatus.COOKING, OrderStatus.COOKED]
+
+# a restaurant status is only moved forward, so a late "cooking" does not overwrite "cooked"
+RESTAURANT_EARLIER: dict[OrderStatus, list[OrderStatus]] = {
+    status: (
+        RESTAURANT_PROGRESS[: RESTAURANT_PROGRESS.index(status)]
+        if status in RESTAURANT_PROGRESS
+        else RESTAURANT_PROGRESS
+    )
+    for status in OrderStatus
+}
+
+
+@dataclass
+class TrackingOrder:
+    """
+    {
+        17: {  // internal Order.id
+            restaurants: {
+                1: {  // internal restaurant id
+                    status: NOT_STARTED, // internal
+                    external_id: 13,
+                },
+                2: {  // internal restaurant id
+                    status: NOT_STARTED, // internal
+                    external_id: edf055b8-06e8-40ed-ab35-300fef3e0a5d,
+                },
+            },
+            delivery: {
+                location: (..., ...),
+                status: NOT STARTED, DELIVERY, DELIVERED
+            }
+        },
+        18: ...
+    }
+    """
+
+    restaurants: dict = field(default_factory=dict)
+    delivery: dict = field(default_factory=dict)
+    status: str | None = None
+
+
+class TrackingOrderStore:
+    NAMESPACE = "orders"
+
+    def __init__(self):
+        self.redis = get_redis_client()
+        self._claim_all_cooked = self.redis.register_script(CLAIM_ALL_COOKED_SCRIPT)
+        self._update_status = self.redis.register_script(UPDATE_STATUS_SCRIPT)
+
+    @classmethod
+    def _key(cls, order_id: int | str) -> str:
+        return CacheService._build_key(cls.NAMESPACE, str(order_id))
+
+    def _hset(
+        self,
+        order_id: int | str,
+        mapping: dict[str, Any],
+        update: dict[str, Any],
+        pipe: Pipeline | None = None,
+    ) -> None:
+        """Update only passed fields, refresh the TTL and publish the `update` in one round trip.
+
+        If the pipeline is passed, commands are queued to be sent with other cache operations.
+        """
+
+        key = self._key(order_id)
+        _pipe = pipe if pipe is not None else self.redis.pipeline()
+        _pipe.hset(key, mapping=mapping)
+        _pipe.expire(key, ORDER_LIFE_TIME)
+        _pipe.publish(TRACKING_CHANNEL, tracking_message(order_id, update))
+
+        if pipe is None:
+            _pipe.execute()
+
+    def create(self, order_id: int, restaurant_ids: list[int], pipe: Pipeline | None = None) -> None:
+        mapping: dict[str, Any] = {"status": OrderStatus.NOT_STARTED}
+        for restaurant_id in restaurant_ids:
+            mapping[f"restaurant:{restaurant_id}:status"] = OrderStatus.NOT_STARTED
+            mapping[f"restaurant:{restaurant_id}:external_id"] = ""
+
+        key = self._key(order_id)
+        _pipe = pipe if pipe is not None else self.redis.pipeline()
+        _pipe.delete(key)
+        _pipe.hset(key, mapping=mapping)
+        _pipe.expire(key, ORDER_LIFE_TIME)
+
+        if pipe is None:
+            _pipe.execute()
+
+    def get(self, order_id: int | str) -> TrackingOrder | None:
+        return self.get_many([order_id])[order_id]
+
+    def get_many(self, order_ids: list[int | str]) -> dict[int | str, TrackingOrder | None]:
+        """Fetch many orders with their latest locations in one round trip."""
+
+        pipe = self.redis.pipeline(transaction=False)
+        for order_id in order_ids:
+            pipe.hgetall(self._key(order_id))
+            pipe.get(location_key(order_id))
+
+        results = pipe.execute()
+
+        return {
+            order_id: self._parse(payload, point)
+            for order_id, payload, point in zip(order_ids, results[::2], results[1::2])
+        }
+
+    @staticmethod
+    def _parse(payload: dict[bytes, bytes], point: bytes | None) -> TrackingOrder | None:
+        if not payload:
+            return None
+
+        tracking_order = TrackingOrder()
+        for raw_name, raw_value in payload.items():
+            name, value = raw_name.decode(), raw_value.decode()
+
+            match name.split(":"):
+                case ["status"]:
+                    tracking_order.status = value
+                case ["restaurant", restaurant_id, attribute]:
+                    restaurant = tracking_order.restaurants.setdefault(restaurant_id, {})
+                    restaurant[attribute] = value or None
+                case ["delivery", attribute]:
+                    tracking_order.delivery[attribute] = value
+
+        if point is not None:
+            tracking_order.delivery["location"] = json.loads(point)[:2]  # without the timestamp
+
+        return tracking_order
+
+    def update_status(
+        self,
+        order_id: int | str,
+        status: OrderStatus,
+        sources: Iterable[OrderStatus],
+        pipe: Pipeline | None = None,
+    ) -> None:
+        """Set the status if the cached one is one of `sources`, so late updates do not move it backwards."""
+
+        self._set_status(order_id, "status", status, {"status": status}, sources, pipe=pipe)
+
+    def _set_status(
+        self,
+        order_id: int | str,
+        name: str,
+        status: OrderStatus,
+        update: dict[str, Any],
+        sources: Iterable[OrderStatus],
+        pipe: Pipeline | None = None,
+    ) -> None:
+        self._update_status(
+            keys=[self._key(order_id)],
+            args=[
+                name,
+                str(status),
+                ORDER_LIFE_TIME,
+                TRACKING_CHANNEL,
+                tracking_message(order_id, update),
+                *map(str, sources),
+            ],
+            client=pipe if pipe is not None else self.redis,
+        )
+
+    def update_restaurant(
+        self,
+        order_id: int | str,
+        restaurant_id: int | str,
+        status: OrderStatus | None = None,
+        external_id: str | None = None,
+        pipe: Pipeline | None = None,
+    ) -> None:
+        """Set the external id and the status if it is later than the cached one, in one round trip."""
+
+        _pipe = pipe if pipe is not None else self.redis.pipeline()
+
+        if external_id is not None:
+            self._hset(
+                order_id,
+                {f"restaurant:{restaurant_id}:external_id": external_id},
+                {"restaurants": {str(restaurant_id): {"external_id": external_id or None}}},
+                pipe=_pipe,
+            )
+        if status is not None:
+            self._set_status(
+                order_id,
+                f"restaurant:{restaurant_id}:status",
+                status,
+                {"restaurants": {str(restaurant_id): {"status": status}}},
+                RESTAURANT_EARLIER[status],
+                pipe=_pipe,
+            )
+
+        if pipe is None:
+            _pipe.execute()
+
+    def update_delivery(
+        self,
+        order_id: int | str,
+        status: OrderStatus | None = None,
+        pipe: Pipeline | None = None,
+    ) -> None:
+        if status is not None:
+            self._hset(order_id, {"delivery:status": status}, {"delivery": {"status": status}}, pipe=pipe)
+
+    def claim_all_cooked(self, order_id: int | str) -> bool:
+        """Atomically check that all restaurants are COOKED.
+
+        Returns `True` only once per order, so concurrent callers
+        (webhooks, poller) do not start the delivery twice.
+        """
+
+        return bool(self._claim_all_cooked(keys=[self._key(order_id)], args=[str(OrderStatus.COOKED)]))
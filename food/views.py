@@ -1,29 +1,50 @@
-import csv
-import io
-import json
-from dataclasses import asdict
+import uuid
 from datetime import date
-from typing import Any, cast
+from typing import Any
 
+from celery import Task
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.files.storage import default_storage
+from django.core.handlers.asgi import ASGIRequest
 from django.db import transaction
+from django.db.models import QuerySet, prefetch_related_objects
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import redirect
-from django.utils.decorators import method_decorator
-from django.views.decorators.cache import cache_page
+from django.utils.http import parse_etags
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 from rest_framework import permissions, routers, serializers, viewsets
 from rest_framework.decorators import action
-from rest_framework.exceptions import ValidationError
-from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import CursorPagination
 from rest_framework.request import Request
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 
-from shared.cache import CacheService
+from shared.metrics import process_stats
 from users.models import Role, User
 
+from . import webhooks
 from .enums import DeliveryProvider
-from .mapper import PROVIDER_EXTERNAL_TO_INTERNAL
-from .models import Dish, Order, OrderItem, OrderStatus, Restaurant
-from .services import TrackingOrder, all_orders_cooked, schedule_order
+from .exports import EXPORT_FORMATS, async_stream, export_rows
+from .imports import ImportJobs, ImportStatus
+from .locations import record_uklon_location
+from .menu import MenuCache
+from .models import Dish, DispatchItem, Order, OrderItem, OrderStatus, Restaurant, RestaurantRef
+from .payloads import OrderDispatch
+from .read_models import OrderReadModel
+from .services import (
+    SUPPORTED_RESTAURANTS,
+    import_dishes_file,
+    kfc_order_webhook,
+    schedule_order,
+    schedule_orders,
+    uklon_order_webhook,
+)
+from .webhooks import WebhookEvent
+
+ORDERS_BATCH_LIMIT = 500
+DISH_IMPORT_SESSION_KEY = "dish_import_job"
 
 
 class DishSerializer(serializers.ModelSerializer):
@@ -41,8 +62,21 @@ class RestaurantSerializer(serializers.ModelSerializer):
         fields = "__all__"
 
 
+class DishPrimaryKeyField(serializers.PrimaryKeyRelatedField):
+    """Accept the dish id without a query. Dishes are resolved in bulk by `OrderSerializer.validate_items`."""
+
+    def to_internal_value(self, data) -> int:
+        if isinstance(data, bool):
+            self.fail("incorrect_type", data_type=type(data).__name__)
+
+        try:
+            return int(data)
+        except (TypeError, ValueError):
+            self.fail("incorrect_type", data_type=type(data).__name__)
+
+
 class OrderItemSerializer(serializers.Serializer):
-    dish = serializers.PrimaryKeyRelatedField(queryset=Dish.objects.all())
+    dish = DishPrimaryKeyField(queryset=Dish.objects.all())
     quantity = serializers.IntegerField(min_value=1, max_value=20)
 
 
@@ -65,9 +99,67 @@ class OrderSerializer(serializers.Serializer):
 
         return total
 
-    # validate_<any-fieldname>
-    # def validate_items(self, value: date):
-    #     raise ValidationError("Some error")
+    @property
+    def items_by_restaurant(self) -> dict[RestaurantRef, list[DispatchItem]]:
+        """Group validated items like `Order.items_by_restaurant`, dishes must be loaded with restaurants."""
+
+        results: dict[RestaurantRef, list[DispatchItem]] = {}
+
+        for item in self.validated_data["items"]:
+            dish: Dish = item["dish"]
+            restaurant = RestaurantRef(id=dish.restaurant.pk, name=dish.restaurant.name)
+            results.setdefault(restaurant, []).append(
+                DispatchItem(dish=dish.name, quantity=item["quantity"], restaurant_id=restaurant.id)
+            )
+
+        return results
+
+    @staticmethod
+    def prefetch_dishes(orders: list) -> dict[int, Dish]:
+        """Load dishes of many raw orders with restaurants with a single query.
+
+        Pass the result as the `dishes` context to skip the query of each order.
+        Malformed items are skipped here and reported by the order validation.
+        """
+
+        dish_ids: set[int] = set()
+
+        for order in orders:
+            items = order.get("items") if isinstance(order, dict) else None
+            for item in items if isinstance(items, list) else []:
+                try:
+                    dish_ids.add(int(item["dish"]))
+                except (KeyError, TypeError, ValueError):
+                    continue
+
+        return OrderSerializer.load_dishes(dish_ids)
+
+    @staticmethod
+    def load_dishes(dish_ids: set[int]) -> dict[int, Dish]:
+        """Dishes with their restaurants, which `items_by_restaurant` reads."""
+
+        return Dish.objects.select_related("restaurant").in_bulk(dish_ids)
+
+    def validate_items(self, value: list[dict]) -> list[dict]:
+        """Resolve all dishes with a single query, or take them from the `dishes` context only.
+
+        Dishes of restaurants which are not processed are rejected, so such orders are not saved.
+        """
+
+        dishes: dict[int, Dish] | None = self.context.get("dishes")
+        if dishes is None:
+            dishes = self.load_dishes({item["dish"] for item in value})
+
+        missing = sorted({item["dish"] for item in value if item["dish"] not in dishes})
+        if missing:
+            raise ValidationError(f"Dishes {missing} do not exist.")
+
+        restaurants = {dishes[item["dish"]].restaurant.name for item in value}
+        unsupported = sorted(name for name in restaurants if name.lower() not in SUPPORTED_RESTAURANTS)
+        if unsupported:
+            raise ValidationError(f"Restaurants {unsupported} are not available for processing.")
+
+        return [item | {"dish": dishes[item["dish"]]} for item in value]
 
     def validate_eta(self, value: date):
         if (value - date.today()).days < 1:
@@ -76,6 +168,11 @@ class OrderSerializer(serializers.Serializer):
             return value
 
 
+class OrderBatchSerializer(serializers.Serializer):
+    # orders are validated one by one to report errors of each order
+    orders = serializers.ListField(child=serializers.DictField(), min_length=1, max_length=ORDERS_BATCH_LIMIT)
+
+
 class KFCOrderSerializer(serializers.Serializer):
     pass
 
@@ -135,6 +232,49 @@ class BaseFitlers:
 
 
 class FoodFilters(BaseFitlers):
+    status: OrderStatus | None = None
+    delivery_provider: DeliveryProvider | None = None
+    eta: date | None = None
+    eta_from: date | None = None
+    eta_to: date | None = None
+    user: int | None = None
+
+    def extract_status(self, status: str) -> OrderStatus:
+        try:
+            return OrderStatus(status.lower())
+        except ValueError:
+            raise ValidationError(f"Status {status} is not supported")
+
+    def extract_eta(self, eta: str) -> date:
+        try:
+            return date.fromisoformat(eta)
+        except ValueError:
+            raise ValidationError(f"ETA {eta} is not a date in the YYYY-MM-DD format")
+
+    def extract_eta_from(self, eta: str) -> date:
+        return self.extract_eta(eta)
+
+    def extract_eta_to(self, eta: str) -> date:
+        return self.extract_eta(eta)
+
+    def extract_user(self, user: str) -> int:
+        try:
+            return int(user)
+        except ValueError:
+            raise ValidationError(f"User {user} is not a valid id")
+
+    def filter(self, queryset: QuerySet[Order]) -> QuerySet[Order]:
+        lookups = {
+            "status": self.status,
+            "delivery_provider": self.delivery_provider,
+            "eta": self.eta,
+            "eta__gte": self.eta_from,
+            "eta__lte": self.eta_to,
+            "user_id": self.user,
+        }
+
+        return queryset.filter(**{lookup: value for lookup, value in lookups.items() if value is not None})
+
     def extract_delivery_provider(self, provider: str | None = None) -> DeliveryProvider | None:
         if provider is None:
             return None
@@ -147,30 +287,91 @@ class FoodFilters(BaseFitlers):
             else:
                 return _provider
 
+    @classmethod
+    def query_params(cls, request: Request, *ignored: str | None) -> dict[str, str]:
+        """Query params to filter by, without params of DRF (`?format=json`) and `ignored` params of the view."""
+
+        params = request.query_params.dict()
+        for param in (api_settings.URL_FORMAT_OVERRIDE, *ignored):
+            if param is not None:
+                params.pop(param, None)
+
+        return params
+
+
+class OrdersPagination(CursorPagination):
+    """Keyset pagination: each page is an index range scan, without OFFSET and COUNT(*)."""
+
+    ordering = "-id"
+    page_size = 50
+    page_size_query_param = "size"
+    max_page_size = 500
+
 
 class FoodAPIViewSet(viewsets.GenericViewSet):
     def get_permissions(self):
         match self.action:
-            case "all_orders":
+            case "all_orders" | "export_orders" | "stats":
                 return [permissions.IsAuthenticated(), IsAdmin()]
             case _:
                 return [permissions.IsAuthenticated()]
 
-    @method_decorator(cache_page(100))
+    def menu_response(self, request: Request, menu: MenuCache, version: int, get_body) -> HttpResponse:
+        """Serve pre-encoded JSON as is. `304` is returned without reading the menu."""
+
+        headers = {"ETag": menu.etag(version), "Cache-Control": "no-cache"}
+
+        if headers["ETag"] in parse_etags(request.headers.get("If-None-Match", "")):
+            return HttpResponse(status=304, headers=headers)
+
+        body: bytes | None = get_body()
+        if body is None:
+            raise NotFound("Restaurant is not found")
+
+        return HttpResponse(body, content_type="application/json", headers=headers)
+
+    @action(methods=["get"], detail=False)
+    def dishes(self, request: Request) -> HttpResponse:
+        menu = MenuCache()
+        version = menu.version()
+
+        return self.menu_response(request, menu, version, lambda: menu.get(version))
+
+    # HTTP GET /food/dishes/1
+    @action(methods=["get"], detail=False, url_path=r"dishes/(?P<restaurant_id>\d+)")
+    def restaurant_dishes(self, request: Request, restaurant_id: str) -> HttpResponse:
+        menu = MenuCache()
+        version = menu.version()
+
+        return self.menu_response(request, menu, version, lambda: menu.restaurant(version, int(restaurant_id)))
+
+    # HTTP GET /food/stats/
     @action(methods=["get"], detail=False)
-    def dishes(self, request: Request) -> Response:
-        restaurants = Restaurant.objects.all()
-        serializer = RestaurantSerializer(restaurants, many=True)
-        # import time
-        # time.sleep(3)
-        return Response(data=serializer.data)
+    def stats(self, request: Request) -> Response:
+        """Pools, provider limits and breakers, local cache tiers of this process."""
+
+        return Response(process_stats())
 
     # HTTP GET /food/orders/4
     @action(methods=["get"], detail=False, url_path=r"orders/(?P<id>\d+)")
-    def retrieve_order(self, request: Request, id: int) -> Response:
-        order = Order.objects.get(id=id)
-        serializer = OrderSerializer(order)
-        return Response(data=serializer.data)
+    def retrieve_order(self, request: Request, id: int) -> HttpResponse:
+        """Serve the read model of the order with its tracking state. Unchanged orders get `304`.
+
+        Orders are served to their customers and admins only, others get `404` as for missing orders.
+        """
+
+        assert type(request.user) is User
+
+        document = OrderReadModel().get(int(id))
+        if document is None or not (request.user.role == Role.ADMIN or request.user.pk == document.user_id):
+            raise NotFound("Order is not found")
+
+        headers = {"ETag": document.etag, "Cache-Control": "no-cache"}
+
+        if document.etag in parse_etags(request.headers.get("If-None-Match", "")):
+            return HttpResponse(status=304, headers=headers)
+
+        return HttpResponse(document.body, content_type="application/json", headers=headers)
 
     # HTTP POST /food/orders/
     def create_order(self, request: Request) -> Response:
@@ -189,13 +390,12 @@ class FoodAPIViewSet(viewsets.GenericViewSet):
             )
 
             items = serializer.validated_data["items"]
-            for dish_order in items:
-                instance = OrderItem.objects.create(
-                    dish=dish_order["dish"],
-                    quantity=dish_order["quantity"],
-                    order=order,
-                )
-                print(f"New Dish Order Item is created: {instance.pk}")
+            OrderItem.objects.bulk_create(
+                [
+                    OrderItem(dish=dish_order["dish"], quantity=dish_order["quantity"], order=order)
+                    for dish_order in items
+                ]
+            )
 
         print(f"New Food Order is created: {order.pk}. ETA: {order.eta}")
 
@@ -203,28 +403,110 @@ class FoodAPIViewSet(viewsets.GenericViewSet):
 
         return Response(OrderSerializer(order).data, status=201)
 
+    # HTTP POST /food/orders/batch/
+    @action(methods=["post"], detail=False, url_path=r"orders/batch")
+    def batch_orders(self, request: Request) -> Response:
+        """Create many orders at once.
+
+        Valid orders are created in one transaction and invalid ones are reported
+        with their index in the request, so the response status is 207 if some orders failed.
+        """
+
+        batch = OrderBatchSerializer(data=request.data)
+        batch.is_valid(raise_exception=True)
+
+        assert type(request.user) is User
+
+        payload: list[dict] = batch.validated_data["orders"]
+        context = {"dishes": OrderSerializer.prefetch_dishes(payload)}
+
+        results: list[dict] = []
+        serializers_by_index: dict[int, OrderSerializer] = {}
+
+        for index, data in enumerate(payload):
+            serializer = OrderSerializer(data=data, context=context)
+
+            if serializer.is_valid():
+                serializers_by_index[index] = serializer
+            else:
+                results.append({"index": index, "status": 400, "errors": serializer.errors})
+
+        with transaction.atomic():
+            orders = Order.objects.bulk_create(
+                [
+                    Order(
+                        status=OrderStatus.NOT_STARTED,
+                        user=request.user,
+                        delivery_provider="uklon",
+                        eta=serializer.validated_data["eta"],
+                        total=serializer.calculated_total,
+                    )
+                    for serializer in serializers_by_index.values()
+                ]
+            )
+
+            OrderItem.objects.bulk_create(
+                [
+                    OrderItem(dish=dish_order["dish"], quantity=dish_order["quantity"], order=order)
+                    for order, serializer in zip(orders, serializers_by_index.values())
+                    for dish_order in serializer.validated_data["items"]
+                ]
+            )
+
+        print(f"{len(orders)} Food Orders are created in a batch. {len(results)} orders are invalid")
+
+        schedule_orders(
+            [
+                OrderDispatch.from_items(order.pk, serializer.items_by_restaurant)
+                for order, serializer in zip(orders, serializers_by_index.values())
+            ]
+        )
+
+        # a single query for items of all created orders
+        prefetch_related_objects(orders, "items")
+
+        for index, data in zip(serializers_by_index, OrderSerializer(orders, many=True).data):
+            results.append({"index": index, "status": 201, "order": data})
+
+        results.sort(key=lambda result: result["index"])
+
+        if not orders:
+            return Response({"results": results}, status=400)
+
+        return Response({"results": results}, status=207 if len(orders) < len(payload) else 201)
+
     def all_orders(self, request: Request) -> Response:
-        # filters = FoodFilters(**request.query_params.dict())
-        # status: str | None = request.query_params.get("status")
-        # orders = (
-        #     Order.objects.all()
-        #     if filters.delivery_provider is None
-        #     else Order.objects.filter(delivery_provider=filters.delivery_provider)
-        # )
-
-        orders = Order.objects.all()
-
-        paginator = LimitOffsetPagination()
-        # paginator.page_size = 2
-        # paginator.page_size_query_param = "size"
+        paginator = OrdersPagination()
+
+        params = FoodFilters.query_params(request, paginator.cursor_query_param, paginator.page_size_query_param)
+        filters = FoodFilters(**params)
+        orders = filters.filter(Order.objects.prefetch_related("items"))
+
         page = paginator.paginate_queryset(orders, request, view=self)
+        serializer = OrderSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+    # HTTP GET /food/orders/export/?type=ndjson&etaFrom=2025-07-01&etaTo=2025-07-31
+    @action(methods=["get"], detail=False, url_path=r"orders/export")
+    def export_orders(self, request: Request) -> StreamingHttpResponse:
+        """Stream orders with items as CSV (default) or NDJSON. Filters are the same as in `all_orders`."""
+
+        params = FoodFilters.query_params(request)
+        export_type = params.pop("type", "csv")
+
+        try:
+            content_type, stream = EXPORT_FORMATS[export_type]
+        except KeyError:
+            raise ValidationError({"queryParams": {"type": f"Use one of: {', '.join(EXPORT_FORMATS)}"}})
 
-        if page is not None:
-            serializer = OrderSerializer(page, many=True)
-            return paginator.get_paginated_response(serializer.data)
+        orders = FoodFilters(**params).filter(Order.objects.all())
 
-        serializer = OrderSerializer(orders, many=True)
-        return Response(serializer.data)
+        chunks = stream(export_rows(orders))
+        content = async_stream(chunks) if isinstance(request._request, ASGIRequest) else chunks
+
+        response = StreamingHttpResponse(content, content_type=content_type)
+        response["Content-Disposition"] = f'attachment; filename="orders.{export_type}"'
+        return response
 
     @action(methods=["get", "post"], detail=False, url_path=r"orders")
     def orders(self, request: Request) -> Response:
@@ -234,7 +516,10 @@ class FoodAPIViewSet(viewsets.GenericViewSet):
             return self.all_orders(request)
 
 
+@staff_member_required
 def import_dishes(request):
+    """Store the uploaded CSV and import it in the background, the admin page polls the progress."""
+
     if request.method != "POST":
         raise ValueError(f"Method {request.method} is not allowed on this resource")
 
@@ -242,86 +527,75 @@ def import_dishes(request):
     if csv_file is None:
         raise ValueError("No CSV File Provided")
 
-    decoded = csv_file.read().decode("utf-8")
-    reader = csv.DictReader(io.StringIO(decoded))
-    total = 0
-
-    for row in reader:
-        restaurant_name = row["restaurant"]
-        try:
-            rest = Restaurant.objects.get(name__icontains=restaurant_name.lower())
-        except Restaurant.DoesNotExist:
-            print(f"Skipping restaurant {restaurant_name}")
-        else:
-            print(f"Restaurant {rest} found")
-
-        Dish.objects.create(name=row["name"], price=int(row["price"]), restaurant=rest)
-        total += 1
+    path = default_storage.save(f"imports/dishes-{uuid.uuid4().hex}.csv", csv_file)
+    job_id = ImportJobs().create()
+    import_dishes_file.delay(job_id, path)
 
-    print(f"{total} dishes uploaded to the database")
+    print(f"Dishes import {job_id} is queued for {path}")
+    request.session[DISH_IMPORT_SESSION_KEY] = job_id
 
     return redirect(request.META.get("HTTP_REFERER", "/"))
 
 
-@csrf_exempt
-def kfc_webhook(request: Request):
-    """Process KFC Order webhooks."""
-
-    print("KFC Webhook is Handled")
+@staff_member_required
+def import_dishes_status(request, job_id: str):
+    progress = ImportJobs().get(job_id)
+    if progress is None:
+        return JsonResponse({"error": "Unknown import"}, status=404)
 
-    data: dict = json.loads(json.dumps(request.POST))
+    if progress["status"] in (ImportStatus.FINISHED, ImportStatus.FAILED):
+        request.session.pop(DISH_IMPORT_SESSION_KEY, None)
 
-    cache = CacheService()
-    restaurant = Restaurant.objects.get(name="kfc")
-    kfc_cache_order = cache.get("kfc_orders", key=data["id"])
+    return JsonResponse(progress)
 
-    # get internal order from the mapping
-    # add logging if order wasn't found
 
-    order: Order = Order.objects.get(id=kfc_cache_order["internal_order_id"])
-    tracking_order = TrackingOrder(**cache.get(namespace="orders", key=str(order.pk)))
-    tracking_order.restaurants[str(restaurant.pk)] |= {
-        "external_id": data["id"],
-        "status": OrderStatus.COOKED,
-    }
+def _queue_webhook(event: WebhookEvent, task: Task) -> JsonResponse:
+    """Deduplicate and queue the event. Duplicates are acknowledged without processing."""
 
-    cache.set(namespace="orders", key=str(order.pk), value=asdict(tracking_order))
+    if not webhooks.accept(event):
+        print(f"Duplicated {event.provider.upper()} webhook: {event.external_id} {event.status}")
+        return JsonResponse({"message": "ok"}, status=200)
 
-    all_orders_cooked(order.pk)
+    try:
+        task.delay(event.to_message())
+    except Exception:
+        webhooks.release(event)
+        return JsonResponse({"error": "Try again later"}, status=503)
 
-    return Response({"message": "ok"}, status=200)
+    return JsonResponse({"message": "ok"}, status=200)
 
 
 @csrf_exempt
-def uklon_webhook(request: Request):
-    """Process Uklon delivery webhooks."""
-
-    print("Uklon Webhook is Handled")
-    data: dict = request.POST.dict()
+@require_POST
+def kfc_webhook(request):
+    """Process KFC Order webhooks."""
 
-    cache = CacheService()
-    order_id: str = str(data.get("id"))
-    status = cast(str, data.get("status"))
-    location = data.get("location")
+    try:
+        event = webhooks.parse_kfc_webhook(request.POST)
+    except ValueError as error:
+        return JsonResponse({"error": str(error)}, status=400)
 
-    uklon_cache_order = cache.get("uklon_orders", key=order_id)
-    if not uklon_cache_order:
-        return Response({"error": "Unknown uklon order"}, status=404)
+    return _queue_webhook(event, kfc_order_webhook)
 
-    order: Order = Order.objects.get(id=uklon_cache_order["internal_order_id"])
-    tracking_order = TrackingOrder(**cache.get(namespace="orders", key=str(order.pk)))
 
-    internal_status = PROVIDER_EXTERNAL_TO_INTERNAL["uklon"][status]
+@csrf_exempt
+@require_POST
+def uklon_webhook(request):
+    """Process Uklon delivery webhooks.
 
-    tracking_order.delivery["status"] = internal_status
-    tracking_order.delivery["location"] = location
+    Location pings mostly repeat the status, so the location is saved here,
+    before the deduplication, and the status change is queued only once.
+    """
 
-    cache.set("orders", str(order.pk), asdict(tracking_order))
+    try:
+        event = webhooks.parse_uklon_webhook(request.POST)
+    except ValueError as error:
+        return JsonResponse({"error": str(error)}, status=400)
 
-    if internal_status == OrderStatus.DELIVERED:
-        Order.objects.filter(id=order.pk).update(status=OrderStatus.DELIVERED)
+    if event.location is not None:
+        record_uklon_location(event.external_id, event.location)
 
-    return Response({"message": "ok"}, status=200)
+    return _queue_webhook(event, uklon_order_webhook)
 
 
 router = routers.DefaultRouter()
@@ -0,0 +1,108 @@
+"""
+Ingestion of provider webhooks.
+
+Handlers only validate the event, drop duplicates and queue it, so the response
+does not depend on the processing time. Providers may deliver the same event
+several times, so each (provider, external id, status) is accepted only once
+in `WEBHOOK_DEDUP_TTL`.
+
+Tasks of accepted events (`WebhookTask`) are retried and acknowledged after they
+finish. If the processing fails, the event is released, so the next delivery of
+the provider is accepted again.
+
+REDIS STRUCTURE:
+    webhooks:kfc:<external_id>:cooked  STR  the event is accepted
+"""
+
+from dataclasses import asdict, dataclass
+
+from celery import Task
+from django.http import QueryDict
+
+from shared.cache import get_redis_client
+
+from .mapper import PROVIDER_EXTERNAL_TO_INTERNAL, RESTAURANT_EXTERNAL_TO_INTERNAL
+
+WEBHOOK_DEDUP_TTL = 600
+WEBHOOK_MAX_RETRIES = 5
+
+
+@dataclass
+class WebhookEvent:
+    provider: str
+    external_id: str
+    status: str  # external
+    location: list[float] | None = None
+
+    @property
+    def dedup_key(self) -> str:
+        return f"webhooks:{self.provider}:{self.external_id}:{self.status}"
+
+    def to_message(self) -> dict:
+        return asdict(self)
+
+    @classmethod
+    def from_message(cls, message: dict) -> "WebhookEvent":
+        return cls(**message)
+
+
+def _parse(provider: str, data: QueryDict, statuses: dict) -> WebhookEvent:
+    external_id = data.get("id", "").strip()
+    if not external_id:
+        raise ValueError("The order id is required")
+
+    status = data.get("status", "")
+    if status not in statuses:
+        raise ValueError(f"Status {status!r} is not supported")
+
+    return WebhookEvent(provider=provider, external_id=external_id, status=status)
+
+
+def parse_kfc_webhook(data: QueryDict) -> WebhookEvent:
+    return _parse("kfc", data, RESTAURANT_EXTERNAL_TO_INTERNAL["kfc"])
+
+
+def parse_uklon_webhook(data: QueryDict) -> WebhookEvent:
+    event = _parse("uklon", data, PROVIDER_EXTERNAL_TO_INTERNAL["uklon"])
+
+    # the location is sent as repeated form fields
+    try:
+        event.location = [float(value) for value in data.getlist("location")] or None
+    except ValueError:
+        raise ValueError(f"Location {data.getlist('location')} is not a list of coordinates")
+
+    return event
+
+
+def accept(event: WebhookEvent) -> bool:
+    """Return `False` if the same event is already accepted."""
+
+    return bool(get_redis_client().set(event.dedup_key, 1, nx=True, ex=WEBHOOK_DEDUP_TTL))
+
+
+def release(event: WebhookEvent) -> None:
+    """Forget the event which is not queued, so the provider could deliver it again."""
+
+    get_redis_client().delete(event.dedup_key)
+
+
+class WebhookTask(Task):
+    """Processing of the accepted `WebhookEvent`, passed as the only argument.
+
+    Handlers are idempotent (see `food.states`), so the task is retried on any error
+    and redelivered if the worker is lost.
+    """
+
+    autoretry_for = (Exception,)
+    max_retries = WEBHOOK_MAX_RETRIES
+    retry_backoff = True
+    acks_late = True
+    reject_on_worker_lost = True
+
+    def on_retry(self, exc, task_id, args, kwargs, einfo):
+        release(WebhookEvent.from_message(args[0]))
+
+    def on_failure(self, exc, task_id, args, kwargs, einfo):
+        event = WebhookEvent.from_message(args[0])
+        print(f"{event.provider.upper()} webhook {event.external_id} {event.status} is not processed: {exc!r}")
+        release(event)
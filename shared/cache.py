@@ -1,8 +1,31 @@
-import json
+from contextlib import contextmanager
 from dataclasses import dataclass
+from typing import Any, Iterable, Iterator, cast
 
+import redis
+from django.conf import settings
 from django.core.cache import cache
 
+from . import codecs
+from .local_cache import INVALIDATION_CHANNEL, LocalCache, get_local_cache, invalidation_message, local_stats
+
+_redis_client: redis.Redis | None = None
+
+
+def get_redis_client() -> redis.Redis:
+    """Return the per-process Redis client for raw structures (hashes, sorted sets, locks).
+
+    It points to the same Redis instance as the Django cache backend,
+    but keys written through it are NOT prefixed by Django.
+    """
+
+    global _redis_client
+
+    if _redis_client is None:
+        _redis_client = redis.Redis.from_url(settings.CACHES["default"]["LOCATION"])
+
+    return _redis_client
+
 
 @dataclass
 class Structure:
@@ -10,21 +33,154 @@ class Structure:
     name: str
 
 
+class CachePipeline:
+    """Namespace-scoped operations which are sent to Redis in one round trip.
+
+    USAGE:
+        with CacheService().pipeline() as pipe:
+            pipe.set("kfc_orders", external_id, {"internal_order_id": 17})
+            pipe.get("orders", "17")
+
+        pipe.results  # [True, {...}]
+    """
+
+    def __init__(self, service: "CacheService", pipe: redis.client.Pipeline):
+        self.service = service
+        self.pipe = pipe  # raw pipeline for other structures (hashes, sets)
+        self.results: list[Any] = []
+        self._values_at: set[int] = set()  # positions of GET commands which results are decoded
+        self._local_updates: list[tuple[LocalCache, str, bytes | None]] = []
+
+    def set(self, namespace: str, key: str, value: dict, ttl: int | None = None) -> None:
+        payload = self.service._dumps(value)
+        self.pipe.set(self.service._make_key(namespace, key), payload, ex=ttl)
+        self._invalidate(namespace, key, payload)
+
+    def get(self, namespace: str, key: str) -> None:
+        self._values_at.add(len(self.pipe))
+        self.pipe.get(self.service._make_key(namespace, key))
+
+    def delete(self, namespace: str, key: str) -> None:
+        self.pipe.delete(self.service._make_key(namespace, key))
+        self._invalidate(namespace, key, None)
+
+    def _invalidate(self, namespace: str, key: str, payload: bytes | None) -> None:
+        """Notify other processes and update the own local tier after the execution."""
+
+        local = self.service._local(namespace)
+        if local is not None:
+            self.pipe.publish(INVALIDATION_CHANNEL, invalidation_message(namespace, key))
+            self._local_updates.append((local, key, payload))
+
+    def execute(self) -> list[Any]:
+        # results of raw commands added to `self.pipe` directly are returned as is
+        self.results = [
+            self.service._loads(result) if position in self._values_at else result
+            for position, result in enumerate(self.pipe.execute())
+        ]
+
+        for local, key, payload in self._local_updates:
+            if payload is None:
+                local.delete(key)
+            else:
+                local.set(key, payload)
+
+        return self.results
+
+
 class CacheService:
+    """JSON-like values in Redis under the `namespace:key` keys.
+
+    Keys are built by the Django cache backend (prefix and version).
+    Values are encoded with `settings.CACHE_SERVICE_CODEC` (json, orjson, msgpack)
+    and prefixed with the codec version byte, so entries written with another codec are still readable.
+
+    Namespaces from `settings.CACHE_SERVICE_LOCAL_NAMESPACES` are also kept
+    in the in-process LRU (see shared/local_cache.py).
+    """
+
+    def __init__(self):
+        self.redis = get_redis_client()
+        self.codec = codecs.get_codec(getattr(settings, "CACHE_SERVICE_CODEC", "json"))
+
     @staticmethod
     def _build_key(namespace: str, key: str) -> str:
         return f"{namespace}:{key}"
 
-    def set(self, namespace: str, key: str, value: dict, ttl: int | None = None):
-        payload = json.dumps(value if isinstance(value, dict) else value.__dict__)
-        cache.set(self._build_key(namespace, key), payload, timeout=ttl)
+    def _make_key(self, namespace: str, key: str) -> str:
+        return cache.make_and_validate_key(self._build_key(namespace, key))
 
-    def get(self, namespace: str, key: str):
-        result: str | None = cache.get(self._build_key(namespace, key))
-        if result is None:
+    def _dumps(self, value) -> bytes:
+        return codecs.encode(self.codec, value if isinstance(value, dict) else value.__dict__)
+
+    @staticmethod
+    def _loads(payload: bytes | None):
+        if payload is None:
             return None
         else:
-            return json.loads(result)
+            return codecs.decode(payload)
+
+    def _local(self, namespace: str) -> LocalCache | None:
+        return get_local_cache(namespace, self.redis)
+
+    def set(self, namespace: str, key: str, value: dict, ttl: int | None = None):
+        with self.pipeline() as pipe:
+            pipe.set(namespace, key, value, ttl=ttl)
+
+    def get(self, namespace: str, key: str):
+        return self.get_many(namespace, [key]).get(key)
 
     def delete(self, namespace: str, key: str):
-        cache.delete(self._build_key(namespace, key))
+        with self.pipeline() as pipe:
+            pipe.delete(namespace, key)
+
+    def get_many(self, namespace: str, keys: Iterable[str]) -> dict[str, Any]:
+        """Return only found items. Items missing in the local tier are requested with one MGET."""
+
+        local = self._local(namespace)
+        payloads: dict[str, bytes] = {}
+        missing: list[str] = []
+
+        for key in keys:
+            payload = local.get(key) if local is not None else None
+            if payload is None:
+                missing.append(key)
+            else:
+                payloads[key] = payload
+
+        if missing:
+            found = cast(list[bytes | None], self.redis.mget([self._make_key(namespace, key) for key in missing]))
+            for key, payload in zip(missing, found):
+                if payload is not None:
+                    payloads[key] = payload
+                    if local is not None:
+                        local.set(key, payload)
+
+        return {key: self._loads(payload) for key, payload in payloads.items()}
+
+    def set_many(self, namespace: str, items: dict[str, dict], ttl: int | None = None):
+        with self.pipeline() as pipe:
+            for key, value in items.items():
+                pipe.set(namespace, key, value, ttl=ttl)
+
+    def delete_many(self, namespace: str, keys: Iterable[str]):
+        with self.pipeline() as pipe:
+            for key in keys:
+                pipe.delete(namespace, key)
+
+    @contextmanager
+    def pipeline(self, transaction: bool = False) -> Iterator[CachePipeline]:
+        """Queue operations and execute them in one round trip on exit.
+
+        With `transaction=True` they are wrapped into MULTI/EXEC.
+        """
+
+        pipe = CachePipeline(self, self.redis.pipeline(transaction=transaction))
+        yield pipe
+        pipe.execute()
+
+    @staticmethod
+    def local_stats() -> dict[str, dict]:
+        """Hit/miss counters of the local tier per namespace."""
+
+        return local_stats()
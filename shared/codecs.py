@@ -0,0 +1,119 @@
+"""
+Codecs of the CacheService payloads.
+
+PAYLOAD FORMAT:
+    [version byte][encoded value]
+
+Entries written before codecs were introduced are pickled JSON strings
+(the Django Redis backend format). They start with the pickle protocol
+byte 0x80, which is never used as a codec version, so they are still readable.
+"""
+
+import json
+import pickle
+from typing import Any
+
+from django.core.exceptions import ImproperlyConfigured
+
+try:
+    import orjson
+except ImportError:
+    orjson = None  # type: ignore[assignment]
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+PICKLE_PROTOCOL_BYTE = 0x80
+
+_json_encoder = json.JSONEncoder(separators=(",", ":"))
+
+
+class Codec:
+    version: int
+    name: str
+
+    def encode(self, value: Any) -> bytes:
+        raise NotImplementedError
+
+    def decode(self, payload: bytes) -> Any:
+        raise NotImplementedError
+
+
+class JSONCodec(Codec):
+    version = 1
+    name = "json"
+
+    def encode(self, value: Any) -> bytes:
+        return _json_encoder.encode(value).encode()
+
+    def decode(self, payload: bytes) -> Any:
+        return json.loads(payload)
+
+
+class OrjsonCodec(Codec):
+    version = 2
+    name = "orjson"
+
+    def __init__(self):
+        if orjson is None:
+            raise ImproperlyConfigured("Install `orjson` to use the orjson cache codec")
+
+    def encode(self, value: Any) -> bytes:
+        return orjson.dumps(value)
+
+    def decode(self, payload: bytes) -> Any:
+        return orjson.loads(payload)
+
+
+class MsgpackCodec(Codec):
+    version = 3
+    name = "msgpack"
+
+    def __init__(self):
+        if msgpack is None:
+            raise ImproperlyConfigured("Install `msgpack` to use the msgpack cache codec")
+
+    def encode(self, value: Any) -> bytes:
+        return msgpack.packb(value)
+
+    def decode(self, payload: bytes) -> Any:
+        return msgpack.unpackb(payload)
+
+
+CODECS: dict[str, type[Codec]] = {codec.name: codec for codec in (JSONCodec, OrjsonCodec, MsgpackCodec)}
+_VERSIONS: dict[int, type[Codec]] = {codec.version: codec for codec in CODECS.values()}
+_instances: dict[type[Codec], Codec] = {}
+
+
+def get_codec(name: str) -> Codec:
+    try:
+        codec_class = CODECS[name]
+    except KeyError:
+        raise ImproperlyConfigured(f"Cache codec {name} is not supported. Use one of: {', '.join(CODECS)}")
+
+    if codec_class not in _instances:
+        _instances[codec_class] = codec_class()
+
+    return _instances[codec_class]
+
+
+def encode(codec: Codec, value: Any) -> bytes:
+    return bytes((codec.version,)) + codec.encode(value)
+
+
+def decode(payload: bytes) -> Any:
+    """Decode the payload with the codec it was written with."""
+
+    version = payload[0]
+
+    if version == PICKLE_PROTOCOL_BYTE:
+        return json.loads(pickle.loads(payload))
+
+    try:
+        codec_class = _VERSIONS[version]
+    except KeyError:
+        raise ValueError(f"Unknown cache payload version: {version}")
+
+    return get_codec(codec_class.name).decode(payload[1:])
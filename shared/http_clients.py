@@ -0,0 +1,382 @@
+"""
+Per-process, per-provider pools of keep-alive HTTP connections.
+
+USAGE:
+    client = get_client("silpo")              # httpx.Client
+    client = get_async_client("silpo")        # httpx.AsyncClient (bound to the running loop)
+    run_in_loop(coroutine)                    # run on the per-process loop to keep async pools alive
+    pool_stats()                              # {"silpo": {"requests": 10, "hits": 9, ...}}
+    limit_stats()                             # {"silpo": {"requests": 10, "throttled": 2, ...}}
+    resilience_stats()                        # {"silpo": {"calls": 10, "retries": 1, "fast_failures": 0, ...}}
+    close_clients()                           # on shutdown of the process (see `config.celery`, `food.asgi`)
+
+Limits, timeouts, rate limits (see `shared.limits`) and breakers (see `shared.resilience`)
+are configured with `settings.HTTP_PROVIDERS`:
+    {
+        "default": {...},  // applied to every provider
+        "silpo": {...},    // provider specific overrides
+    }
+"""
+
+import asyncio
+import os
+import threading
+import time
+import weakref
+from dataclasses import asdict, dataclass
+from typing import Any, Coroutine, TypeVar
+
+import httpx
+from django.conf import settings
+
+from .limits import ProviderLimiter
+from .resilience import ProviderGuard
+
+T = TypeVar("T")
+
+DEFAULT_CONFIG: dict[str, Any] = {
+    "max_connections": 20,
+    "max_keepalive_connections": 10,
+    "keepalive_expiry": 30.0,
+    "connect_timeout": 2.0,
+    "read_timeout": 10.0,
+    "write_timeout": 5.0,
+    "pool_timeout": 5.0,
+    "order_timeout": 15.0,  # deadline of the whole provider call in async orchestration
+    "rate": None,  # requests per second of all processes
+    "burst": None,
+    "max_concurrency": None,  # requests in flight of all processes
+    "limit_timeout": 5.0,  # seconds to wait for the rate and concurrency limits
+    # retries and circuit breakers, see `shared.resilience`
+    "call_timeout": 12.0,  # deadline of the call with its retries
+    "retries": 2,
+    "backoff": 0.1,
+    "max_backoff": 2.0,
+    "retry_ratio": 0.2,  # retries earned by each call
+    "retry_budget": 10,
+    "failure_threshold": 5,  # failed calls in the window which open the breaker
+    "failure_window": 30.0,
+    "open_timeout": 15.0,  # seconds while calls fail fast
+}
+
+# if the first network event happens later than that - request was waiting for a free connection
+POOL_WAIT_THRESHOLD = 0.005
+
+
+@dataclass
+class PoolStats:
+    requests: int = 0
+    hits: int = 0  # keep-alive connection is reused
+    misses: int = 0  # new connection is opened
+    waits: int = 0  # request waited for a free connection in the pool
+    wait_time: float = 0.0
+
+    def record(self, new_connection: bool, waited: float) -> None:
+        self.requests += 1
+
+        if new_connection:
+            self.misses += 1
+        else:
+            self.hits += 1
+
+        if waited > POOL_WAIT_THRESHOLD:
+            self.waits += 1
+            self.wait_time += waited
+
+
+class _ConnectionTracer:
+    """httpcore `trace` extension which detects new connections and pool waits."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.first_event_at: float | None = None
+        self.new_connection = False
+
+    def __call__(self, event_name: str, info: dict) -> None:
+        if self.first_event_at is None:
+            self.first_event_at = time.perf_counter()
+        if event_name == "connection.connect_tcp.started":
+            self.new_connection = True
+
+    @property
+    def waited(self) -> float:
+        if self.first_event_at is None:
+            return 0.0
+        return self.first_event_at - self.started
+
+
+class _AsyncConnectionTracer(_ConnectionTracer):
+    async def __call__(self, event_name: str, info: dict) -> None:  # type: ignore[override]
+        super().__call__(event_name, info)
+
+
+class PooledTransport(httpx.HTTPTransport):
+    def __init__(self, stats: PoolStats, limiter: ProviderLimiter, guard: ProviderGuard, **kwargs):
+        super().__init__(**kwargs)
+        self.stats = stats
+        self.limiter = limiter
+        self.guard = guard
+        self._lock = threading.Lock()
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        deadline, probe = self.guard.start()
+        attempt = 0
+
+        while True:
+            self.guard.limit_timeouts(request, deadline)
+
+            try:
+                response = self._send(request)
+            except httpx.TransportError as error:
+                if (delay := self.guard.retry_delay(request, attempt, deadline, error=error)) is None:
+                    self.guard.finish(probe, error=error)
+                    raise
+            else:
+                if (delay := self.guard.retry_delay(request, attempt, deadline, response=response)) is None:
+                    self.guard.finish(probe, response=response)
+                    return response
+                response.close()
+
+            time.sleep(delay)
+            attempt += 1
+
+    def _send(self, request: httpx.Request) -> httpx.Response:
+        lease_id = self.limiter.acquire()
+        tracer = _ConnectionTracer()
+        request.extensions["trace"] = tracer
+        response: httpx.Response | None = None
+
+        try:
+            response = super().handle_request(request)
+            return response
+        finally:
+            self.limiter.release(lease_id, response)
+            with self._lock:
+                self.stats.record(tracer.new_connection, tracer.waited)
+
+
+class AsyncPooledTransport(httpx.AsyncHTTPTransport):
+    def __init__(self, stats: PoolStats, limiter: ProviderLimiter, guard: ProviderGuard, **kwargs):
+        super().__init__(**kwargs)
+        self.stats = stats
+        self.limiter = limiter
+        self.guard = guard
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        deadline, probe = await self.guard.start_async()
+        attempt = 0
+
+        while True:
+            self.guard.limit_timeouts(request, deadline)
+
+            try:
+                response = await self._send(request)
+            except httpx.TransportError as error:
+                if (delay := self.guard.retry_delay(request, attempt, deadline, error=error)) is None:
+                    await self.guard.finish_async(probe, error=error)
+                    raise
+            else:
+                if (delay := self.guard.retry_delay(request, attempt, deadline, response=response)) is None:
+                    await self.guard.finish_async(probe, response=response)
+                    return response
+                await response.aclose()
+
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def _send(self, request: httpx.Request) -> httpx.Response:
+        lease_id = await self.limiter.acquire_async()
+        tracer = _AsyncConnectionTracer()
+        request.extensions["trace"] = tracer
+        response: httpx.Response | None = None
+
+        try:
+            response = await super().handle_async_request(request)
+            return response
+        finally:
+            await self.limiter.release_async(lease_id, response)
+            self.stats.record(tracer.new_connection, tracer.waited)
+
+
+def get_config(provider: str) -> dict[str, Any]:
+    providers: dict[str, dict] = getattr(settings, "HTTP_PROVIDERS", {})
+    return DEFAULT_CONFIG | providers.get("default", {}) | providers.get(provider, {})
+
+
+def _client_options(provider: str) -> dict[str, Any]:
+    config = get_config(provider)
+
+    return {
+        "limits": httpx.Limits(
+            max_connections=config["max_connections"],
+            max_keepalive_connections=config["max_keepalive_connections"],
+            keepalive_expiry=config["keepalive_expiry"],
+        ),
+        "timeout": httpx.Timeout(
+            connect=config["connect_timeout"],
+            read=config["read_timeout"],
+            write=config["write_timeout"],
+            pool=config["pool_timeout"],
+        ),
+    }
+
+
+_lock = threading.Lock()
+_pid: int | None = None
+_clients: dict[str, httpx.Client] = {}
+_async_clients: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict[str, httpx.AsyncClient]] = (
+    weakref.WeakKeyDictionary()
+)
+_stats: dict[str, PoolStats] = {}
+_limiters: dict[str, ProviderLimiter] = {}
+_guards: dict[str, ProviderGuard] = {}
+_loop: asyncio.AbstractEventLoop | None = None
+
+
+def _reset_after_fork() -> None:
+    """Connections must not be shared between forked Celery worker processes."""
+
+    global _pid, _loop
+
+    if _pid != os.getpid():
+        _pid = os.getpid()
+        _clients.clear()
+        _async_clients.clear()
+        _stats.clear()
+        _limiters.clear()
+        _guards.clear()
+        _loop = None
+
+
+def _limiter(provider: str) -> ProviderLimiter:
+    """One limiter per provider is shared by sync and async clients, so their stats are not split."""
+
+    if provider not in _limiters:
+        config = get_config(provider)
+        _limiters[provider] = ProviderLimiter(
+            provider,
+            rate=config["rate"],
+            burst=config["burst"],
+            max_concurrency=config["max_concurrency"],
+            limit_timeout=config["limit_timeout"],
+        )
+
+    return _limiters[provider]
+
+
+def _guard(provider: str) -> ProviderGuard:
+    if provider not in _guards:
+        config = get_config(provider)
+        options = (
+            "call_timeout",
+            "retries",
+            "backoff",
+            "max_backoff",
+            "retry_ratio",
+            "retry_budget",
+            "failure_threshold",
+            "failure_window",
+            "open_timeout",
+        )
+        _guards[provider] = ProviderGuard(provider, **{name: config[name] for name in options})
+
+    return _guards[provider]
+
+
+def get_client(provider: str) -> httpx.Client:
+    with _lock:
+        _reset_after_fork()
+
+        if provider not in _clients:
+            options = _client_options(provider)
+            stats = _stats.setdefault(provider, PoolStats())
+            _clients[provider] = httpx.Client(
+                transport=PooledTransport(
+                    stats=stats, limiter=_limiter(provider), guard=_guard(provider), limits=options["limits"]
+                ),
+                timeout=options["timeout"],
+            )
+
+        return _clients[provider]
+
+
+def get_async_client(provider: str) -> httpx.AsyncClient:
+    """Async connections are bound to the event loop, so the pool is kept per loop."""
+
+    loop = asyncio.get_running_loop()
+
+    with _lock:
+        _reset_after_fork()
+
+        clients = _async_clients.setdefault(loop, {})
+        if provider not in clients:
+            options = _client_options(provider)
+            stats = _stats.setdefault(provider, PoolStats())
+            clients[provider] = httpx.AsyncClient(
+                transport=AsyncPooledTransport(
+                    stats=stats, limiter=_limiter(provider), guard=_guard(provider), limits=options["limits"]
+                ),
+                timeout=options["timeout"],
+            )
+
+        return clients[provider]
+
+
+def run_in_loop(coroutine: Coroutine[Any, Any, T]) -> T:
+    """Run the coroutine from the sync code (Celery task) on the per-process event loop.
+
+    `asyncio.run` creates a new loop on each call, so async pools could not be reused between tasks.
+    """
+
+    global _loop
+
+    with _lock:
+        _reset_after_fork()
+        if _loop is None or _loop.is_closed():
+            _loop = asyncio.new_event_loop()
+        loop = _loop
+
+    return loop.run_until_complete(coroutine)
+
+
+def pool_stats() -> dict[str, dict]:
+    return {provider: asdict(stats) for provider, stats in _stats.items()}
+
+
+def limit_stats() -> dict[str, dict]:
+    """Metrics of providers with rate or concurrency limits."""
+
+    return {provider: asdict(limiter.stats) for provider, limiter in _limiters.items() if limiter.enabled}
+
+
+def resilience_stats() -> dict[str, dict]:
+    return {provider: asdict(guard.stats) for provider, guard in _guards.items()}
+
+
+def close_clients() -> None:
+    """Close pools of the process on shutdown, async pools of the `run_in_loop` loop too.
+
+    Must be called without the running event loop, pools of a running loop are closed by `aclose_clients`.
+    """
+
+    global _loop
+
+    with _lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
+        loop, _loop = _loop, None
+
+    if loop is not None and not loop.is_closed():
+        loop.run_until_complete(aclose_clients())
+        loop.close()
+
+
+async def aclose_clients() -> None:
+    """Close async pools of the running loop."""
+
+    with _lock:
+        clients = _async_clients.pop(asyncio.get_running_loop(), {})
+
+    for client in clients.values():
+        await client.aclose()
@@ -0,0 +1,212 @@
+"""
+Per-provider rate limits and concurrency bulkheads, shared by all worker processes.
+
+Each request to the provider takes a token from its bucket, refilled with
+`rate` tokens per second up to `burst`, and a slot of `max_concurrency`
+requests in flight. Requests wait for a token and a slot at most `limit_timeout`
+seconds, then fail with `LimitExceeded`. A `429 Too Many Requests` response
+empties the bucket for every process, for the `Retry-After` seconds if it is sent.
+
+Limits are configured with `settings.HTTP_PROVIDERS` next to pools (see `shared.http_clients`):
+    {
+        "silpo": {"rate": 20, "burst": 40, "max_concurrency": 10, "limit_timeout": 5.0},
+    }
+Limits which are not set (`None`) are not applied.
+
+REDIS STRUCTURE:
+    limits:silpo:bucket  HASH  {"tokens": "12.5", "ts": "1751360000000"}  // tokens at the time (ms)
+    limits:silpo:leases  ZSET  {lease_id: expires_at (ms)}  // requests in flight
+"""
+
+import asyncio
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+
+import httpx
+import redis
+
+from .cache import get_redis_client
+
+LEASE_TTL = 60.0  # seconds, slots of crashed processes are freed after that
+CONCURRENCY_POLL_INTERVAL = 0.05
+DEFAULT_RETRY_AFTER = 1.0
+
+# KEYS: bucket, leases. ARGV: rate, burst, max concurrency, lease ttl (ms), lease id.
+# Returns 0 if acquired, -1 if there is no free slot, or milliseconds to wait for a token.
+ACQUIRE_SCRIPT = """
+local time = redis.call('TIME')
+local now = time[1] * 1000 + math.floor(time[2] / 1000)
+local rate, burst, concurrency = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+
+if concurrency > 0 then
+    redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', now)
+    if redis.call('ZCARD', KEYS[2]) >= concurrency then
+        return -1
+    end
+end
+
+if rate > 0 then
+    local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+    local tokens = tonumber(bucket[1]) or burst
+    local ts = tonumber(bucket[2]) or now
+    tokens = math.min(burst, tokens + math.max(0, now - ts) * rate / 1000)
+    if tokens < 1 then
+        return math.ceil((1 - tokens) * 1000 / rate)
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tokens - 1, 'ts', now)
+    redis.call('PEXPIRE', KEYS[1], math.ceil(burst * 1000 / rate) + 1000)
+end
+
+if concurrency > 0 then
+    redis.call('ZADD', KEYS[2], now + ARGV[4], ARGV[5])
+    redis.call('PEXPIRE', KEYS[2], ARGV[4])
+end
+return 0
+"""
+
+# KEYS: bucket. ARGV: rate, seconds without tokens.
+PENALIZE_SCRIPT = """
+local time = redis.call('TIME')
+local now = time[1] * 1000 + math.floor(time[2] / 1000)
+redis.call('HSET', KEYS[1], 'tokens', -ARGV[1] * ARGV[2], 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(ARGV[2] * 1000) + 1000)
+return 1
+"""
+
+
+class LimitExceeded(httpx.TransportError):
+    """The request is not sent: no token or slot of the provider in `limit_timeout`."""
+
+
+@dataclass
+class LimitStats:
+    requests: int = 0
+    throttled: int = 0  # waited for a token or a slot
+    wait_time: float = 0.0
+    rejected: int = 0  # raised `LimitExceeded`
+    too_many_requests: int = 0  # 429 responses of the provider
+
+
+class ProviderLimiter:
+    def __init__(
+        self,
+        provider: str,
+        rate: float | None = None,
+        burst: int | None = None,
+        max_concurrency: int | None = None,
+        limit_timeout: float = 5.0,
+    ):
+        self.provider = provider
+        self.rate = rate or 0
+        self.burst = burst or max(1, int(self.rate))
+        self.max_concurrency = max_concurrency or 0
+        self.timeout = limit_timeout
+        self.stats = LimitStats()
+        self.redis = get_redis_client()
+        self._acquire = self.redis.register_script(ACQUIRE_SCRIPT)
+        self._penalize = self.redis.register_script(PENALIZE_SCRIPT)
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.rate or self.max_concurrency)
+
+    def _keys(self) -> list[str]:
+        return [f"limits:{self.provider}:bucket", f"limits:{self.provider}:leases"]
+
+    def _try_acquire(self, lease_id: str) -> float:
+        """Return `0` if acquired, otherwise seconds to wait before the next attempt.
+
+        Requests are not limited while Redis is not available, providers are still called.
+        """
+
+        try:
+            result = int(
+                self._acquire(
+                    keys=self._keys(),
+                    args=[self.rate, self.burst, self.max_concurrency, int(LEASE_TTL * 1000), lease_id],
+                )
+            )
+        except redis.RedisError as error:
+            print(f"{self.provider} limits are not checked: {error}")
+            return 0
+
+        return CONCURRENCY_POLL_INTERVAL if result < 0 else result / 1000
+
+    def _wait(self, waited: float, delay: float) -> float:
+        """Return the delay to sleep, or raise if the deadline is over."""
+
+        if waited + delay > self.timeout:
+            self._record(waited, rejected=True)
+            raise LimitExceeded(f"{self.provider} limits are exceeded for {self.timeout} seconds")
+        return delay
+
+    def _record(self, waited: float, rejected: bool = False) -> None:
+        with self._lock:
+            self.stats.requests += 1
+            if waited:
+                self.stats.throttled += 1
+                self.stats.wait_time += waited
+            if rejected:
+                self.stats.rejected += 1
+
+    def acquire(self) -> str | None:
+        """Block until the request may be sent. Return the lease to release, if concurrency is limited."""
+
+        if not self.enabled:
+            return None
+
+        lease_id, started, throttled = uuid.uuid4().hex, time.monotonic(), False
+
+        while delay := self._try_acquire(lease_id):
+            throttled = True
+            time.sleep(self._wait(time.monotonic() - started, delay))
+
+        self._record(time.monotonic() - started if throttled else 0.0)
+        return lease_id if self.max_concurrency else None
+
+    async def acquire_async(self) -> str | None:
+        """The same as `acquire`, but Redis is called from a thread and waits do not block the event loop."""
+
+        if not self.enabled:
+            return None
+
+        lease_id, started, throttled = uuid.uuid4().hex, time.monotonic(), False
+
+        while delay := await asyncio.to_thread(self._try_acquire, lease_id):
+            throttled = True
+            await asyncio.sleep(self._wait(time.monotonic() - started, delay))
+
+        self._record(time.monotonic() - started if throttled else 0.0)
+        return lease_id if self.max_concurrency else None
+
+    def release(self, lease_id: str | None, response: httpx.Response | None = None) -> None:
+        """Free the slot and slow down all processes if the provider answered with `429`."""
+
+        retry_after = _retry_after(response) if response is not None and response.status_code == 429 else None
+        if retry_after is not None:
+            with self._lock:
+                self.stats.too_many_requests += 1
+
+        try:
+            if lease_id is not None:
+                self.redis.zrem(self._keys()[1], lease_id)
+            if retry_after is not None and self.rate:
+                self._penalize(keys=self._keys()[:1], args=[self.rate, retry_after])
+        except redis.RedisError as error:
+            print(f"{self.provider} limits are not updated: {error}")  # the lease expires in `LEASE_TTL`
+
+    async def release_async(self, lease_id: str | None, response: httpx.Response | None = None) -> None:
+        """The same as `release`, with Redis called from a thread if there is anything to update."""
+
+        if lease_id is not None or (response is not None and response.status_code == 429):
+            await asyncio.to_thread(self.release, lease_id, response)
+
+
+def _retry_after(response: httpx.Response) -> float:
+    try:
+        return float(response.headers.get("Retry-After", DEFAULT_RETRY_AFTER))
+    except ValueError:  # HTTP date
+        return DEFAULT_RETRY_AFTER
@@ -0,0 +1,182 @@
+"""
+In-process LRU tier of the CacheService for read-mostly namespaces.
+
+Namespaces are configured with `settings.CACHE_SERVICE_LOCAL_NAMESPACES`:
+    {
+        "kfc_orders": {"size": 10000, "ttl": 3600},
+    }
+
+When a key of such namespace is overwritten or deleted, its name is published
+to the `INVALIDATION_CHANNEL` and every process evicts it from its local tier.
+The first tier of the process is returned once the listener is subscribed,
+so invalidations of values read into it are not missed.
+"""
+
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from typing import Any
+
+import redis
+from django.conf import settings
+
+INVALIDATION_CHANNEL = "cache:invalidate"
+RECONNECT_DELAY = 1.0
+SUBSCRIBE_TIMEOUT = 1.0  # seconds to wait for the listener, values are not cached locally before it
+
+
+@dataclass
+class LocalCacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0  # by the size limit
+    invalidations: int = 0  # by other processes
+
+
+class LocalCache:
+    """Thread-safe LRU with the size limit and TTL of each item."""
+
+    def __init__(self, size: int, ttl: float):
+        self.size = size
+        self.ttl = ttl
+        self.stats = LocalCacheStats()
+        self._items: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Any:
+        """Return the value or `None` if it is missing or expired."""
+
+        with self._lock:
+            item = self._items.get(key)
+
+            if item is None or item[0] < time.monotonic():
+                self._items.pop(key, None)
+                self.stats.misses += 1
+                return None
+
+            self._items.move_to_end(key)
+            self.stats.hits += 1
+            return item[1]
+
+    def set(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._items[key] = (time.monotonic() + self.ttl, value)
+            self._items.move_to_end(key)
+
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+                self.stats.evictions += 1
+
+    def delete(self, key: str, invalidation: bool = False) -> None:
+        with self._lock:
+            if self._items.pop(key, None) is not None and invalidation:
+                self.stats.invalidations += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+_lock = threading.Lock()
+_pid: int | None = None
+_token = ""  # id of the process, to skip own invalidation messages
+_tiers: dict[str, LocalCache] = {}
+_listener: threading.Thread | None = None
+_subscribed = threading.Event()
+
+
+def _reset_after_fork() -> None:
+    global _pid, _token, _listener, _subscribed
+
+    if _pid != os.getpid():
+        _pid = os.getpid()
+        _token = uuid.uuid4().hex
+        _tiers.clear()
+        _listener = None  # threads are not inherited by the forked process
+        _subscribed = threading.Event()
+
+
+def get_local_cache(namespace: str, client: redis.Redis) -> LocalCache | None:
+    """Return the local tier of the namespace, if it is configured."""
+
+    config: dict | None = getattr(settings, "CACHE_SERVICE_LOCAL_NAMESPACES", {}).get(namespace)
+    if config is None:
+        return None
+
+    with _lock:
+        _reset_after_fork()
+
+        if namespace not in _tiers:
+            _tiers[namespace] = LocalCache(size=config.get("size", 1000), ttl=config.get("ttl", 300))
+            _start_listener(client)
+
+        return _tiers[namespace]
+
+
+def invalidation_message(namespace: str, key: str) -> str:
+    return f"{_token}|{namespace}|{key}"
+
+
+def _start_listener(client: redis.Redis) -> None:
+    """Start the listener, or start it again if it stopped, and wait until it is subscribed."""
+
+    global _listener
+
+    if _listener is None or not _listener.is_alive():
+        _listener = threading.Thread(target=_listen, args=(client,), name="cache-invalidation", daemon=True)
+        _listener.start()
+
+    if not _subscribed.wait(SUBSCRIBE_TIMEOUT):
+        print("Cache invalidation listener is not subscribed yet")
+
+
+def _listen(client: redis.Redis) -> None:
+    while True:
+        pubsub = client.pubsub()
+
+        try:
+            pubsub.subscribe(INVALIDATION_CHANNEL)
+
+            for message in pubsub.listen():
+                if message["type"] == "subscribe":
+                    # values read before could miss invalidations
+                    _clear_tiers()
+                    _subscribed.set()
+                else:
+                    _invalidate(message["data"])
+        except redis.RedisError as error:
+            # invalidations could be lost while disconnected
+            print(f"Cache invalidation listener failed: {error}")
+            _subscribed.clear()
+            _clear_tiers()
+            time.sleep(RECONNECT_DELAY)
+        finally:
+            pubsub.close()
+
+
+def _invalidate(data: bytes) -> None:
+    try:
+        token, namespace, key = data.decode().split("|", 2)
+    except ValueError as error:
+        # a broken message must not stop invalidations of other keys
+        print(f"Cache invalidation {data!r} is skipped: {error!r}")
+        return
+
+    tier = _tiers.get(namespace)
+    if tier is not None and token != _token:
+        tier.delete(key, invalidation=True)
+
+
+def _clear_tiers() -> None:
+    for tier in list(_tiers.values()):
+        tier.clear()
+
+
+def local_stats() -> dict[str, dict]:
+    return {namespace: asdict(tier.stats) | {"size": len(tier)} for namespace, tier in _tiers.items()}
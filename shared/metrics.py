@@ -0,0 +1,39 @@
+"""
+Metrics of the process: HTTP pools, limits and breakers of providers, local cache tiers.
+
+Celery worker processes log them after tasks, at most once per `STATS_LOG_INTERVAL`
+(see `config.celery`). Stats of the web process are served to admins by `GET /food/stats/`.
+"""
+
+import json
+import os
+import time
+
+from .cache import CacheService
+from .http_clients import limit_stats, pool_stats, resilience_stats
+
+STATS_LOG_INTERVAL = 60.0  # seconds
+
+_logged_at: float | None = None
+
+
+def process_stats() -> dict[str, dict]:
+    return {
+        "pools": pool_stats(),
+        "limits": limit_stats(),
+        "resilience": resilience_stats(),
+        "local_cache": CacheService.local_stats(),
+    }
+
+
+def log_stats() -> None:
+    """Print stats of the process, if they were not printed for `STATS_LOG_INTERVAL` seconds."""
+
+    global _logged_at
+
+    now = time.monotonic()
+    if _logged_at is not None and now - _logged_at < STATS_LOG_INTERVAL:
+        return
+
+    _logged_at = now
+    print(f"Process {os.getpid()} stats: {json.dumps(process_stats())}")
@@ -0,0 +1,317 @@
+"""
+Circuit breakers, deadlines and retries of provider calls.
+
+A call has the `call_timeout` deadline, including retries: timeouts of each
+attempt are cut to the time left. Failed attempts (network errors, `5xx`) are
+retried with the full jitter exponential backoff, while the deadline and the
+retry budget allow it. The budget is earned by calls (`retry_ratio` retries
+per call, at most `retry_budget`), so retries can not multiply the load of a
+degraded provider. POST requests are retried only if they were not sent.
+
+The breaker is shared by all processes. It opens after `failure_threshold`
+failed calls in `failure_window` seconds, and calls fail fast with `CircuitOpen`
+for `open_timeout` seconds. Then one call probes the provider: its success
+closes the breaker, its failure opens it again.
+
+Options are configured with `settings.HTTP_PROVIDERS` (see `shared.http_clients`).
+
+REDIS STRUCTURE:
+    breakers:silpo:failures   STR  failed calls in the current window
+    breakers:silpo:open       STR  exists while calls fail fast
+    breakers:silpo:half_open  STR  exists until the probe succeeds
+    breakers:silpo:probe      STR  exists while the probe is in flight
+"""
+
+import asyncio
+import random
+import threading
+import time
+from dataclasses import dataclass
+
+import httpx
+import redis
+
+from .cache import get_redis_client
+from .limits import LimitExceeded
+
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+RETRY_STATUSES = frozenset({502, 503, 504})
+# the request is not sent, so retries do not duplicate it
+NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+PROBE_TIMEOUT = 30.0
+
+# KEYS: open, half_open, probe. Returns 1 if the call is allowed, 2 if it is the probe,
+# or milliseconds while calls fail fast, negative.
+ALLOW_SCRIPT = """
+local open = redis.call('PTTL', KEYS[1])
+if open > 0 then
+    return -open
+end
+if redis.call('EXISTS', KEYS[2]) == 0 then
+    return 1
+end
+if redis.call('SET', KEYS[3], 1, 'NX', 'PX', ARGV[1]) then
+    return 2
+end
+return -math.max(redis.call('PTTL', KEYS[3]), 1)
+"""
+
+# KEYS: failures, open, half_open, probe. ARGV: failed (0/1), probe (0/1), threshold, window (ms), open timeout (ms).
+# Returns 1 if the breaker is opened.
+RECORD_SCRIPT = """
+if ARGV[2] == '1' then
+    redis.call('DEL', KEYS[4])
+    if ARGV[1] == '0' then
+        redis.call('DEL', KEYS[1], KEYS[3])
+        return 0
+    end
+elseif ARGV[1] == '0' then
+    return 0
+else
+    local failures = redis.call('INCR', KEYS[1])
+    if failures == 1 then
+        redis.call('PEXPIRE', KEYS[1], ARGV[4])
+    end
+    if failures < tonumber(ARGV[3]) then
+        return 0
+    end
+end
+redis.call('DEL', KEYS[1])
+redis.call('SET', KEYS[2], 1, 'PX', ARGV[5])
+redis.call('SET', KEYS[3], 1)
+return 1
+"""
+
+
+class CircuitOpen(httpx.TransportError):
+    """The request is not sent: the provider is failing."""
+
+
+# the call did not reach the provider, so it may be repeated by another task
+CALL_NOT_SENT_ERRORS = (*NOT_SENT_ERRORS, LimitExceeded, CircuitOpen)
+
+
+@dataclass
+class ResilienceStats:
+    calls: int = 0
+    failures: int = 0
+    retries: int = 0
+    budget_exhausted: int = 0  # retries skipped by the budget
+    fast_failures: int = 0  # raised `CircuitOpen`
+    opened: int = 0  # breakers opened by this process
+
+
+class CircuitBreaker:
+    def __init__(self, provider: str, failure_threshold: int, failure_window: float, open_timeout: float):
+        self.provider = provider
+        self.failure_threshold = failure_threshold
+        self.failure_window = failure_window
+        self.open_timeout = open_timeout
+        self.redis = get_redis_client()
+        self._allow = self.redis.register_script(ALLOW_SCRIPT)
+        self._record = self.redis.register_script(RECORD_SCRIPT)
+        self._open_until = 0.0  # known in this process, so fast failures do not call Redis
+
+    def _keys(self) -> list[str]:
+        return [f"breakers:{self.provider}:{name}" for name in ("failures", "open", "half_open", "probe")]
+
+    def allow(self) -> bool:
+        """Return `True` if the call is the probe. Raise `CircuitOpen` if calls fail fast.
+
+        Calls are allowed while Redis is not available.
+        """
+
+        if time.monotonic() < self._open_until:
+            raise CircuitOpen(f"{self.provider} circuit is open")
+
+        try:
+            result = int(self._allow(keys=self._keys()[1:], args=[int(PROBE_TIMEOUT * 1000)]))
+        except redis.RedisError as error:
+            print(f"{self.provider} circuit is not checked: {error}")
+            return False
+
+        if result < 0:
+            self._open_until = time.monotonic() + -result / 1000
+            raise CircuitOpen(f"{self.provider} circuit is open")
+
+        return result == 2
+
+    def record(self, failed: bool, probe: bool) -> bool:
+        """Return `True` if the breaker is opened by this call."""
+
+        if not failed and not probe:
+            return False  # nothing to change
+
+        try:
+            opened = self._record(
+                keys=self._keys(),
+                args=[
+                    int(failed),
+                    int(probe),
+                    self.failure_threshold,
+                    int(self.failure_window * 1000),
+                    int(self.open_timeout * 1000),
+                ],
+            )
+        except redis.RedisError as error:
+            print(f"{self.provider} circuit is not updated: {error}")
+            return False
+
+        if opened:
+            self._open_until = time.monotonic() + self.open_timeout
+            print(f"{self.provider} circuit is opened for {self.open_timeout} seconds")
+
+        return bool(opened)
+
+    def release_probe(self) -> None:
+        """Let another call probe the provider, if the probe is not sent."""
+
+        try:
+            self.redis.delete(self._keys()[3])
+        except redis.RedisError as error:
+            print(f"{self.provider} circuit probe is not released: {error}")  # it expires in `PROBE_TIMEOUT`
+
+
+class RetryBudget:
+    """Retries earned by calls of this process."""
+
+    def __init__(self, ratio: float, limit: float):
+        self.ratio = ratio
+        self.limit = limit
+        self._tokens = limit
+        self._lock = threading.Lock()
+
+    def deposit(self) -> None:
+        with self._lock:
+            self._tokens = min(self.limit, self._tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        with self._lock:
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+class ProviderGuard:
+    """Decisions of pooled transports about each call of the provider."""
+
+    def __init__(
+        self,
+        provider: str,
+        call_timeout: float = 15.0,
+        retries: int = 2,
+        backoff: float = 0.1,
+        max_backoff: float = 2.0,
+        retry_ratio: float = 0.2,
+        retry_budget: float = 10,
+        failure_threshold: int = 5,
+        failure_window: float = 30.0,
+        open_timeout: float = 15.0,
+    ):
+        self.call_timeout = call_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.breaker = CircuitBreaker(provider, failure_threshold, failure_window, open_timeout)
+        self.budget = RetryBudget(retry_ratio, retry_budget)
+        self.stats = ResilienceStats()
+        self._lock = threading.Lock()
+
+    def start(self) -> tuple[float, bool]:
+        """Check the breaker before the call. Return its deadline and whether it is the probe."""
+
+        try:
+            probe = self.breaker.allow()
+        except CircuitOpen:
+            self._count("fast_failures")
+            raise
+
+        self._count("calls")
+        self.budget.deposit()
+        return time.monotonic() + self.call_timeout, probe
+
+    async def start_async(self) -> tuple[float, bool]:
+        """The same as `start`, with the breaker checked from a thread, so the event loop is not blocked."""
+
+        if time.monotonic() < self.breaker._open_until:
+            return self.start()  # fails fast without Redis
+
+        return await asyncio.to_thread(self.start)
+
+    @staticmethod
+    def limit_timeouts(request: httpx.Request, deadline: float) -> None:
+        """Cut timeouts of the attempt to the time left."""
+
+        left = max(deadline - time.monotonic(), 0.001)
+        timeouts: dict[str, float | None] = request.extensions.get("timeout", {})
+        request.extensions["timeout"] = {
+            name: min(value, left) if value is not None else left for name, value in timeouts.items()
+        }
+
+    def retry_delay(
+        self,
+        request: httpx.Request,
+        attempt: int,
+        deadline: float,
+        response: httpx.Response | None = None,
+        error: Exception | None = None,
+    ) -> float | None:
+        """Return the delay before the next attempt, or `None` if the result is final."""
+
+        if not self._retryable(request, response, error) or attempt >= self.retries:
+            return None
+
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2**attempt))
+        if time.monotonic() + delay >= deadline:
+            return None
+
+        if not self.budget.withdraw():
+            self._count("budget_exhausted")
+            return None
+
+        self._count("retries")
+        return delay
+
+    @staticmethod
+    def _retryable(request: httpx.Request, response: httpx.Response | None, error: Exception | None) -> bool:
+        if isinstance(error, LimitExceeded):
+            return False
+        if isinstance(error, NOT_SENT_ERRORS):
+            return True
+        if request.method not in IDEMPOTENT_METHODS:
+            return False
+        return error is not None or (response is not None and response.status_code in RETRY_STATUSES)
+
+    def finish(self, probe: bool, response: httpx.Response | None = None, error: Exception | None = None) -> None:
+        """Record the final result of the call in the breaker."""
+
+        if isinstance(error, LimitExceeded):
+            if probe:
+                self.breaker.release_probe()
+            return
+
+        failed = self._failed(response, error)
+        if failed:
+            self._count("failures")
+
+        if self.breaker.record(failed, probe):
+            self._count("opened")
+
+    async def finish_async(
+        self, probe: bool, response: httpx.Response | None = None, error: Exception | None = None
+    ) -> None:
+        """The same as `finish`, with the breaker updated from a thread if there is anything to record."""
+
+        if probe or self._failed(response, error):
+            await asyncio.to_thread(self.finish, probe, response, error)
+        else:
+            self.finish(probe, response, error)
+
+    @staticmethod
+    def _failed(response: httpx.Response | None, error: Exception | None) -> bool:
+        return error is not None or (response is not None and response.status_code >= 500)
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            setattr(self.stats, name, getattr(self.stats, name) + 1)
@@ -74,7 +74,7 @@ class UsersAPIViewSet(viewsets.GenericViewSet):
         activation_service.save_activation_information(
             user_id=getattr(serializer.instance, "id"), activation_key=activation_key
         )
-        send_user_activation_email.delay(email=email, activation_key=activation_key)
+        send_user_activation_email.delay(email=email, activation_key=str(activation_key))
 
         return Response(UserSerializer(serializer.instance).data, status=201)
 
@@ -119,7 +119,7 @@ class UsersAPIViewSet(viewsets.GenericViewSet):
         activation_service = ActivationService()
         activation_key = activation_service.create_activation_key()
         activation_service.save_activation_information(user_id=user.id, activation_key=activation_key)
-        send_user_activation_email.delay(email=email, activation_key=activation_key)
+        send_user_activation_email.delay(email=email, activation_key=str(activation_key))
 
         return Response({"message": "Activation email sent"}, status=200)
 